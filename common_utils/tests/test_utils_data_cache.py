@@ -0,0 +1,162 @@
+import pytest
+import numpy as np
+import pandas as pd
+import sys
+from pathlib import Path
+from datetime import datetime
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_COMMON_UTILS = PATH_ROOT / 'common_utils'
+    if not PATH_COMMON_UTILS.exists():
+        raise ValueError("The 'common_utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_COMMON_UTILS))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from utils_data_store import get_views_df_path, load_views_df
+from utils_data_cache import DataCache, get_queryset_fingerprint
+
+
+class MockQueryset:
+    """
+    Minimal stand-in for a viewser Queryset, which is a pydantic model.
+    """
+    def __init__(self, name, loa, operations):
+        self.name = name
+        self.loa = loa
+        self.operations = operations
+
+    def model_dump(self, mode="python"):
+        return {"name": self.name, "loa": self.loa, "operations": self.operations}
+
+
+@pytest.fixture
+def mock_views_df():
+    """
+    Fixture to create a mock viewser DataFrame with 4 months, 3 grid cells and 2 features.
+    """
+    index = pd.MultiIndex.from_product([[121, 122, 123, 124], [1, 2, 3]], names=["month_id", "priogrid_gid"])
+    data = {
+        "ln_sb_best": np.arange(12, dtype=np.float64),
+        "ln_ns_best": np.arange(12, dtype=np.float64) * 2,
+    }
+    return pd.DataFrame(data, index=index)
+
+
+def test_get_queryset_fingerprint():
+    """
+    Test that the fingerprint ignores the queryset name but not the definition.
+    """
+    qs_a = MockQueryset("model_a", "priogrid_month", [["ged_sb", "ln"]])
+    qs_b = MockQueryset("model_b", "priogrid_month", [["ged_sb", "ln"]])
+    qs_c = MockQueryset("model_a", "priogrid_month", [["ged_ns", "ln"]])
+
+    assert get_queryset_fingerprint(qs_a) == get_queryset_fingerprint(qs_b)
+    assert get_queryset_fingerprint(qs_a) != get_queryset_fingerprint(qs_c)
+
+
+def test_get_queryset_fingerprint_requires_canonical_serialisation():
+    """
+    Test that a queryset without a canonical serialisation, or with values that only have a repr, is not fingerprinted.
+    """
+    class PlainQueryset:
+        def __init__(self):
+            self.loa = "priogrid_month"
+
+    with pytest.raises(TypeError):
+        get_queryset_fingerprint(PlainQueryset())
+
+    with pytest.raises(TypeError):
+        get_queryset_fingerprint(MockQueryset("model_a", "priogrid_month", [object()]))
+
+
+def test_put_and_get(tmp_path, mock_views_df):
+    """
+    Test that cached data is returned for the same and for a shorter month range with the same first month,
+    and that a column projection can be requested.
+    """
+    cache = DataCache(tmp_path / "cache")
+    cache.put("abc", 121, 125, mock_views_df)
+
+    pd.testing.assert_frame_equal(cache.get("abc", 121, 125), mock_views_df)
+    pd.testing.assert_frame_equal(cache.get("abc", 121, 123, columns=["ln_ns_best"]),
+                                  mock_views_df.loc[[121, 122], ["ln_ns_best"]])
+
+    assert cache.get("abc", 122, 125) is None
+    assert cache.get("abc", 121, 126) is None
+    assert cache.get("def", 121, 125) is None
+
+
+def test_export_links_cache_file(tmp_path, mock_views_df):
+    """
+    Test that an exact-range entry is hard linked into the model directory and a shorter range is written out.
+    """
+    cache = DataCache(tmp_path / "cache")
+    key = cache.put("abc", 121, 125, mock_views_df)
+    path_raw = tmp_path / "raw"
+    path_raw.mkdir()
+
+    assert cache.export("abc", 121, 125, path_raw, "testing")
+    assert get_views_df_path(path_raw, "testing").samefile(get_views_df_path(cache.cache_dir, key))
+
+    assert cache.export("abc", 121, 123, path_raw, "calibration")
+    pd.testing.assert_frame_equal(load_views_df(path_raw, "calibration"), mock_views_df.loc[[121, 122]])
+
+    assert not cache.export("abc", 121, 126, path_raw, "forecasting")
+
+
+def test_evict_least_recently_used(tmp_path, mock_views_df):
+    """
+    Test that the least recently used entries are evicted when the cache exceeds its limits.
+    """
+    cache = DataCache(tmp_path / "cache", max_entries=2)
+    key_a = cache.put("a", 121, 125, mock_views_df)
+    key_b = cache.put("b", 121, 125, mock_views_df)
+    cache.get("a", 121, 125)
+    key_c = cache.put("c", 121, 125, mock_views_df)
+
+    assert cache.lookup("b", 121, 125) is None
+    assert not get_views_df_path(cache.cache_dir, key_b).exists()
+    assert cache.lookup("a", 121, 125) == key_a
+    assert cache.lookup("c", 121, 125) == key_c
+
+    cache.max_size_gb = 0
+    cache.evict(keep=key_c)
+    assert cache.lookup("a", 121, 125) is None
+    assert cache.lookup("c", 121, 125) == key_c
+
+
+def test_get_fetch_timestamp(tmp_path, mock_views_df):
+    """
+    Test that an entry keeps the time it was fetched, in the format of the data fetch logs.
+    """
+    cache = DataCache(tmp_path / "cache")
+    key = cache.put("abc", 121, 125, mock_views_df)
+    fetch_timestamp = cache.get_fetch_timestamp(key)
+
+    cache.get("abc", 121, 125)
+    assert cache.get_fetch_timestamp(key) == fetch_timestamp
+    assert datetime.strptime(fetch_timestamp, "%Y%m%d_%H%M%S")
+
+
+def test_evict_skips_linked_entries(tmp_path, mock_views_df):
+    """
+    Test that an entry still linked from a model directory does not count towards the size limit and is not evicted for it.
+    """
+    cache = DataCache(tmp_path / "cache")
+    key_a = cache.put("a", 121, 125, mock_views_df)
+    key_b = cache.put("b", 121, 125, mock_views_df)
+    path_raw = tmp_path / "raw"
+    path_raw.mkdir()
+    cache.export("a", 121, 125, path_raw, "testing")
+    cache.get("b", 121, 125)
+
+    cache.max_size_gb = 0
+    assert cache.evict() == [key_b]
+    assert cache.lookup("a", 121, 125) == key_a
+
+    cache.max_entries = 0
+    assert cache.evict() == [key_a]
+    assert get_views_df_path(path_raw, "testing").exists()
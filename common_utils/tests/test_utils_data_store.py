@@ -0,0 +1,180 @@
+import pytest
+import numpy as np
+import pandas as pd
+import sys
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_COMMON_UTILS = PATH_ROOT / 'common_utils'
+    if not PATH_COMMON_UTILS.exists():
+        raise ValueError("The 'common_utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_COMMON_UTILS))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from utils_data_store import (get_views_df_path, save_views_df, load_views_df, get_stored_month_range,
+                              get_revised_months, append_views_df, slice_views_df_by_month_range,
+                              to_compact_views_df, to_default_views_df, compact_views_df_equivalence_test)
+
+
+@pytest.fixture
+def mock_views_df():
+    """
+    Fixture to create a mock viewser DataFrame with a (month_id, priogrid_gid) MultiIndex.
+
+    Returns:
+        pd.DataFrame: A DataFrame with 3 months, 4 grid cells and 3 float64 features.
+    """
+    index = pd.MultiIndex.from_product([[121, 122, 123], [1, 2, 3, 4]], names=["month_id", "priogrid_gid"])
+    data = {
+        "ln_sb_best": np.arange(12, dtype=np.float64),
+        "ln_ns_best": np.arange(12, dtype=np.float64) * 2,
+        "ln_os_best": np.arange(12, dtype=np.float64) * 3,
+    }
+    return pd.DataFrame(data, index=index)
+
+
+def test_save_and_load_views_df(tmp_path, mock_views_df):
+    """
+    Test that a DataFrame saved with save_views_df is loaded back unchanged, including the MultiIndex.
+    """
+    path = save_views_df(mock_views_df, tmp_path, "calibration")
+    assert path == get_views_df_path(tmp_path, "calibration")
+    assert path.exists()
+
+    df = load_views_df(tmp_path, "calibration")
+    pd.testing.assert_frame_equal(df, mock_views_df)
+    assert df.index.names == ["month_id", "priogrid_gid"]
+
+
+def test_load_views_df_columns_and_months(tmp_path, mock_views_df):
+    """
+    Test that only the requested columns and months [month_first, month_last) are loaded.
+    """
+    save_views_df(mock_views_df, tmp_path, "testing")
+
+    df = load_views_df(tmp_path, "testing", columns=["ln_ns_best"], month_first=122, month_last=123)
+    expected = mock_views_df.loc[[122], ["ln_ns_best"]]
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_load_views_df_unsorted_months(tmp_path, mock_views_df):
+    """
+    Test that the month range is also selected correctly when the data is not sorted by month.
+    """
+    df_unsorted = mock_views_df.sort_index(level="priogrid_gid")
+    save_views_df(df_unsorted, tmp_path, "testing")
+
+    df = load_views_df(tmp_path, "testing", month_first=123)
+    assert set(df.index.get_level_values("month_id")) == {123}
+    assert len(df) == 4
+
+
+def test_load_views_df_missing_column(tmp_path, mock_views_df):
+    """
+    Test that requesting a column that is not in the file raises a KeyError.
+    """
+    save_views_df(mock_views_df, tmp_path, "calibration")
+    with pytest.raises(KeyError):
+        load_views_df(tmp_path, "calibration", columns=["not_a_column"])
+
+
+def test_load_views_df_legacy_pickle(tmp_path, mock_views_df):
+    """
+    Test that an old {partition}_viewser_df.pkl is read when no Feather file exists.
+    """
+    mock_views_df.to_pickle(get_views_df_path(tmp_path, "forecasting", legacy=True))
+
+    df = load_views_df(tmp_path, "forecasting", columns=["ln_sb_best"], month_last=122)
+    pd.testing.assert_frame_equal(df, mock_views_df.loc[[121], ["ln_sb_best"]])
+
+
+def test_load_views_df_not_found(tmp_path):
+    """
+    Test that a FileNotFoundError is raised when no saved data exists.
+    """
+    with pytest.raises(FileNotFoundError):
+        load_views_df(tmp_path, "calibration")
+
+
+def test_get_stored_month_range(tmp_path, mock_views_df):
+    """
+    Test that the first and last (inclusive) saved months are returned, and None when nothing is saved.
+    """
+    assert get_stored_month_range(tmp_path, "forecasting") is None
+
+    save_views_df(mock_views_df, tmp_path, "forecasting")
+    assert get_stored_month_range(tmp_path, "forecasting") == (121, 123)
+
+
+def test_get_revised_months(mock_views_df):
+    """
+    Test that only the months whose values or rows differ are reported as revised.
+    """
+    df_new = mock_views_df.copy()
+    df_new.loc[(122, 3), "ln_sb_best"] = 100.0
+    assert get_revised_months(mock_views_df, df_new, 121, 123) == [122]
+
+    df_new = mock_views_df.drop(index=(123, 4))
+    assert get_revised_months(mock_views_df, df_new, 121, 123) == [123]
+
+    with pytest.raises(ValueError):
+        get_revised_months(mock_views_df, mock_views_df[["ln_sb_best"]], 121, 123)
+
+
+def test_append_views_df(mock_views_df):
+    """
+    Test that newly fetched months replace the overlapping saved months and are appended in month order.
+    """
+    df_held = mock_views_df.loc[[121, 122]]
+    df_new = mock_views_df.loc[[122, 123]] + 1
+
+    df = append_views_df(df_held, df_new)
+
+    assert list(df.index.get_level_values("month_id").unique()) == [121, 122, 123]
+    pd.testing.assert_frame_equal(df.loc[[121]], mock_views_df.loc[[121]])
+    pd.testing.assert_frame_equal(df.loc[[122, 123]], df_new)
+
+
+def test_slice_views_df_by_month_range(mock_views_df):
+    """
+    Test that month ranges are sliced from sorted and unsorted DataFrames alike.
+    """
+    pd.testing.assert_frame_equal(slice_views_df_by_month_range(mock_views_df, 122, 124), mock_views_df.loc[[122, 123]])
+    pd.testing.assert_frame_equal(slice_views_df_by_month_range(mock_views_df, month_last=122), mock_views_df.loc[[121]])
+
+    df_unsorted = mock_views_df.sort_index(level="priogrid_gid")
+    df = slice_views_df_by_month_range(df_unsorted, 123)
+    assert set(df.index.get_level_values("month_id")) == {123}
+
+
+def test_compact_views_df(tmp_path, mock_views_df):
+    """
+    Test that the compact dtype mode uses float32 features and int32 index levels, survives a save/load roundtrip,
+    and converts back to the default dtype mode unchanged.
+    """
+    df_compact = to_compact_views_df(mock_views_df)
+
+    assert set(df_compact.dtypes) == {np.dtype(np.float32)}
+    assert all(level.dtype == np.int32 for level in df_compact.index.levels)
+    assert mock_views_df["ln_sb_best"].dtype == np.float64  # the input is not modified
+
+    save_views_df(df_compact, tmp_path, "testing")
+    pd.testing.assert_frame_equal(load_views_df(tmp_path, "testing"), df_compact)
+
+    pd.testing.assert_frame_equal(to_default_views_df(df_compact), mock_views_df)
+
+
+def test_compact_views_df_equivalence_test(mock_views_df):
+    """
+    Test that the equivalence check passes for ordinary features and fails when float32 loses too much precision.
+    """
+    max_abs_diff = compact_views_df_equivalence_test(mock_views_df)
+    assert set(max_abs_diff) == set(mock_views_df.columns)
+
+    df = mock_views_df.copy()
+    df.iloc[0, 0] = 1e8 + 1  # not representable in float32
+    with pytest.raises(ValueError):
+        compact_views_df_equivalence_test(df, rtol=0, atol=0.5)
@@ -0,0 +1,56 @@
+import pytest
+import numpy as np
+import pandas as pd
+import sys
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_COMMON_UTILS = PATH_ROOT / 'common_utils'
+    if not PATH_COMMON_UTILS.exists():
+        raise ValueError("The 'common_utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_COMMON_UTILS))
+    sys.path.insert(0, str(PATH_ROOT))  # for common_configs
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from utils_data_store import save_views_df
+from utils_dataloaders import create_or_load_views_vol
+
+
+@pytest.fixture
+def sparse_views_df():
+    """
+    Fixture to create a mock viewser DataFrame whose cells only cover a 3x2 corner of the grid in 2 months.
+    """
+    data = {
+        "pg_id": [1, 2, 3, 4],
+        "col": [10, 11, 10, 11],
+        "row": [20, 20, 22, 22],
+        "month_id": [121, 121, 122, 122],
+        "c_id": [1, 1, 1, 1],
+        "ln_sb_best": [0.1, 0.2, 0.3, 0.4],
+        "ln_ns_best": [0.2, 0.3, 0.4, 0.5],
+        "ln_os_best": [0.3, 0.4, 0.5, 0.6],
+    }
+    return pd.DataFrame(data)
+
+
+def test_create_or_load_views_vol_sparse_frame(tmp_path, sparse_views_df):
+    """
+    Test that a DataFrame that does not span the whole grid still gives a 180x180 volume, with the southernmost row
+    of the data in the bottom row of the volume, and that the saved volume is loaded on the next call.
+    """
+    path_raw, path_processed = tmp_path / "raw", tmp_path / "processed"
+    path_raw.mkdir()
+    save_views_df(sparse_views_df, path_raw, "calibration")
+
+    vol = create_or_load_views_vol("calibration", path_processed, path_raw)
+    assert vol.shape == (2, 180, 180, 8)
+
+    # row 20 is the first row of the grid, so it is the last row of the north-up volume
+    assert vol[0, 179, 0, 0] == 1
+    assert vol[1, 177, 1, 0] == 4
+
+    np.testing.assert_array_equal(create_or_load_views_vol("calibration", path_processed, path_raw), vol)
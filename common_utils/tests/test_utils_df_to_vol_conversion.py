@@ -18,8 +18,10 @@ else:
 from utils_df_to_vol_conversion import (
     get_requried_columns_for_vol,
     calculate_absolute_indices,
+    get_vol_shape,
     df_to_vol,
     vol_to_df,
+    load_vol,
     df_vol_conversion_test,
     plot_vol,
 )
@@ -124,10 +126,80 @@ def test_df_to_vol(mock_df):
         AssertionError: If the output is not a numpy array or if the shape of the array
                         is not as expected.
     """
-    vol = df_to_vol(mock_df)
+    vol = df_to_vol(mock_df, height=180, width=180)
     assert isinstance(vol, np.ndarray)
     assert vol.shape == (2, 180, 180, 8)
 
+    # Without height and width the grid bounds are inferred from the data
+    vol = df_to_vol(mock_df)
+    assert vol.shape == (2, 4, 4, 8)
+
+
+def test_df_to_vol_layout(mock_df):
+    """
+    Test that df_to_vol places every row at its month, north-up row and column in the volume,
+    matching the original fill-flip-transpose construction, and does not modify the input DataFrame.
+
+    Args:
+        mock_df (pd.DataFrame): A mock DataFrame with predefined data.
+    """
+    df_original = mock_df.copy()
+    vol = df_to_vol(mock_df, height=6, width=5, dtype=np.float32)
+
+    pd.testing.assert_frame_equal(mock_df, df_original)
+    assert vol.dtype == np.float32
+
+    vol_features = get_requried_columns_for_vol() + ["ln_sb_best", "ln_ns_best", "ln_os_best"]
+    df_abs = calculate_absolute_indices(mock_df)
+    vol_reference = np.zeros([6, 5, 2, len(vol_features)])
+    for i, feature in enumerate(vol_features):
+        vol_reference[df_abs["abs_row"], df_abs["abs_col"], df_abs["abs_month"], i] = df_abs[feature]
+    vol_reference = np.transpose(np.flip(vol_reference, axis=0), (2, 0, 1, 3))
+
+    np.testing.assert_array_equal(vol, vol_reference.astype(np.float32))
+
+
+def test_df_to_vol_out(tmp_path, mock_df):
+    """
+    Test that df_to_vol writes into a preallocated memory-mapped array, and rejects one of the wrong shape.
+
+    Args:
+        mock_df (pd.DataFrame): A mock DataFrame with predefined data.
+    """
+    shape = get_vol_shape(mock_df)
+    out = np.lib.format.open_memmap(tmp_path / "vol.npy", mode="w+", dtype=np.float64, shape=shape)
+    vol = df_to_vol(mock_df, out=out)
+    assert vol is out
+    out.flush()
+    np.testing.assert_array_equal(np.load(tmp_path / "vol.npy"), df_to_vol(mock_df))
+
+    with pytest.raises(ValueError):
+        df_to_vol(mock_df, out=np.zeros((1, 1, 1, 1)))
+
+
+def test_load_vol(tmp_path, mock_vol):
+    """
+    Test that load_vol memory-maps the volume, converting it to float32 through a sidecar file,
+    and that changes to the copy-on-write array are not written back to disk.
+
+    Args:
+        mock_vol (np.ndarray): A mock 4D numpy array with random values.
+    """
+    path_vol = tmp_path / "testing_vol.npy"
+    np.save(path_vol, mock_vol)
+
+    vol = load_vol(path_vol)
+    assert isinstance(vol, np.memmap)
+    assert vol.dtype == np.float32
+    assert (tmp_path / "testing_vol_float32.npy").exists()
+    np.testing.assert_array_equal(vol, mock_vol.astype(np.float32))
+
+    vol[0, 0, 0, 0] = -1
+    assert load_vol(path_vol)[0, 0, 0, 0] == np.float32(mock_vol[0, 0, 0, 0])
+
+    vol = load_vol(path_vol, dtype=None, mmap_mode="r")
+    assert vol.dtype == np.float64
+
 
 def test_vol_to_df(mock_vol):
     """
@@ -81,6 +81,43 @@ def parse_args():
         "-o", "--override_month", help="Over-ride use of current month", type=int
     )
 
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Flag to only fetch the months missing from the locally saved data (plus a small overlap window "
+        "to catch revised months) instead of the full partition. Mainly useful for the monthly forecasting run.",
+    )
+
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Flag to use the raw data cache shared by all models. Data already fetched by a model with the same queryset "
+        "is taken from the cache instead of viewser, and fetched data is added to the cache.",
+    )
+
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Flag to store the fetched data in the compact dtype mode (float32 features, int32 index levels), "
+        "which halves its memory and disk use.",
+    )
+
+    parser.add_argument(
+        "--inference_backend",
+        choices=["eager", "torchscript", "compile", "onnx"],
+        type=str,
+        help="Choose how a model artifact is run in evaluation and forecasting: eager (the python model), torchscript, compile (torch.compile) or onnx (onnxruntime on CPU). "
+        "The exported graphs are cached next to the artifact. If not provided, the model config decides (only used by models that support it).",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Flag to continue an interrupted training from its last checkpoint (saved every checkpoint_every samples by models that support it). "
+        "If there is no checkpoint, the training starts from scratch. Can only be used with --train.",
+    )
+
     return parser.parse_args()
 
 
@@ -129,6 +166,26 @@ def validate_arguments(args):
         )
         sys.exit(1)
 
+    if args.compact and args.saved:
+        print("Error: --compact is applied when fetching data and cannot be used with --saved. Exiting.")
+        print("To fix: Remove --compact. Saved data is loaded in the dtype mode it was saved in.")
+        sys.exit(1)
+
+    if args.cache and args.saved:
+        print("Error: --cache is used when fetching data and cannot be used with --saved. Exiting.")
+        print("To fix: Remove either --cache or --saved.")
+        sys.exit(1)
+
+    if args.incremental and args.saved:
+        print("Error: --incremental fetches new data and cannot be used with --saved. Exiting.")
+        print("To fix: Remove either --incremental or --saved.")
+        sys.exit(1)
+
+    if args.resume and (not args.train or args.sweep):
+        print("Error: --resume continues a training and can only be used with --train, not with --sweep. Exiting.")
+        print("To fix: Add --train, or remove --resume.")
+        sys.exit(1)
+
     if not args.train and not args.saved:
         # if not training, then we need to use saved data
         print(
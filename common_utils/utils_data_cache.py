@@ -0,0 +1,357 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+from utils_data_store import get_views_df_path, save_views_df, load_views_df, get_stored_month_range
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE_GB = 50
+CACHE_DIR_NAME = '.data_cache'
+INDEX_FILE_NAME = 'index.json'
+
+
+def get_queryset_fingerprint(queryset):
+    """
+    Returns a hash of the definition of a viewser queryset.
+
+    The hash only depends on what the queryset fetches (the level of analysis and the column definitions
+    with their transforms), not on its name or description. Models whose querysets are published under
+    different names but define the same data therefore share the same cache entries.
+
+    Only the canonical serialisation of the queryset (the pydantic model dump of the viewser Queryset) is hashed.
+    Object reprs are never used, since they can contain memory addresses and would give a new fingerprint on every run.
+
+    Args:
+        queryset (viewser.Queryset): The queryset, as returned by ModelPath.get_queryset().
+
+    Returns:
+        str: The sha256 hex digest of the queryset definition.
+
+    Raises:
+        TypeError: If the queryset has no canonical serialisation, or it holds values that are not JSON serialisable.
+    """
+
+    if hasattr(queryset, 'model_dump'):
+        definition = queryset.model_dump(mode='json')
+    elif hasattr(queryset, 'dict'):
+        definition = json.loads(queryset.json())  # pydantic v1
+    else:
+        raise TypeError(f'Cannot fingerprint a queryset of type {type(queryset).__name__}: it has no canonical serialisation (model_dump)')
+
+    definition = {k: v for k, v in definition.items() if k not in ('name', 'description', 'themes')}
+    definition_json = json.dumps(definition, sort_keys=True)  # no default=str: a value without a JSON form raises instead of hashing its repr
+
+    return hashlib.sha256(definition_json.encode()).hexdigest()
+
+
+class DataCache:
+    """
+    A content-addressed cache of raw viewser data shared by all models in the pipeline.
+
+    Entries are keyed by the fingerprint of the queryset definition (see get_queryset_fingerprint) and the month
+    range [month_first, month_last) and stored in the Feather format of utils_data_store.py, so a model can load
+    only the columns it needs from an entry. An entry also serves requests for a shorter range with the same first
+    month, e.g. the calibration partition from a testing partition entry.
+
+    When an entry is handed to a model with export(), the model's {partition}_viewser_df.feather is created as a
+    hard link to the cache file where possible, so the data is only stored once on disk.
+
+    The total size of the cache is capped: when an entry is added, the least recently used entries are evicted
+    until the cache fits within max_size_gb (and max_entries, if set). Exports are linked rather than copied, so
+    a cache file that is still linked from a model directory takes no disk space of its own: removing it would
+    free nothing. The size limit therefore only counts, and only evicts, the files with a link count of 1, i.e.
+    the data held by the cache alone. Linked entries are still evicted if the cache exceeds max_entries.
+
+    Attributes:
+        cache_dir (Path): The directory holding the cache files and the index.
+        max_size_gb (float): The maximum total size of the cached files in GB.
+        max_entries (int or None): The maximum number of entries, or None for no limit.
+    """
+
+    def __init__(self, cache_dir=None, max_size_gb=DEFAULT_MAX_SIZE_GB, max_entries=None):
+        """
+        Initializes the DataCache.
+
+        Args:
+            cache_dir (str or Path, optional): The cache directory. Defaults to '.data_cache' in the project root.
+            max_size_gb (float, optional): The maximum total size of the cache in GB. Defaults to DEFAULT_MAX_SIZE_GB.
+            max_entries (int, optional): The maximum number of entries. Defaults to None (no limit).
+        """
+
+        if cache_dir is None:
+            from model_path import ModelPath  # only needed for the default location
+            cache_dir = ModelPath.get_root() / CACHE_DIR_NAME
+
+        self.cache_dir = Path(cache_dir)
+        self.max_size_gb = max_size_gb
+        self.max_entries = max_entries
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_entry_key(fingerprint, month_first, month_last):
+        """
+        Returns the key of the cache entry for a queryset fingerprint and month range.
+        """
+
+        return f'{fingerprint[:16]}_{month_first}_{month_last}'
+
+    def _load_index(self):
+        """
+        Reads the index of cache entries, dropping entries whose files have been removed.
+        """
+
+        path_index = self.cache_dir / INDEX_FILE_NAME
+
+        if not path_index.exists():
+            return {}
+
+        with open(path_index, 'r') as f:
+            index = json.load(f)
+
+        return {key: entry for key, entry in index.items() if get_views_df_path(self.cache_dir, key).exists()}
+
+    def _save_index(self, index):
+        """
+        Writes the index of cache entries, via a temporary file so a concurrent reader never sees a partial index.
+        """
+
+        path_index = self.cache_dir / INDEX_FILE_NAME
+        path_tmp = path_index.with_suffix('.json.tmp')
+
+        with open(path_tmp, 'w') as f:
+            json.dump(index, f, indent=2)
+
+        os.replace(path_tmp, path_index)
+
+    def lookup(self, fingerprint, month_first, month_last):
+        """
+        Finds the cache entry that can serve a queryset fingerprint and month range.
+
+        An entry with the exact range is preferred. Otherwise the smallest entry with the same first month and a
+        later last month is used.
+
+        Args:
+            fingerprint (str): The queryset fingerprint.
+            month_first (int): The first month ID.
+            month_last (int): The first month ID after the range (exclusive), as returned by get_month_range.
+
+        Returns:
+            str or None: The key of the entry, or None if no entry covers the range.
+        """
+
+        index = self._load_index()
+
+        candidates = [(entry['month_last'], key) for key, entry in index.items()
+                      if entry['fingerprint'] == fingerprint
+                      and entry['month_first'] == month_first
+                      and entry['month_last'] >= month_last]
+
+        if not candidates:
+            return None
+
+        return min(candidates)[1]
+
+    def get_fetch_timestamp(self, key):
+        """
+        Returns when the data of an entry was fetched from viewser, in the %Y%m%d_%H%M%S format of the data fetch logs.
+
+        Entries added before the fetch time was recorded fall back to the modification time of the cache file.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            str: The fetch timestamp.
+        """
+
+        entry = self._load_index()[key]
+
+        if 'fetch_timestamp' in entry:
+            return entry['fetch_timestamp']
+
+        return time.strftime('%Y%m%d_%H%M%S', time.localtime(get_views_df_path(self.cache_dir, key).stat().st_mtime))
+
+    def _touch(self, key):
+        """
+        Marks an entry as used, for the least-recently-used eviction.
+        """
+
+        index = self._load_index()
+        index[key]['last_access'] = time.time()
+        self._save_index(index)
+
+    def get(self, fingerprint, month_first, month_last, columns=None):
+        """
+        Loads data from the cache.
+
+        Args:
+            fingerprint (str): The queryset fingerprint.
+            month_first (int): The first month ID.
+            month_last (int): The first month ID after the range (exclusive).
+            columns (list of str, optional): The columns to load. Defaults to None, which loads all columns.
+
+        Returns:
+            pd.DataFrame or None: The cached data for the range, or None if it is not cached.
+        """
+
+        key = self.lookup(fingerprint, month_first, month_last)
+
+        if key is None:
+            logger.info(f'No cached data found for queryset {fingerprint[:16]} and months {month_first}-{month_last - 1}')
+            return None
+
+        logger.info(f'Loading cached data {key} for months {month_first}-{month_last - 1}')
+        self._touch(key)
+
+        return load_views_df(self.cache_dir, key, columns=columns, month_first=month_first, month_last=month_last)
+
+    def put(self, fingerprint, month_first, month_last, df):
+        """
+        Adds data to the cache and evicts the least recently used entries if the cache exceeds its size limits.
+
+        Args:
+            fingerprint (str): The queryset fingerprint.
+            month_first (int): The first month ID of the data.
+            month_last (int): The first month ID after the range of the data (exclusive).
+            df (pd.DataFrame): The data fetched from viewser.
+
+        Returns:
+            str: The key of the entry.
+        """
+
+        key = self.get_entry_key(fingerprint, month_first, month_last)
+        path_entry = save_views_df(df, self.cache_dir, key)
+
+        index = self._load_index()
+        index[key] = {
+            'fingerprint': fingerprint,
+            'month_first': int(month_first),
+            'month_last': int(month_last),
+            'columns': list(df.columns),
+            'size': path_entry.stat().st_size,
+            'last_access': time.time(),
+            'fetch_timestamp': time.strftime('%Y%m%d_%H%M%S'),  # when the data was fetched from viewser, for the data fetch log of a cache hit
+        }
+        self._save_index(index)
+
+        self.evict(keep=key)
+
+        return key
+
+    def export(self, fingerprint, month_first, month_last, PATH_RAW, partition):
+        """
+        Places cached data in a model's raw data directory as {partition}_viewser_df.feather.
+
+        If the entry has exactly the requested range, the file is hard linked to the cache file (or copied if the
+        cache and the model directory are on different file systems). Otherwise the requested months are written
+        to a new file.
+
+        Args:
+            fingerprint (str): The queryset fingerprint.
+            month_first (int): The first month ID.
+            month_last (int): The first month ID after the range (exclusive).
+            PATH_RAW (str or Path): The path to the model-specific directory where raw data is stored.
+            partition (str): The partition ('calibration', 'testing' or 'forecasting').
+
+        Returns:
+            bool: True if the data was exported, False if it is not cached.
+        """
+
+        key = self.lookup(fingerprint, month_first, month_last)
+
+        if key is None:
+            return False
+
+        self._touch(key)
+        path_entry = get_views_df_path(self.cache_dir, key)
+
+        if get_stored_month_range(self.cache_dir, key) != (month_first, month_last - 1):
+            save_views_df(load_views_df(self.cache_dir, key, month_first=month_first, month_last=month_last),
+                          PATH_RAW, partition)
+            return True
+
+        path_viewser_df = get_views_df_path(PATH_RAW, partition)
+        path_tmp = path_viewser_df.with_suffix('.feather.tmp')
+
+        if path_tmp.exists():
+            path_tmp.unlink()
+
+        try:
+            os.link(path_entry, path_tmp)
+        except OSError:
+            shutil.copyfile(path_entry, path_tmp)
+
+        # save_views_df always replaces the file rather than writing into it, so the link never modifies the cache
+        os.replace(path_tmp, path_viewser_df)
+        logger.info(f'Linked cached data {key} to {path_viewser_df}')
+
+        return True
+
+    def _get_disk_size(self, key):
+        """
+        Returns the disk space that removing an entry would free: the file size if the cache holds the only link
+        to the file, and 0 if it is also linked from a model directory (see export).
+        """
+
+        stat = get_views_df_path(self.cache_dir, key).stat()
+
+        return stat.st_size if stat.st_nlink == 1 else 0
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache fits within max_size_gb and max_entries.
+
+        Only files held by the cache alone count towards max_size_gb (see _get_disk_size).
+
+        Args:
+            keep (str, optional): The key of an entry that is never evicted, e.g. the one just added.
+
+        Returns:
+            list of str: The keys of the evicted entries.
+        """
+
+        index = self._load_index()
+        max_size = self.max_size_gb * 1024 ** 3
+
+        sizes = {key: self._get_disk_size(key) for key in index}
+        total_size = sum(sizes.values())
+        evicted = []
+
+        for key in sorted(index, key=lambda k: index[k]['last_access']):
+            n_entries = len(index) - len(evicted)
+            within_entries = self.max_entries is None or n_entries <= self.max_entries
+            within_size = total_size <= max_size
+
+            if within_size and within_entries:
+                break
+
+            # a file still linked from a model directory frees no disk space, so it is only evicted to meet max_entries
+            if key == keep or (within_entries and sizes[key] == 0):
+                continue
+
+            get_views_df_path(self.cache_dir, key).unlink()
+            total_size -= sizes[key]
+            evicted.append(key)
+            logger.info(f'Evicted cached data {key}')
+
+        for key in evicted:
+            del index[key]
+
+        self._save_index(index)
+
+        return evicted
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+
+        for key in self._load_index():
+            get_views_df_path(self.cache_dir, key).unlink()
+
+        self._save_index({})
@@ -0,0 +1,445 @@
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+
+def get_views_df_path(PATH_RAW, partition, legacy=False):
+    """
+    Returns the path of the raw viewser data file for a given partition.
+
+    Args:
+        PATH_RAW (str or Path): The path to the model-specific directory where raw data is stored.
+        partition (str): The partition ('calibration', 'testing' or 'forecasting').
+        legacy (bool, optional): If True, the path of the old pickle file is returned instead. Defaults to False.
+
+    Returns:
+        Path: The path to the {partition}_viewser_df.feather (or .pkl) file.
+    """
+
+    extension = 'pkl' if legacy else 'feather'
+
+    return Path(PATH_RAW) / f'{partition}_viewser_df.{extension}'
+
+
+def save_views_df(df, PATH_RAW, partition):
+    """
+    Saves a viewser DataFrame in the columnar Arrow IPC (Feather v2) format.
+
+    The file is written uncompressed so it can be memory-mapped when read back, and the
+    (month_id, priogrid_gid) or (month_id, country_id) MultiIndex is stored as regular columns
+    together with the pandas metadata needed to restore it.
+    The file is written to a temporary path first and then moved in place, so a failed write
+    never leaves a truncated file behind.
+
+    Args:
+        df (pd.DataFrame): The DataFrame fetched from viewser.
+        PATH_RAW (str or Path): The path to the model-specific directory where raw data is stored.
+        partition (str): The partition ('calibration', 'testing' or 'forecasting').
+
+    Returns:
+        Path: The path the DataFrame was saved to.
+    """
+
+    path_viewser_df = get_views_df_path(PATH_RAW, partition)
+    path_tmp = path_viewser_df.with_suffix('.feather.tmp')
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    feather.write_feather(table, str(path_tmp), compression='uncompressed')
+    os.replace(path_tmp, path_viewser_df)
+
+    logger.info(f'Saved data to {path_viewser_df}')
+
+    return path_viewser_df
+
+
+def get_index_columns(table):
+    """
+    Returns the names of the columns holding the pandas index of an Arrow table.
+
+    Args:
+        table (pa.Table): A table written by save_views_df.
+
+    Returns:
+        list of str: The index column names, e.g. ['month_id', 'priogrid_gid']. Empty if the table has no stored index.
+    """
+
+    pandas_metadata = table.schema.pandas_metadata or {}
+
+    # A RangeIndex is stored as a dict in the metadata and not as a column
+    return [i for i in pandas_metadata.get('index_columns', []) if isinstance(i, str)]
+
+
+def slice_table_by_month_range(table, month_first=None, month_last=None):
+    """
+    Selects the rows of an Arrow table within a month range.
+
+    viewser returns the data sorted by month_id, in which case the range is found with a binary search
+    and returned as a zero-copy slice of the (memory-mapped) table. Otherwise a filter is applied.
+
+    Args:
+        table (pa.Table): A table with a 'month_id' column.
+        month_first (int, optional): The first month ID to include. Defaults to the first month in the table.
+        month_last (int, optional): The first month ID after the range (exclusive), as returned by get_month_range.
+                                    Defaults to the last month in the table.
+
+    Returns:
+        pa.Table: The rows of the table within [month_first, month_last).
+    """
+
+    if month_first is None and month_last is None:
+        return table
+
+    month_id = table.column('month_id').to_numpy()
+
+    month_first = month_id.min() if month_first is None else month_first
+    month_last = month_id.max() + 1 if month_last is None else month_last
+
+    if np.all(month_id[:-1] <= month_id[1:]):
+        start = np.searchsorted(month_id, month_first, side='left')
+        stop = np.searchsorted(month_id, month_last, side='left')
+        return table.slice(start, stop - start)
+
+    mask = pc.and_(pc.greater_equal(table.column('month_id'), month_first),
+                   pc.less(table.column('month_id'), month_last))
+
+    return table.filter(mask)
+
+
+def load_views_df(PATH_RAW, partition, columns=None, month_first=None, month_last=None):
+    """
+    Loads a viewser DataFrame saved with save_views_df.
+
+    The file is memory-mapped and only the requested columns and months are materialized, so loading a few
+    features or a sub-range of a large priogrid-month partition does not read the whole file into memory.
+    The index columns are always read and the MultiIndex is restored, so the returned DataFrame has the
+    same layout as the one fetched from viewser.
+
+    If no Feather file exists but an old {partition}_viewser_df.pkl does, the pickle is read instead
+    and the same column and month selection is applied.
+
+    Args:
+        PATH_RAW (str or Path): The path to the model-specific directory where raw data is stored.
+        partition (str): The partition ('calibration', 'testing' or 'forecasting').
+        columns (list of str, optional): The feature columns to load. Defaults to None, which loads all columns.
+        month_first (int, optional): The first month ID to load. Defaults to None (from the first month).
+        month_last (int, optional): The first month ID after the range to load (exclusive). Defaults to None (to the last month).
+
+    Returns:
+        pd.DataFrame: The DataFrame with the requested columns and months.
+
+    Raises:
+        FileNotFoundError: If neither the Feather nor the pickle file exists.
+        KeyError: If any of the requested columns is not in the file.
+    """
+
+    path_viewser_df = get_views_df_path(PATH_RAW, partition)
+
+    if not path_viewser_df.exists():
+        path_legacy = get_views_df_path(PATH_RAW, partition, legacy=True)
+
+        if not path_legacy.exists():
+            raise FileNotFoundError(f'No saved data found at {path_viewser_df} or {path_legacy}')
+
+        logger.warning(f'{path_viewser_df} not found. Reading legacy pickle file {path_legacy}')
+        return _load_legacy_views_df(path_legacy, columns, month_first, month_last)
+
+    logger.info(f'Reading saved data from {path_viewser_df}')
+
+    table = feather.read_table(str(path_viewser_df), memory_map=True)
+    index_columns = get_index_columns(table)
+
+    if columns is not None:
+        missing = [col for col in columns if col not in table.column_names]
+        if missing:
+            raise KeyError(f'Columns {missing} not found in {path_viewser_df}')
+
+        selected_columns = index_columns + [col for col in columns if col not in index_columns]
+
+        # month_id is needed to select the month range, even when it is not requested
+        table = table.select(selected_columns + (['month_id'] if 'month_id' not in selected_columns else []))
+        table = slice_table_by_month_range(table, month_first, month_last)
+        table = table.select(selected_columns)
+
+    else:
+        table = slice_table_by_month_range(table, month_first, month_last)
+
+    return table.to_pandas()
+
+
+def _load_legacy_views_df(path, columns=None, month_first=None, month_last=None):
+    """
+    Reads an old pickled viewser DataFrame and applies the column and month selection of load_views_df.
+    """
+
+    df = pd.read_pickle(path)
+
+    if columns is not None:
+        df = df[columns]
+
+    if month_first is not None or month_last is not None:
+        df = slice_views_df_by_month_range(df, month_first, month_last)
+
+    return df
+
+
+def slice_views_df_by_month_range(df, month_first=None, month_last=None):
+    """
+    Selects the rows of a viewser DataFrame within a month range.
+
+    The pandas counterpart of slice_table_by_month_range: if the DataFrame is sorted by month_id the range is found
+    with a binary search and returned as a positional slice, which pandas does not copy. Otherwise a boolean mask is applied.
+
+    Args:
+        df (pd.DataFrame): A DataFrame with month_id as an index level or a column.
+        month_first (int, optional): The first month ID to include. Defaults to the first month in the DataFrame.
+        month_last (int, optional): The first month ID after the range (exclusive). Defaults to the last month in the DataFrame.
+
+    Returns:
+        pd.DataFrame: The rows of the DataFrame within [month_first, month_last).
+    """
+
+    month_id = get_month_ids(df)
+
+    month_first = month_id.min() if month_first is None else month_first
+    month_last = month_id.max() + 1 if month_last is None else month_last
+
+    if np.all(month_id[:-1] <= month_id[1:]):
+        start = np.searchsorted(month_id, month_first, side='left')
+        stop = np.searchsorted(month_id, month_last, side='left')
+        return df.iloc[start:stop]
+
+    return df[(month_id >= month_first) & (month_id < month_last)]
+
+
+def get_stored_month_range(PATH_RAW, partition):
+    """
+    Returns the range of months held in the saved viewser data of a partition.
+
+    Only the month_id column is read from the Feather file, so this is cheap even for large partitions.
+
+    Args:
+        PATH_RAW (str or Path): The path to the model-specific directory where raw data is stored.
+        partition (str): The partition ('calibration', 'testing' or 'forecasting').
+
+    Returns:
+        tuple or None: The first and last (inclusive) month IDs held locally, or None if no data is saved.
+    """
+
+    path_viewser_df = get_views_df_path(PATH_RAW, partition)
+
+    if path_viewser_df.exists():
+        month_id = feather.read_table(str(path_viewser_df), columns=['month_id'], memory_map=True).column('month_id')
+        if len(month_id) == 0:
+            return None
+        min_max = pc.min_max(month_id)
+        return min_max['min'].as_py(), min_max['max'].as_py()
+
+    if get_views_df_path(PATH_RAW, partition, legacy=True).exists():
+        month_id = get_month_ids(load_views_df(PATH_RAW, partition))
+        return int(month_id.min()), int(month_id.max())
+
+    return None
+
+
+def get_month_ids(df):
+    """
+    Returns the month_id values of a viewser DataFrame, whether month_id is an index level or a column.
+    """
+
+    if 'month_id' in df.columns:
+        return df['month_id'].values
+
+    return df.index.get_level_values('month_id').values
+
+
+def get_revised_months(df_held, df_new, month_first, month_last):
+    """
+    Compares the months two viewser DataFrames have in common and returns the months whose data differs.
+
+    Used to check the overlap window of an incremental fetch: months that viewser has revised since the
+    data was saved show up as differences between the saved and the newly fetched data.
+
+    Args:
+        df_held (pd.DataFrame): The saved DataFrame.
+        df_new (pd.DataFrame): The newly fetched DataFrame.
+        month_first (int): The first month of the overlap window.
+        month_last (int): The last month of the overlap window (inclusive).
+
+    Returns:
+        list of int: The months within [month_first, month_last] where the rows or values differ.
+
+    Raises:
+        ValueError: If the two DataFrames do not have the same columns.
+    """
+
+    if list(df_held.columns) != list(df_new.columns):
+        raise ValueError(f'Saved and fetched data have different columns: {list(df_held.columns)} != {list(df_new.columns)}')
+
+    month_held = get_month_ids(df_held)
+    month_new = get_month_ids(df_new)
+
+    revised_months = []
+
+    for month in range(month_first, month_last + 1):
+        df_held_month = df_held[month_held == month].sort_index()
+        df_new_month = df_new[month_new == month].sort_index()
+
+        if not df_held_month.index.equals(df_new_month.index):
+            revised_months.append(month)
+            continue
+
+        values_held = df_held_month.to_numpy(dtype=np.float64)
+        values_new = df_new_month.to_numpy(dtype=np.float64)
+
+        if not np.allclose(values_held, values_new, equal_nan=True):
+            revised_months.append(month)
+
+    return revised_months
+
+
+def append_views_df(df_held, df_new):
+    """
+    Appends newly fetched months to a saved viewser DataFrame.
+
+    All months in df_new replace the corresponding months in df_held, so revised months in the
+    overlap window of an incremental fetch are taken from the new data.
+
+    Args:
+        df_held (pd.DataFrame): The saved DataFrame.
+        df_new (pd.DataFrame): The newly fetched DataFrame, starting at the first month of the overlap window.
+
+    Returns:
+        pd.DataFrame: The combined DataFrame, in month order.
+    """
+
+    month_first_new = get_month_ids(df_new).min()
+    df_held = df_held[get_month_ids(df_held) < month_first_new]
+
+    return pd.concat([df_held, df_new[df_held.columns]])
+
+
+def to_compact_views_df(df):
+    """
+    Converts a viewser DataFrame to the compact dtype mode: float32 features and int32 index levels.
+
+    viewser returns float64 features and int64 (month_id, priogrid_gid) or (month_id, country_id) index levels.
+    Neither needs the extra precision: the features are (log) counts and shares, and the IDs are far below 2**31.
+    The compact mode halves the memory and disk use of a DataFrame. Use compact_views_df_equivalence_test to check
+    how much the features change for a given DataFrame.
+
+    Args:
+        df (pd.DataFrame): The viewser DataFrame.
+
+    Returns:
+        pd.DataFrame: The DataFrame with float32 features and int32 index levels.
+
+    Raises:
+        ValueError: If an index level holds values that do not fit in int32.
+    """
+
+    float_columns = df.select_dtypes(include=['floating']).columns
+    df = df.astype({col: np.float32 for col in float_columns})
+
+    if isinstance(df.index, pd.MultiIndex):
+        levels = [_to_int32_index(level) for level in df.index.levels]
+        df.index = df.index.set_levels(levels)
+    else:
+        df.index = _to_int32_index(df.index)
+
+    return df
+
+
+def to_default_views_df(df):
+    """
+    Converts a viewser DataFrame back to the default dtype mode: float64 features and int64 index levels.
+
+    This is the format returned by viewser. The views_validate decorators of views_stepshift and
+    views_stepshifter_darts use it to hand compact DataFrames to the estimators as float64, since the estimators
+    (LightGBM, XGBoost, sklearn and darts models) have only been run on float64 input.
+
+    Args:
+        df (pd.DataFrame): The viewser DataFrame, in either dtype mode.
+
+    Returns:
+        pd.DataFrame: The DataFrame with float64 features and int64 index levels.
+    """
+
+    float_columns = df.select_dtypes(include=['floating']).columns
+    df = df.astype({col: np.float64 for col in float_columns})
+
+    if isinstance(df.index, pd.MultiIndex):
+        levels = [level.astype(np.int64) if pd.api.types.is_integer_dtype(level) else level for level in df.index.levels]
+        df.index = df.index.set_levels(levels)
+    elif pd.api.types.is_integer_dtype(df.index):
+        df.index = df.index.astype(np.int64)
+
+    return df
+
+
+def _to_int32_index(index):
+    """
+    Converts an integer index (level) to int32, leaving other indexes unchanged.
+    """
+
+    if not pd.api.types.is_integer_dtype(index):
+        return index
+
+    if len(index) > 0 and (index.min() < np.iinfo(np.int32).min or index.max() > np.iinfo(np.int32).max):
+        raise ValueError(f'Index {index.name} holds values that do not fit in int32')
+
+    return index.astype(np.int32)
+
+
+def compact_views_df_equivalence_test(df, rtol=1e-6, atol=1e-6):
+    """
+    Tests that converting a viewser DataFrame to the compact dtype mode leaves it numerically equivalent.
+
+    The features of the compact DataFrame are compared with the float64 features column by column, and the index
+    is compared value by value. float32 holds about 7 significant digits, so the relative difference of each value
+    is at most about 6e-8. Larger differences only occur for values outside the float32 range.
+
+    Args:
+        df (pd.DataFrame): The viewser DataFrame in the default (float64) dtype mode.
+        rtol (float, optional): The relative tolerance of the comparison. Defaults to 1e-6.
+        atol (float, optional): The absolute tolerance of the comparison. Defaults to 1e-6.
+
+    Returns:
+        dict: The maximum absolute difference of each feature column.
+
+    Raises:
+        ValueError: If the index or any feature differs beyond the tolerances.
+    """
+
+    df_compact = to_compact_views_df(df)
+
+    if not df_compact.index.equals(df.index):
+        raise ValueError('The index of the compact DataFrame differs from the original index')
+
+    max_abs_diff = {}
+    failed_columns = []
+
+    for col in df.columns:
+        values = df[col].to_numpy(dtype=np.float64)
+        values_compact = df_compact[col].to_numpy(dtype=np.float64)
+
+        with np.errstate(invalid='ignore'):
+            diff = np.abs(values - values_compact)
+        max_abs_diff[col] = float(np.nanmax(diff)) if np.any(~np.isnan(diff)) else 0.0
+
+        if not np.allclose(values, values_compact, rtol=rtol, atol=atol, equal_nan=True):
+            failed_columns.append(col)
+
+    logger.info(f'Maximum absolute difference between the float64 and the compact features: {max_abs_diff}')
+
+    if failed_columns:
+        raise ValueError(f'Columns {failed_columns} differ beyond rtol={rtol}, atol={atol} in the compact dtype mode')
+
+    return max_abs_diff
@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import os
 import numpy as np
 import pandas as pd
@@ -8,7 +9,10 @@ from datetime import datetime
 
 from set_partition import get_partitioner_dict
 from common_configs import config_drift_detection
-from utils_df_to_vol_conversion import df_to_vol
+from utils_df_to_vol_conversion import df_to_vol, get_vol_shape
+from utils_data_store import get_views_df_path, save_views_df, load_views_df, get_stored_month_range, get_revised_months, append_views_df
+from utils_data_store import slice_views_df_by_month_range, to_compact_views_df
+from utils_data_cache import DataCache, get_queryset_fingerprint
 from utils_log_files import create_data_fetch_log_file
 from viewser import Queryset, Column
 
@@ -76,6 +80,26 @@ def get_month_range(partition):
     return month_first, month_last
 
 
+def get_partition_month_range(partition, override_month=None):
+    """
+    Determines the month range of a partition, taking an overridden end month of the forecasting partition into account.
+
+    Args:
+        partition (str): The partition type ('calibration', 'testing', or 'forecasting').
+        override_month (int, optional): Overrides the end month (exclusive) of the forecasting partition.
+
+    Returns:
+        tuple: The first month ID and the first month ID after the range (exclusive).
+    """
+    month_first, month_last = get_month_range(partition)
+
+    if partition == 'forecasting' and override_month is not None:
+        month_last = override_month
+        logger.warning(f'Overriding end month in forecasting partition to {month_last} ***\n')
+
+    return month_first, month_last
+
+
 def get_drift_config_dict(partition):
     """
     Gets the drift-detection configuration dictionary for the pertinent partition from the
@@ -188,7 +212,106 @@ def get_views_df(model_name, partition, override_month=None, self_test=False):
     return df, alerts
 
 
-def fetch_or_load_views_df(model_name, partition, PATH_RAW, self_test=False, use_saved=False, override_month=None):
+def get_model_queryset_fingerprint(model_name, compact=False):
+    """
+    Returns the fingerprint of a model's queryset, used as the key of the shared data cache (see utils_data_cache.py).
+
+    Args:
+        model_name (str): The name of the model.
+        compact (bool, optional): If True, the fingerprint of the data in the compact dtype mode is returned,
+                                  so compact and default data are cached separately. Defaults to False.
+
+    Returns:
+        str: The queryset fingerprint.
+
+    Raises:
+        RuntimeError: If no queryset is found for the model.
+    """
+    queryset = ModelPath(model_name).get_queryset()
+    if queryset is None:
+        raise RuntimeError(f'Could not find queryset for {model_name} in common_querysets')
+
+    fingerprint = get_queryset_fingerprint(queryset)
+
+    if compact:
+        fingerprint = hashlib.sha256(f'{fingerprint}_compact'.encode()).hexdigest()
+
+    return fingerprint
+
+
+def get_views_df_incremental(model_name, partition, PATH_RAW, override_month=None, self_test=False, overlap_months=3):
+    """
+    Fetches a DataFrame for the specified partition by only fetching the months missing from the saved data.
+
+    Each month the forecasting partition moves forward by one month, so most of the data is already held locally.
+    This function fetches the months after the last saved month, plus an overlap window of already saved months
+    to catch months that have been revised in viewser since the data was saved. The overlap is compared with the
+    saved data and the new months are appended.
+
+    The full partition is fetched instead (as in get_views_df) if
+    - no data is saved for the partition, or the saved data does not start at the first month of the partition,
+    - the saved and the fetched data have different columns,
+    - the first month of the overlap window has been revised, since the revisions may then extend further back than the window.
+
+    Args:
+        model_name (str): The name of the model.
+        partition (str): The partition to fetch. Valid options are 'calibration', 'testing', 'forecasting'.
+        PATH_RAW (str or Path): The path to the model-specific directory where raw data is stored.
+        override_month (int, optional): Overrides the end month of the forecasting partition.
+        self_test (bool, optional): Passed on to the drift detection.
+        overlap_months (int, optional): The number of already saved months to fetch again and compare. Defaults to 3.
+
+    Returns:
+        tuple: The DataFrame for the full partition, the drift detection alerts and the (first, last) months that
+               were fetched (None for both if nothing was fetched). The drift detection only runs on the fetched
+               months, so after an incremental fetch the alerts cover the overlap window and the new months, not
+               the whole partition.
+    """
+
+    month_first, month_last = get_partition_month_range(partition, override_month)
+
+    held_month_range = get_stored_month_range(PATH_RAW, partition)
+
+    if held_month_range is None or held_month_range[0] != month_first:
+        logger.info(f'No saved data starting at month {month_first} found. Fetching the full partition...')
+        return (*get_views_df(model_name, partition, override_month, self_test), (month_first, month_last - 1))
+
+    held_last = held_month_range[1]
+
+    if held_last >= month_last - 1:
+        logger.info(f'Saved data already holds months {month_first}-{month_last - 1}. Nothing to fetch')
+        return load_views_df(PATH_RAW, partition, month_last=month_last), None, None
+
+    fetch_first = max(month_first, held_last + 1 - overlap_months)
+    logger.info(f'Saved data holds months {month_first}-{held_last}. Fetching months {fetch_first}-{month_last - 1}')
+
+    drift_config_dict = get_drift_config_dict(partition)
+    df_new, alerts = fetch_data_from_viewser(model_name, fetch_first, month_last, drift_config_dict, self_test)
+    df_held = load_views_df(PATH_RAW, partition)
+
+    try:
+        revised_months = get_revised_months(df_held, df_new, fetch_first, held_last)
+    except ValueError as e:
+        logger.warning(f'{e}. Fetching the full partition...')
+        return (*get_views_df(model_name, partition, override_month, self_test), (month_first, month_last - 1))
+
+    if fetch_first in revised_months and fetch_first > month_first:
+        logger.warning(f'Revised months {revised_months} reach the start of the {overlap_months} month overlap window '
+                       f'and may extend further back. Fetching the full partition...')
+        return (*get_views_df(model_name, partition, override_month, self_test), (month_first, month_last - 1))
+
+    if revised_months:
+        logger.warning(f'Months {revised_months} have been revised since the data was saved. Using the newly fetched data')
+
+    df = append_views_df(df_held, df_new)
+
+    logger.info(f'Drift detection ran on months {fetch_first}-{month_last - 1} only, not on the whole partition')
+
+    return df, alerts, (fetch_first, month_last - 1)
+
+
+def fetch_or_load_views_df(model_name, partition, PATH_RAW, self_test=False, use_saved=False, override_month=None,
+                           incremental=False, overlap_months=3, use_cache=False, compact=False):
     """
     Fetches or loads a DataFrame for a given partition from viewser.
 
@@ -196,17 +319,30 @@ def fetch_or_load_views_df(model_name, partition, PATH_RAW, self_test=False, use
 
     The default behaviour is to fetch fresh data via viewser. This can be overridden by setting the
     used_saved flag to True, in which case saved data is returned, if it can be found.
+    The data is saved in the columnar Feather format (see utils_data_store.py), so downstream steps can
+    load only the columns and months they need with load_views_df.
 
     Args:
         model_name (str): The name of the model.
         partition (str): The partition to process. Valid options are 'calibration', 'forecasting', 'testing'.
         PATH_RAW (str or Path): The path to the model-specific directory where raw data should be stored.
+        incremental (bool, optional): If True, only the months missing from the saved data (plus an overlap
+                                      window) are fetched and appended. See get_views_df_incremental. Defaults to False.
+        overlap_months (int, optional): The size of the overlap window used when incremental is True. Defaults to 3.
+        use_cache (bool, optional): If True, the data is taken from the cache shared by all models (see utils_data_cache.py)
+                                    when a model with the same queryset has already fetched it, and freshly fetched
+                                    data is added to the cache. Defaults to False.
+        compact (bool, optional): If True, fetched data is converted to float32 features and int32 index levels
+                                  before it is saved (see utils_data_store.to_compact_views_df). Saved data is
+                                  loaded in the dtype mode it was saved in. Defaults to False.
 
     Returns:
-        pd.DataFrame: The DataFrame fetched or loaded from viewser, with minimum preprocessing applied.
+        tuple: The DataFrame fetched or loaded from viewser, with minimum preprocessing applied, and the drift
+               detection alerts (None if nothing was fetched). With incremental=True the alerts only cover the
+               months that were fetched, which are recorded in the data fetch log.
     """
 
-    path_viewser_df = os.path.join(str(PATH_RAW), f'{partition}_viewser_df.pkl')  # maby change to df...
+    path_viewser_df = get_views_df_path(PATH_RAW, partition)
 
     # Create the folders if they don't exist
     os.makedirs(str(PATH_RAW), exist_ok=True)
@@ -217,21 +353,49 @@ def fetch_or_load_views_df(model_name, partition, PATH_RAW, self_test=False, use
     if use_saved:
         # Check if the VIEWSER data file exists
         try:
-            df = pd.read_pickle(path_viewser_df)
-            logger.info(f'Reading saved data from {path_viewser_df}')
+            df = load_views_df(PATH_RAW, partition)
 
-        except:
+        except FileNotFoundError:
             raise RuntimeError(f'Use of saved data was specified but {path_viewser_df} not found')
 
     else:
-        logger.info(f'Fetching data...')
-        df, alerts = get_views_df(model_name, partition, override_month, self_test)  # which is then used here
-
-        data_fetch_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        create_data_fetch_log_file(PATH_RAW, partition, model_name, data_fetch_timestamp)
-
-        logger.info(f'Saving data to {path_viewser_df}')
-        df.to_pickle(path_viewser_df)
+        if use_cache:
+            cache = DataCache()
+            fingerprint = get_model_queryset_fingerprint(model_name, compact)
+            month_first, month_last = get_partition_month_range(partition, override_month)
+
+        if use_cache and cache.export(fingerprint, month_first, month_last, PATH_RAW, partition):
+            logger.info(f'Using cached data for {model_name}, no data fetched')
+            df = load_views_df(PATH_RAW, partition)
+
+            # log the cache hit as such, with the time the cached data was fetched from viewser
+            key = cache.lookup(fingerprint, month_first, month_last)
+            create_data_fetch_log_file(PATH_RAW, partition, model_name, cache.get_fetch_timestamp(key), data_source=f'cache {key}')
+
+        else:
+            logger.info(f'Fetching data...')
+            data_source = 'viewser'
+            if incremental:
+                df, alerts, fetched_months = get_views_df_incremental(model_name, partition, PATH_RAW, override_month, self_test, overlap_months)
+                if fetched_months is None:
+                    data_source = 'saved data, no months fetched'
+                else:
+                    data_source = f'viewser, months {fetched_months[0]}-{fetched_months[1]} (drift detection ran on these months only)'
+            else:
+                df, alerts = get_views_df(model_name, partition, override_month, self_test)  # which is then used here
+
+            if compact:
+                df = to_compact_views_df(df)
+
+            logger.info(f'Saving data to {path_viewser_df}')
+            if use_cache:
+                cache.put(fingerprint, month_first, month_last, df)
+                cache.export(fingerprint, month_first, month_last, PATH_RAW, partition)
+            else:
+                save_views_df(df, PATH_RAW, partition)
+
+            data_fetch_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            create_data_fetch_log_file(PATH_RAW, partition, model_name, data_fetch_timestamp, data_source=data_source)
 
     if validate_df_partition(df, partition, override_month):
 
@@ -241,8 +405,144 @@ def fetch_or_load_views_df(model_name, partition, PATH_RAW, self_test=False, use
         raise RuntimeError(f'file at {path_viewser_df} incompatible with partition {partition}')
 
 
+def plan_partition_fetches(partitions, override_month=None):
+    """
+    Groups partitions that can be served by a single fetch from viewser.
+
+    Partitions are grouped if they start at the same month and use the same drift detection configuration,
+    e.g. calibration (months 121-444) and testing (months 121-492). Each group is fetched once over the union
+    of its month ranges and the partitions are sliced from that superset locally.
+
+    Args:
+        partitions (list of str): The partitions to fetch ('calibration', 'testing' and/or 'forecasting').
+        override_month (int, optional): Overrides the end month (exclusive) of the forecasting partition.
+
+    Returns:
+        list of dict: One dict per fetch, with the keys
+                      - 'month_first': the first month ID of the fetch,
+                      - 'month_last': the first month ID after the fetch (exclusive),
+                      - 'partitions': a dict mapping each partition served by the fetch to its (month_first, month_last).
+    """
+
+    plan = []
+
+    for partition in partitions:
+        month_first, month_last = get_partition_month_range(partition, override_month)
+        drift_config_dict = get_drift_config_dict(partition)
+
+        for fetch in plan:
+            if fetch['month_first'] == month_first and fetch['drift_config_dict'] == drift_config_dict:
+                fetch['month_last'] = max(fetch['month_last'], month_last)
+                fetch['partitions'][partition] = (month_first, month_last)
+                break
+        else:
+            plan.append({'month_first': month_first,
+                         'month_last': month_last,
+                         'drift_config_dict': drift_config_dict,
+                         'partitions': {partition: (month_first, month_last)}})
+
+    for fetch in plan:
+        logger.info(f'Planned fetch of months {fetch["month_first"]}-{fetch["month_last"] - 1} '
+                    f'for partition(s) {", ".join(fetch["partitions"])}')
+        del fetch['drift_config_dict']
+
+    return plan
+
+
+def fetch_or_load_views_dfs(model_name, partitions, PATH_RAW, self_test=False, use_saved=False, override_month=None,
+                            use_cache=False, compact=False):
+    """
+    Fetches or loads the DataFrames for several partitions, fetching overlapping partitions from viewser only once.
+
+    The partitions are grouped with plan_partition_fetches. Each group is fetched once over the union of its month
+    ranges, after which every partition is sliced from the superset, saved, logged and validated exactly as
+    fetch_or_load_views_df does for a single partition. The drift detection runs once per fetch, on the superset, so
+    its alerts are only returned for the partition whose month range is the superset (e.g. testing). The other
+    partitions of the fetch (e.g. calibration) get None: their own slice was not checked.
+
+    Args:
+        model_name (str): The name of the model.
+        partitions (list of str): The partitions to process. Valid options are 'calibration', 'forecasting', 'testing'.
+        PATH_RAW (str or Path): The path to the model-specific directory where raw data should be stored.
+        self_test (bool, optional): Passed on to the drift detection of the first fetch.
+        use_saved (bool, optional): If True, the saved data of each partition is loaded instead. Defaults to False.
+        override_month (int, optional): Overrides the end month of the forecasting partition.
+        use_cache (bool, optional): If True, each superset is taken from the shared data cache (see utils_data_cache.py)
+                                    when a model with the same queryset has already fetched it, and freshly fetched
+                                    supersets are added to the cache. The partitions are exported from the cache.
+                                    Defaults to False.
+        compact (bool, optional): If True, the fetched data is converted to the compact dtype mode. Defaults to False.
+
+    Returns:
+        dict: Maps each partition to a tuple of its DataFrame and the drift detection alerts (None if the drift
+              detection did not run on the partition's month range, or the data was taken from the cache).
+
+    Raises:
+        RuntimeError: If the data of a partition does not match the partition's month range.
+    """
+
+    if use_saved:
+        return {partition: fetch_or_load_views_df(model_name, partition, PATH_RAW, self_test, use_saved, override_month)
+                for partition in partitions}
+
+    os.makedirs(str(PATH_RAW), exist_ok=True)
+
+    if use_cache:
+        cache = DataCache()
+        fingerprint = get_model_queryset_fingerprint(model_name, compact)
+
+    views_dfs = {}
+
+    for fetch in plan_partition_fetches(partitions, override_month):
+        month_first, month_last = fetch['month_first'], fetch['month_last']
+        # The drift detection config is the same for all partitions in the fetch
+        drift_config_dict = get_drift_config_dict(next(iter(fetch['partitions'])))
+
+        df_superset = cache.get(fingerprint, month_first, month_last) if use_cache else None
+
+        if df_superset is not None:
+            logger.info(f'Using cached data for {model_name}, no data fetched')
+            key = cache.lookup(fingerprint, month_first, month_last)
+            alerts = None  # the drift detection only runs on fetched data
+            data_fetch_timestamp, data_source = cache.get_fetch_timestamp(key), f'cache {key}'
+
+        else:
+            logger.info(f'Fetching data...')
+            df_superset, alerts = fetch_data_from_viewser(model_name, month_first, month_last, drift_config_dict, self_test)
+            self_test = False
+
+            if compact:
+                df_superset = to_compact_views_df(df_superset)
+
+            if use_cache:
+                cache.put(fingerprint, month_first, month_last, df_superset)
+
+            data_fetch_timestamp, data_source = datetime.now().strftime("%Y%m%d_%H%M%S"), 'viewser'
+
+        for partition, (partition_first, partition_last) in fetch['partitions'].items():
+            df = slice_views_df_by_month_range(df_superset, partition_first, partition_last)
+
+            logger.info(f'Saving data to {get_views_df_path(PATH_RAW, partition)}')
+            if not (use_cache and cache.export(fingerprint, partition_first, partition_last, PATH_RAW, partition)):
+                save_views_df(df, PATH_RAW, partition)
+
+            create_data_fetch_log_file(PATH_RAW, partition, model_name, data_fetch_timestamp, data_source=data_source)
+
+            if not validate_df_partition(df, partition, override_month):
+                raise RuntimeError(f'file at {get_views_df_path(PATH_RAW, partition)} incompatible with partition {partition}')
+
+            if alerts is None or (partition_first, partition_last) == (month_first, month_last):
+                views_dfs[partition] = (df, alerts)
+            else:
+                logger.info(f'Drift detection skipped for partition {partition}: it ran on months '
+                            f'{month_first}-{month_last - 1}, not on the partition alone')
+                views_dfs[partition] = (df, None)
+
+    return views_dfs
+
+
 # could be moved to common_utils/utils_df_to_vol_conversion.py but it is not really a conversion function so I would keep it here for now.
-def create_or_load_views_vol(partition, PATH_PROCESSED, PATH_RAW):
+def create_or_load_views_vol(partition, PATH_PROCESSED, PATH_RAW, mmap_mode='r', height=180, width=180):
     """
     Creates or loads a volume from a DataFrame for a specified partition.
 
@@ -254,6 +554,13 @@ def create_or_load_views_vol(partition, PATH_PROCESSED, PATH_RAW):
     Args:
         partition (str): The partition to process. Valid options are 'calibration', 'forecasting', 'testing'.
         PATH_PROCESSED (str or Path): The path to the directory where processed volume data should be stored.
+        PATH_RAW (str or Path): The path to the directory where the raw viewser data is stored.
+        mmap_mode (str, optional): The np.load memory-map mode used to open the volume. Defaults to 'r', so the volume
+                                   is not read into memory. None reads the whole volume into memory.
+        height (int, optional): The height of the spatial grid. Defaults to 180, the Africa and Middle East grid
+                                HydraNet is built for. Not inferred from the data, since a month range with no
+                                events in the outermost rows or columns would give a smaller, shifted volume.
+        width (int, optional): The width of the spatial grid. Defaults to 180, see height.
 
     Returns:
         np.ndarray: The 4D volume array created or loaded from the DataFrame, with shape
@@ -269,14 +576,22 @@ def create_or_load_views_vol(partition, PATH_PROCESSED, PATH_RAW):
     # Check if the volume exists
     if os.path.isfile(path_vol):
         logger.info('Volume already created')
-        vol = np.load(path_vol)
     else:
         logger.info('Creating volume...')
-        path_raw = os.path.join(str(PATH_RAW), f'{partition}_viewser_df.pkl')
-        vol = df_to_vol(pd.read_pickle(path_raw))
-        logger.info(f'shape of volume: {vol.shape}')
+        df = load_views_df(PATH_RAW, partition)
+        vol_shape = get_vol_shape(df, height=height, width=width)
+        logger.info(f'shape of volume: {vol_shape}')
         logger.info(f'Saving volume to {path_vol}')
-        np.save(path_vol, vol)
+
+        # The volume is written straight into a memory-mapped .npy file, so it is never held in memory twice
+        path_tmp = f'{path_vol}.tmp'
+        vol = np.lib.format.open_memmap(path_tmp, mode='w+', dtype=np.float64, shape=vol_shape)
+        df_to_vol(df, height=height, width=width, out=vol)
+        vol.flush()
+        del vol
+        os.replace(path_tmp, path_vol)
+
+    vol = np.load(path_vol, mmap_mode=mmap_mode)
 
     logger.info('Done')
 
@@ -350,6 +665,7 @@ def ensure_float64(df):
     """
     Check if the DataFrame only contains np.float64 types. If not, raise a warning
     and convert the DataFrame to use np.float64 for all its numeric columns.
+    The compact dtype mode (float32) is applied after this check, see fetch_or_load_views_df.
     """
 
     non_float64_cols = df.select_dtypes(include=['number']).columns[
@@ -374,5 +690,7 @@ def parse_args():
     parser.add_argument('-f', '--forecasting', action='store_true', help='Fetch forecasting data from viewser')
     parser.add_argument('-s', '--saved', action='store_true', help='Used locally stored data')
     parser.add_argument('-o', '--override_month', help='Over-ride use of current month', type=int)
+    parser.add_argument('--cache', action='store_true', help='Use the data cache shared by all models')
+    parser.add_argument('--compact', action='store_true', help='Store features as float32 and index levels as int32')
 
     return parser.parse_args()
\ No newline at end of file
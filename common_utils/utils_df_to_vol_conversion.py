@@ -1,3 +1,6 @@
+import os
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -34,25 +37,96 @@ def calculate_absolute_indices(df): # arguably HydraNet or at lest vol specific
     This is needed to turn as pandas df into a numpy array (volume).
     The volme is the data format need be the e.g. HydraNet model(s).
 
+    The input DataFrame is not modified. df_to_vol computes the same indices as numpy arrays directly (see get_vol_indices).
+
     Args:
         df (pd.DataFrame): The input DataFrame with columns 'row', 'col', and 'month_id'.
 
     Returns:
-        pd.DataFrame: The DataFrame with added 'abs_row', 'abs_col', and 'abs_month' columns.
+        pd.DataFrame: A new DataFrame with added 'abs_row', 'abs_col', and 'abs_month' columns.
     """
     
     # get the first month_id
     month_first = df['month_id'].min() 
     
     # calculate the absolute indices
-    df['abs_row'] = df['row'] - df['row'].min()         
-    df['abs_col'] = df['col'] - df['col'].min()
-    df['abs_month'] = df['month_id'] - month_first
+    return df.assign(abs_row = df['row'] - df['row'].min(),
+                     abs_col = df['col'] - df['col'].min(),
+                     abs_month = df['month_id'] - month_first)
 
-    return df
 
+def _get_values(df, name):
+    """
+    Returns the values of a column or an index level of a DataFrame as a numpy array, without copying a column.
+    """
 
-def df_to_vol(df, height = 180, width = 180, forecast_features = ['ln_sb_best', 'ln_ns_best', 'ln_os_best']):
+    if name in df.columns:
+        return df[name].to_numpy()
+
+    if name in df.index.names:
+        return df.index.get_level_values(name).to_numpy()
+
+    raise ValueError(f'Column {name} not found in the DataFrame. Please check your viewser query set in "model"/configs/config_input_data.py')
+
+
+def get_vol_indices(df, height = None, width = None):
+    """
+    Computes the integer (month, row, col) position of every row of the DataFrame in the volume.
+
+    The positions are computed once as numpy arrays and used to write all features in one assignment.
+    Rows are flipped so north is up, i.e. the northernmost row of the grid is row 0 of the volume.
+
+    Args:
+        df (pd.DataFrame): The input DataFrame with 'row', 'col' and 'month_id' as columns or index levels.
+        height (int, optional): The height of the spatial grid. Defaults to None, which infers it from the rows in the data.
+        width (int, optional): The width of the spatial grid. Defaults to None, which infers it from the columns in the data.
+
+    Returns:
+        tuple: The month, row and col index arrays, and the shape (n_months, height, width) of the volume.
+
+    Raises:
+        ValueError: If the data does not fit in a grid of the given height and width.
+    """
+
+    row = _get_values(df, 'row').astype(np.int64)
+    col = _get_values(df, 'col').astype(np.int64)
+    month_id = _get_values(df, 'month_id').astype(np.int64)
+
+    abs_row = row - row.min()
+    abs_col = col - col.min()
+    abs_month = month_id - month_id.min()
+
+    n_months = int(abs_month.max()) + 1
+    height = int(abs_row.max()) + 1 if height is None else height
+    width = int(abs_col.max()) + 1 if width is None else width
+
+    if abs_row.max() >= height or abs_col.max() >= width:
+        raise ValueError(f'The data spans {abs_row.max() + 1} rows and {abs_col.max() + 1} columns, '
+                         f'which does not fit in a {height}x{width} volume.')
+
+    return abs_month, height - 1 - abs_row, abs_col, (n_months, height, width)
+
+
+def get_vol_shape(df, height = None, width = None, forecast_features = ['ln_sb_best', 'ln_ns_best', 'ln_os_best']):
+    """
+    Returns the shape of the volume df_to_vol creates from a DataFrame, e.g. to preallocate or memory-map it.
+
+    Args:
+        df (pd.DataFrame): The input DataFrame (see df_to_vol).
+        height (int, optional): The height of the spatial grid. Defaults to None (inferred from the data).
+        width (int, optional): The width of the spatial grid. Defaults to None (inferred from the data).
+        forecast_features (list of str, optional): List of forcast feature columns to include in the volume.
+
+    Returns:
+        tuple: The shape (n_months, height, width, n_features).
+    """
+
+    _, _, _, shape = get_vol_indices(df, height, width)
+
+    return shape + (len(get_requried_columns_for_vol()) + len(forecast_features),)
+
+
+def df_to_vol(df, height = None, width = None, forecast_features = ['ln_sb_best', 'ln_ns_best', 'ln_os_best'], dtype = np.float64, out = None):
 
 
     """
@@ -61,56 +135,64 @@ def df_to_vol(df, height = 180, width = 180, forecast_features = ['ln_sb_best',
     This volume format is used by models like HydraNet and other CNN-based models. The resulting
     volume array has dimensions [n_months, height, width, n_features].
 
+    The positions of all rows in the volume are computed once and all features are written in a single
+    assignment directly into the month-major volume, so no transposed or flipped copy is made.
+    The input DataFrame is not modified.
+
     Args:
-        df (pd.DataFrame): The input DataFrame containing spatial-temporal data. Must include columns:
+        df (pd.DataFrame): The input DataFrame containing spatial-temporal data. Must include columns (or index levels):
                            - 'pg_id': Priogrid ID.
                            - 'col': Column index in the spatial grid.
                            - 'row': Row index in the spatial grid.
                            - 'month_id': Temporal index for months.
                            - 'c_id': Country ID or relevant identifier.
 
-        height (int, optional): The height of the spatial grid. Defaults to 180 which fits Africa and the Middle East.
+        height (int, optional): The height of the spatial grid. Defaults to None, which infers it from the data.
+                                The Africa and Middle East grid used by HydraNet is 180 high.
         
-        width (int, optional): The width of the spatial grid. Defaults to 180 which fits Africa and the Middle East.
+        width (int, optional): The width of the spatial grid. Defaults to None, which infers it from the data.
+                               The Africa and Middle East grid used by HydraNet is 180 wide.
         
         forecast_features (list of str, optional): List of forcast feature columns to include in the volume.
                                                    Defaults to ['ln_sb_best', 'ln_ns_best', 'ln_os_best'].
 
+        dtype (np.dtype, optional): The dtype of the volume. Defaults to np.float64.
+
+        out (np.ndarray, optional): A preallocated array of shape get_vol_shape(df, ...) to write the volume into,
+                                    e.g. a memory-mapped .npy file opened with np.lib.format.open_memmap. 
+                                    Defaults to None, which allocates a new array.
+
     Returns:
         np.ndarray: A 4D volume array with shape [n_months, height, width, n_features].
                     Where n_features is the total number of required and forecast features combined. Given the default settings the default shape is [n_months, 180, 180, 8].
 
     Raises:
-        ValueError: If any of the required columns ('pg_id', 'col', 'row', 'month_id', 'c_id') are missing from the DataFrame.
+        ValueError: If any of the required columns ('pg_id', 'col', 'row', 'month_id', 'c_id') are missing from the DataFrame,
+                    if the data does not fit in the given height and width, or if out has the wrong shape.
 
     """
 
     #required_columns = ['pg_id', 'col', 'row', 'month_id', 'c_id']
     required_columns = get_requried_columns_for_vol()
-    
-    for col in required_columns:
-        if col not in df.columns:
-            raise ValueError(f'Column {col} not found in the DataFrame. Please check your viewser query set in "model"/configs/config_input_data.py')
 
     vol_features =  required_columns + forecast_features
 
-    n_features = len(vol_features)
-
-    month_first = df['month_id'].min()
-    month_last = df['month_id'].max()
-    month_range = month_last - month_first + 1
+    abs_month, vol_row, vol_col, shape = get_vol_indices(df, height, width) # month, row (north up) and col of each row in the volume
+    shape = shape + (len(vol_features),)
 
-    df = calculate_absolute_indices(df) # abs_row, abs_col, abs_month needed for the volume
+    if out is None:
+        vol = np.zeros(shape, dtype = dtype) # Create the volume array.
+    elif out.shape != shape:
+        raise ValueError(f'The output array has shape {out.shape}, but the volume has shape {shape}.')
+    else:
+        vol = out
+        vol[...] = 0
 
-    vol = np.zeros([height, width, month_range, n_features]) # Create the volume array.
+    values = np.column_stack([_get_values(df, feature) for feature in vol_features])
 
-    for i, feature in enumerate(vol_features):
-        vol[df['abs_row'], df['abs_col'], df['abs_month'], i] = df[feature] 
+    vol[abs_month, vol_row, vol_col, :] = values
 
-    vol = np.flip(vol, axis=0)  # Flip the rows, so north is up.
-    vol = np.transpose(vol, (2, 0, 1, 3))  # Move the month dimension to the front.
-
-    print(f'Volume of shape {vol.shape} created. Should be (n_months, 180, 180, 8)')
+    print(f'Volume of shape {vol.shape} created. Should be (n_months, height, width, {len(vol_features)})')
 
     return vol
 
@@ -124,6 +206,9 @@ def vol_to_df(vol, forecast_features = ['ln_sb_best', 'ln_ns_best', 'ln_os_best'
     a DataFrame. Th purpose is to cehck that the conversion between DataFrame and volume does not alter data, 
     thus verifying consistency between df_to_vol and vol_to_df operations.
 
+    Only the occupied cells (where 'pg_id' is not 0) are gathered from the volume, so no DataFrame of all
+    n_months * height * width cells is built.
+
     Args:
         vol (np.ndarray): The input 4D volume array (created with df_to_vol()) to be converted, with shape 
                           [n_months, height, width, n_features].
@@ -139,7 +224,7 @@ def vol_to_df(vol, forecast_features = ['ln_sb_best', 'ln_ns_best', 'ln_os_best'
     Returns:
         pd.DataFrame: The DataFrame representation of the volume array containing columns:
                       'pg_id', 'col', 'row', 'month_id', 'c_id', followed by forecast features.
-                      Rows where 'pg_id' is 0 are removed. This datafreame should be identical to the original DataFrame used to create the volume via df_to_vol().
+                      Only cells where 'pg_id' is not 0 are included. This datafreame should be identical to the original DataFrame used to create the volume via df_to_vol().
 
     Raises:
         ValueError: If the number of features in the volume does not match the expected number 
@@ -155,25 +240,70 @@ def vol_to_df(vol, forecast_features = ['ln_sb_best', 'ln_ns_best', 'ln_os_best'
     if n_features != vol.shape[3]:
         raise ValueError(f'Number of features in the volume array ({vol.shape[3]}) does not match the number of features expected ({n_features}).')
 
-    feature_dict  = {}
-    for i, feature in enumerate(vol_features):
-        feature_dict[feature] = vol[:, :, :, i].flatten()
+    # Cells where 'pg_id' is 0 are ocean cells and not PRIO grid cells as such.
+    occupied = vol[:, :, :, 0].astype(int) != 0
+    values = vol[occupied] # [n_occupied, n_features], in the same (month, row, col) order as the flattened volume
 
-    df = pd.DataFrame(feature_dict)
+    df = pd.DataFrame(values, columns = vol_features)
 
     # Correct the data types for required columns
     for col in required_columns:
         df[col] = df[col].astype(int)
 
-    # Remove rows where 'pg_id' is 0 - these are ocean cells and not PRIO grid cells as such.
-    df = df[df['pg_id'] != 0]
-
-    print(f'DataFrame of shape {df.shape} created. Should be (n_months * 180 * 180, 8)')
+    print(f'DataFrame of shape {df.shape} created. Should be (n_occupied_cells, {n_features})')
 
     return df
 
 
 
+def load_vol(path_vol, dtype = np.float32, mmap_mode = 'c'):
+
+    """
+    Opens a volume saved as .npy without reading it into memory.
+
+    The volume is memory-mapped, so only the months and channels that are actually accessed are read from disk.
+    The default copy-on-write mode ('c') gives a writable array (as torch.from_numpy expects) whose changes are
+    kept in memory and never written back to the file.
+
+    If a dtype other than the stored one is requested, a sidecar file {name}_{dtype}.npy holding the converted
+    volume is created next to the volume (one month at a time, so without loading the whole volume) and mapped
+    instead. The sidecar is recreated when the volume is newer than it.
+
+    Args:
+        path_vol (str or Path): The path to the {partition}_vol.npy file.
+        dtype (np.dtype, optional): The dtype of the returned volume. Defaults to np.float32, which is what the
+                                    PyTorch models use. None returns the volume in its stored dtype.
+        mmap_mode (str, optional): The np.load memory-map mode. Defaults to 'c' (copy-on-write).
+                                   None reads the whole volume into memory.
+
+    Returns:
+        np.ndarray: The volume with shape [n_months, height, width, n_features].
+    """
+
+    path_vol = Path(path_vol)
+    vol = np.load(path_vol, mmap_mode = 'r')
+
+    if dtype is None or vol.dtype == np.dtype(dtype):
+        return np.load(path_vol, mmap_mode = mmap_mode)
+
+    path_sidecar = path_vol.with_name(f'{path_vol.stem}_{np.dtype(dtype).name}.npy')
+
+    if not path_sidecar.exists() or path_sidecar.stat().st_mtime < path_vol.stat().st_mtime:
+        print(f'Creating {np.dtype(dtype).name} copy of the volume at {path_sidecar}')
+        path_tmp = path_sidecar.with_suffix('.npy.tmp')
+        vol_sidecar = np.lib.format.open_memmap(path_tmp, mode = 'w+', dtype = dtype, shape = vol.shape)
+
+        for month in range(vol.shape[0]):
+            vol_sidecar[month] = vol[month]
+
+        vol_sidecar.flush()
+        del vol_sidecar
+        os.replace(path_tmp, path_sidecar)
+
+    return np.load(path_sidecar, mmap_mode = mmap_mode)
+
+
+
 def df_vol_conversion_test(df, vol, forecast_features = ['ln_sb_best', 'ln_ns_best', 'ln_os_best']):
 
     """
@@ -35,7 +35,8 @@ def read_log_file(log_file_path):
 def create_data_fetch_log_file(path_raw, 
                               run_type,
                               model_name,
-                              data_fetch_timestamp):
+                              data_fetch_timestamp,
+                              data_source="viewser"):
     """
     Creates a log file in the specified single model folder with details about the data fetch.
 
@@ -44,13 +45,17 @@ def create_data_fetch_log_file(path_raw,
     - run_type (str): The type of run.
     - model_name (str): The name of the model.
     - data_fetch_timestamp (str): The timestamp when the raw data used was fetched from VIEWS.
+      For data taken from the shared data cache this is when the cache entry was fetched, not when it was loaded.
+    - data_source (str, optional): Where the data came from: "viewser" (a fetch), "viewser, months <first>-<last> ..." (an
+      incremental fetch of those months) or "cache <key>" (a cache hit). Default is "viewser".
     """
     
     data_fetch_log_file_path = f"{path_raw}/{run_type}_data_fetch_log.txt"
 
     with open(data_fetch_log_file_path, "w") as log_file:
         log_file.write(f"Single Model Name: {model_name}\n")
-        log_file.write(f"Data Fetch Timestamp: {data_fetch_timestamp}\n\n")
+        log_file.write(f"Data Fetch Timestamp: {data_fetch_timestamp}\n")
+        log_file.write(f"Data Source: {data_source}\n\n")
 
     logger.info(f"Data fetch log file created at {data_fetch_log_file_path}")
 
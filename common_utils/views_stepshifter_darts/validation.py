@@ -1,6 +1,7 @@
 import functools
 import numpy as np
 import pandas as pd
+from utils_data_store import to_default_views_df
 
 class ValidationError(Exception):
     pass
@@ -11,14 +12,20 @@ def dataframe_is_right_format(dataframe: pd.DataFrame):
     except AssertionError:
         raise ValidationError("Dataframe must have a two-level index")
 
+    # np.float32 is accepted for dataframes in the compact dtype mode (see utils_data_store.to_compact_views_df),
+    # views_validate converts them back to np.float64 before they reach the estimators
     try:
-        assert set(dataframe.dtypes) == {np.dtype(float)}
+        assert set(dataframe.dtypes) in ({np.dtype(np.float64)}, {np.dtype(np.float32)})
     except AssertionError:
-        raise ValidationError("The dataframe must contain only np.float64 floats")
+        raise ValidationError("The dataframe must contain only np.float64 floats, or only np.float32 floats in compact mode")
 
 def views_validate(fn):
     @functools.wraps(fn)
     def inner(*args,**kwargs):
         dataframe_is_right_format(args[-1])
+        # The estimators are only known to work with np.float64 input, so compact dataframes are converted back
+        # here, at the fit/predict boundary. The compact mode saves memory and disk up to this point.
+        if np.dtype(np.float32) in set(args[-1].dtypes):
+            args = (*args[:-1], to_default_views_df(args[-1]))
         return fn(*args,**kwargs)
     return inner
@@ -2,6 +2,7 @@ import logging
 import pickle
 from pathlib import Path
 from model_path import ModelPath
+from utils_data_store import load_views_df
 from ensemble_path import EnsemblePath
 from utils_log_files import create_log_file, read_log_file
 from utils_outputs import save_model_outputs, save_predictions
@@ -45,7 +46,7 @@ def evaluate_ensemble(config):
             model_config = get_single_model_config(model_name)
             model_config["timestamp"] = ts
             model_config["run_type"] = run_type
-            df_viewser = pd.read_pickle(path_raw / f"{run_type}_viewser_df.pkl")
+            df_viewser = load_views_df(path_raw, run_type)
 
             try:
                 stepshift_model = pd.read_pickle(path_artifact)
@@ -4,6 +4,7 @@ import pickle
 import logging  
 from pathlib import Path
 from model_path import ModelPath
+from utils_data_store import load_views_df
 from ensemble_path import EnsemblePath
 from set_partition import get_partitioner_dict
 from utils_log_files import create_log_file, read_log_file
@@ -44,7 +45,7 @@ def forecast_ensemble(config):
             model_config = get_single_model_config(model_name)
             model_config["timestamp"] = ts
             model_config["run_type"] = run_type
-            df_viewser = pd.read_pickle(path_raw / f"{run_type}_viewser_df.pkl")
+            df_viewser = load_views_df(path_raw, run_type)
 
             try:
                 stepshift_model = pd.read_pickle(path_artifact)
@@ -1,6 +1,7 @@
 import logging
 from datetime import datetime
 from model_path import ModelPath
+from utils_data_store import load_views_df
 from set_partition import get_partitioner_dict
 from utils_log_files import create_log_file, read_log_file
 from utils_run import get_model, get_single_model_config
@@ -24,7 +25,7 @@ def train_ensemble(config):
         path_generated = model_path.data_generated
         path_artifacts = model_path.artifacts
 
-        df_viewser = pd.read_pickle(path_raw / f"{run_type}_viewser_df.pkl")
+        df_viewser = load_views_df(path_raw, run_type)
         model_config = get_single_model_config(model_name)
         model_config["run_type"] = run_type
         stepshift_model = stepshift_training(model_config, run_type, get_model(model_config), df_viewser)
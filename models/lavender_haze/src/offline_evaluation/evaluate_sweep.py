@@ -2,6 +2,7 @@ import pandas as pd
 import wandb
 from sklearn.metrics import mean_squared_error
 from model_path import ModelPath
+from utils_data_store import load_views_df
 from utils_run import get_standardized_df
 from utils_wandb import log_wandb_log_dict
 from utils_evaluation_metrics import generate_metric_dict
@@ -13,7 +14,7 @@ def evaluate_sweep(config, stepshift_model):
     run_type = config["run_type"]
     steps = config["steps"]
 
-    df_viewser = pd.read_pickle(path_raw / f"{run_type}_viewser_df.pkl")
+    df_viewser = load_views_df(path_raw, run_type)
 
     df = stepshift_model.predict(run_type, "predict", df_viewser)
     df = get_standardized_df(df, config)
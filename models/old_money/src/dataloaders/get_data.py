@@ -9,7 +9,8 @@ def get_data(args, model_name):
     model_path = ModelPath(model_name)
     path_raw = model_path.data_raw
 
-    data, alerts = fetch_or_load_views_df(model_name, args.run_type, path_raw, use_saved=args.saved)
+    data, alerts = fetch_or_load_views_df(model_name, args.run_type, path_raw, use_saved=args.saved, incremental=args.incremental,
+                                          use_cache=args.cache, compact=args.compact)
     logger.debug(f"DataFrame shape: {data.shape if data is not None else 'None'}")
 
     for ialert, alert in enumerate(str(alerts).strip('[').strip(']').split('Input')):
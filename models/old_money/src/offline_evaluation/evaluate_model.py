@@ -2,6 +2,7 @@ from datetime import datetime
 import pandas as pd
 import logging
 from model_path import ModelPath
+from utils_data_store import load_views_df
 from utils_log_files import create_log_file, read_log_file
 from utils_outputs import save_model_outputs, save_predictions
 from utils_run import get_standardized_df
@@ -35,7 +36,7 @@ def evaluate_model_artifact(config, artifact_name):
         PATH_ARTIFACT = get_latest_model_artifact(path_artifacts, run_type)
 
     config["timestamp"] = PATH_ARTIFACT.stem[-15:]
-    df_viewser = pd.read_pickle(path_raw / f"{run_type}_viewser_df.pkl")
+    df_viewser = load_views_df(path_raw, run_type)
 
     try:
         stepshift_model = pd.read_pickle(PATH_ARTIFACT)
@@ -2,6 +2,7 @@ import pandas as pd
 from datetime import datetime
 import logging
 from model_path import ModelPath
+from utils_data_store import load_views_df
 from utils_log_files import create_log_file, read_log_file
 from utils_run import get_standardized_df
 from utils_outputs import save_predictions
@@ -31,7 +32,7 @@ def forecast_model_artifact(config, artifact_name):
         path_artifact = get_latest_model_artifact(path_artifacts, run_type)
 
     config["timestamp"] = path_artifact.stem[-15:]
-    df_viewser = pd.read_pickle(path_raw / f"{run_type}_viewser_df.pkl")
+    df_viewser = load_views_df(path_raw, run_type)
 
     try:
         stepshift_model = pd.read_pickle(path_artifact)
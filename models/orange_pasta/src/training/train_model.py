@@ -1,6 +1,7 @@
 from datetime import datetime
 import pandas as pd
 from model_path import ModelPath
+from utils_data_store import load_views_df
 from utils_log_files import create_log_file, read_log_file
 from utils_run import get_model
 from set_partition import get_partitioner_dict
@@ -14,7 +15,7 @@ def train_model_artifact(config):
     path_generated = model_path.data_generated
     path_artifacts = model_path.artifacts
     run_type = config["run_type"]
-    df_viewser = pd.read_pickle(path_raw / f"{run_type}_viewser_df.pkl")
+    df_viewser = load_views_df(path_raw, run_type)
 
     stepshift_model = stepshift_training(config, run_type, df_viewser)
     if not config["sweep"]:
@@ -18,6 +18,16 @@ def get_hp_config():
     'min_events' : 5,
     'samples': 300, # 600 for actual trainnig, 10 for debug
     'batch_size': 3, 
+    'batched_windows' : False, # stack the batch_size windows into one N x T x C x H x W tensor instead of looping over them. Changes the BatchNorm statistics (over N windows), so off by default
+    'num_workers' : 2, # worker processes sampling the batches in the background (needs batched_windows). 0 samples them in the training loop
+    'prefetch_factor' : 2, # batches prefetched per worker
+    'fused_lstm' : False, # all LSTM gates in two convolutions instead of 32. Same model, fewer kernel launches. Changes the state_dict layout, so off by default. Older artifacts are converted when loaded with it on
+    'grouped_decoder' : False, # the six decoder heads as grouped convolutions, one pass per layer. Changes the state_dict layout, so off by default. Older artifacts are converted when loaded with it on
+    'tbptt_steps' : 1, # truncated BPTT: backward every n months, so only n months of graph are kept. 1 gives the same gradients as 0 (one backward after the full sequence)
+    'checkpoint_unet' : False, # recompute the U-Net activations in the backward pass instead of keeping them. Less memory, ~30% more compute
+    'timing' : False, # time the training and inference phases (window sampling, forward, backward, rollout, ...) to a timing_*.jsonl file in data/generated
+    'timing_wandb' : False, # log the phase timings to WandB as well
+    'checkpoint_every' : 50, # save the training state every n samples (written in the background), so an interrupted run can continue with --resume. 0 for no checkpoints
     'dropout_rate' : 0.125,
     'learning_rate' :  0.001,
     'weight_decay' :  0.1,
@@ -33,6 +43,19 @@ def get_hp_config():
     'loss_reg_a' : 258, 
     'loss_reg_c' :  0.001, # 0.05 works...
     'test_samples': 10, # 128 for actual testing, 10 for debug
+    'inference_backend': 'eager', # 'eager', 'torchscript', 'compile' or 'onnx' (CPU, needs onnxruntime). How an artifact runs the month steps in the evaluation. Can be set with --inference_backend
+    'inference_precision': 'float32', # 'float32' or 'bfloat16' (autocast, for CPU nodes with bf16 support). Check it with precision_report first
+    'precision_report': False, # compare the bfloat16 posterior against the float32 posterior in the evaluation
+    'posterior_batch_size': 5, # posterior samples drawn together in one batch by sample_posterior. Lower it to save memory
+    'posterior_mode': 'full_replay', # 'full_replay' replays the in-sample months for each posterior sample, 'shared_warmup' runs them once and only samples the out-of-sample rollouts
+    'posterior_workers': 0, # CPU only. n > 0 draws the posterior batches in n processes, with one seeded RNG stream per batch - the same samples for any n. 0 draws them in this process
+    'posterior_worker_threads': 1, # torch threads per posterior worker
+    'warmup_passes': 0, # shared_warmup only. 0 is a deterministic warm-up, n > 0 runs n warm-ups with dropout that the samples branch from
+    'posterior_mode_report': False, # compare the calibration of the two posterior modes in the evaluation
+    'posterior_quantiles': [0.05, 0.95], # quantiles of the posterior magnitudes estimated while sampling (P² sketches). [] for none
+    'save_posterior_samples': False, # also write the raw posterior samples of the land cells to a posterior store (see utils_posterior_store.py)
+    'posterior_store_dtype': 'float16', # 'float16' or 'float32'
+    'posterior_store_compression': False, # compress the shards of the posterior store (smaller, but a shard is read as a whole)
     'np_seed' : 4,
     'torch_seed' : 4,
     'window_dim' : 32,
@@ -28,6 +28,16 @@ def get_sweep_config():
         'min_events': {'value': 5},
         'samples': {'value': 600}, # 600 for run 10 for debug. should be a function of batches becaus batch 3 and sample 1000 = 3000....
         'batch_size': {'value':  3}, # just speed running here..
+        'batched_windows': {'value': False}, # True: one forward pass per month for the whole batch (BatchNorm over N windows)
+        'num_workers': {'value': 2}, # background window sampling
+        'prefetch_factor': {'value': 2},
+        'fused_lstm': {'value': False}, # True: fused LSTM gate convolutions (changes the state_dict layout)
+        'grouped_decoder': {'value': False}, # True: grouped decoder heads (changes the state_dict layout)
+        'tbptt_steps': {'value': 1}, # backward every month - same gradients as one backward per sequence
+        'checkpoint_unet': {'value': False},
+        'timing': {'value': False},
+        'timing_wandb': {'value': False},
+        'checkpoint_every': {'value': 0}, # sweep runs are not resumed
         "dropout_rate" : {'value' : 0.125},
         'learning_rate': {'value' :  0.001}, #0.001 default, but 0.005 might be better
         "weight_decay" : {'value' : 0.1},
@@ -43,6 +53,19 @@ def get_sweep_config():
         'loss_reg_a' : { 'value' : 256},
         'loss_reg_c' : { 'value' : 0.001},
         'test_samples': { 'value' :128}, # 128 for actual testing, 10 for debug
+        'inference_backend': {'value': 'eager'}, # the sweep evaluates the model it just trained, so nothing is exported
+        'inference_precision': {'value': 'float32'},
+        'precision_report': {'value': False},
+        'posterior_batch_size': {'value': 5}, # posterior samples drawn together
+        'posterior_mode': {'value': 'full_replay'}, # or 'shared_warmup'
+        'posterior_workers': {'value': 0}, # CPU posterior worker processes
+        'posterior_worker_threads': {'value': 1},
+        'warmup_passes': {'value': 0},
+        'posterior_mode_report': {'value': False},
+        'posterior_quantiles': {'value': []}, # no need for the quantiles in a sweep
+        'save_posterior_samples': {'value': False},
+        'posterior_store_dtype': {'value': 'float16'},
+        'posterior_store_compression': {'value': False},
         'np_seed' : {'values' : [4,8]},
         'torch_seed' : {'values' : [4,8]},
         'window_dim' : {'value' : 32},
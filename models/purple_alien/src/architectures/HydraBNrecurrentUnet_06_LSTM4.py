@@ -2,11 +2,21 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+# the order of the decoder heads in the grouped decoder
+DECODER_HEADS = ['head1_reg', 'head1_class', 'head2_reg', 'head2_class', 'head3_reg', 'head3_class']
+
+# In the separate decoder, head2 reg, head2 class and head3 class continue from the dropped out first layer of head1 class (dropped out once more), 
+# and head2 reg uses the second layer of head1 class. These are where each head of the grouped decoder takes its input from, so the two decoders are the same model.
+DECODER_D0_SOURCE = [0, 1, 1, 1, 4, 1]
+DECODER_D0_REDROP = torch.tensor([False, False, True, True, False, True])
+DECODER_D1_SOURCE = [0, 1, 1, 3, 4, 5]
 
 # why can't import????
 # give everything better names at some point
 class HydraBNUNet06_LSTM4(nn.Module):
-    def __init__(self, input_channels, total_hidden_channels, output_channels, dropout_rate):
+    def __init__(self, input_channels, total_hidden_channels, output_channels, dropout_rate, fused_lstm = False, grouped_decoder = False, checkpoint_unet = False):
         super().__init__()
 
         kernel_size = 3 
@@ -17,6 +27,11 @@ class HydraBNUNet06_LSTM4(nn.Module):
         num_lstm_state_layers = int(total_hidden_channels/(num_lstm_cells*2)) # *2 because both hs (short-term) and hl (long-term). This diffinetion ensures the number of total layers does not change when you change the number of lstm cells. But it could be changed to something else.
         
         self.base = base # to extract later
+        self.fused_lstm = fused_lstm # all gates of all four LSTMs in two convolutions, see _fused_lstm_forward
+        self.grouped_decoder = grouped_decoder # all six decoder heads in one grouped convolution per layer, see _grouped_decoder_forward
+        self.checkpoint_unet = checkpoint_unet # recompute the U-Net activations in the backward pass instead of keeping them, see _checkpointed_unet_forward
+        self.num_lstm_cells = num_lstm_cells
+        self.num_lstm_state_layers = num_lstm_state_layers
         
         # encoder (downsampling)
         self.enc_conv0 = nn.Conv2d(input_channels + int(total_hidden_channels/2), base, kernel_size, padding=1, bias = False) #input channels + total_hidden_channels) because you only concat x with hs and not hl. So it will always be half.
@@ -33,189 +48,173 @@ class HydraBNUNet06_LSTM4(nn.Module):
         self.bn_bottleneck_conv = nn.BatchNorm2d(base*4) 
         
 
-        # HEAD1 reg
-        self.upsample0_head1_reg = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
-        self.dec_conv0_head1_reg = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
-        self.bn_dec_conv0_head1_reg = nn.BatchNorm2d(base*2) 
+        # DECODERS
+        if grouped_decoder:
+
+            # The six heads (see DECODER_HEADS for the order) as grouped convs - one group per head. Same layers as the separate heads below.
+            # b is the same input for all heads, so the first upsampling is a plain ConvTranspose2d with the heads stacked along the output channels
+            num_heads = len(DECODER_HEADS)
+
+            self.upsample0_heads = nn.ConvTranspose2d(base*4, num_heads*base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
+            self.dec_conv0_heads = nn.Conv2d(num_heads*base*4, num_heads*base*2, kernel_size, padding=1, bias = False, groups = num_heads) # base+base=base*2 because of skip conneciton
+            self.bn_dec_conv0_heads = nn.BatchNorm2d(num_heads*base*2) 
+
+            self.upsample1_heads = nn.ConvTranspose2d(num_heads*base*2, num_heads*base, 2, stride= 2, padding= 0, output_padding= 0, groups = num_heads) # 8 -> 16
+            self.dec_conv1_heads = nn.Conv2d(num_heads*base*2, num_heads*base, kernel_size, padding=1, bias = False, groups = num_heads) # base+base=base*2 because of skip connection
+            self.bn_dec_conv1_heads = nn.BatchNorm2d(num_heads*base) 
+
+            self.dec_conv4_heads = nn.Conv2d(num_heads*base, num_heads*output_channels, kernel_size, padding=1, groups = num_heads)
+
+        else:
 
-        self.upsample1_head1_reg = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
-        self.dec_conv1_head1_reg = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
-        self.bn_dec_conv1_head1_reg = nn.BatchNorm2d(base) 
+            # HEAD1 reg
+            self.upsample0_head1_reg = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
+            self.dec_conv0_head1_reg = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
+            self.bn_dec_conv0_head1_reg = nn.BatchNorm2d(base*2) 
 
-        self.dec_conv4_head1_reg = nn.Conv2d(base, output_channels, kernel_size, padding=1) # 2 because reg and class
+            self.upsample1_head1_reg = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
+            self.dec_conv1_head1_reg = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
+            self.bn_dec_conv1_head1_reg = nn.BatchNorm2d(base) 
 
+            self.dec_conv4_head1_reg = nn.Conv2d(base, output_channels, kernel_size, padding=1) # 2 because reg and class
 
-        # HEAD1 class
-        self.upsample0_head1_class = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
-        self.dec_conv0_head1_class = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
-        self.bn_dec_conv0_head1_class = nn.BatchNorm2d(base*2) 
 
-        self.upsample1_head1_class = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
-        self.dec_conv1_head1_class = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
-        self.bn_dec_conv1_head1_class = nn.BatchNorm2d(base) 
+            # HEAD1 class
+            self.upsample0_head1_class = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
+            self.dec_conv0_head1_class = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
+            self.bn_dec_conv0_head1_class = nn.BatchNorm2d(base*2) 
 
-        self.dec_conv4_head1_class = nn.Conv2d(base, output_channels, 3, padding=1)
+            self.upsample1_head1_class = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
+            self.dec_conv1_head1_class = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
+            self.bn_dec_conv1_head1_class = nn.BatchNorm2d(base) 
+
+            self.dec_conv4_head1_class = nn.Conv2d(base, output_channels, 3, padding=1)
         
 
-        # HEAD2 reg
-        self.upsample0_head2_reg = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
-        self.dec_conv0_head2_reg = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
-        self.bn_dec_conv0_head2_reg = nn.BatchNorm2d(base*2) 
+            # HEAD2 reg
+            self.upsample0_head2_reg = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
+            self.dec_conv0_head2_reg = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
+            self.bn_dec_conv0_head2_reg = nn.BatchNorm2d(base*2) 
 
-        self.upsample1_head2_reg = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
-        self.dec_conv1_head2_reg = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
-        self.bn_dec_conv1_head2_reg = nn.BatchNorm2d(base) 
+            self.upsample1_head2_reg = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
+            self.dec_conv1_head2_reg = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
+            self.bn_dec_conv1_head2_reg = nn.BatchNorm2d(base) 
 
-        self.dec_conv4_head2_reg = nn.Conv2d(base, output_channels, 3, padding=1) # 2 because reg and class
+            self.dec_conv4_head2_reg = nn.Conv2d(base, output_channels, 3, padding=1) # 2 because reg and class
 
 
-        # HEAD2 class
-        self.upsample0_head2_class = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
-        self.dec_conv0_head2_class = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
-        self.bn_dec_conv0_head2_class = nn.BatchNorm2d(base*2) 
+            # HEAD2 class
+            self.upsample0_head2_class = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
+            self.dec_conv0_head2_class = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
+            self.bn_dec_conv0_head2_class = nn.BatchNorm2d(base*2) 
 
-        self.upsample1_head2_class = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
-        self.dec_conv1_head2_class = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
-        self.bn_dec_conv1_head2_class = nn.BatchNorm2d(base) 
+            self.upsample1_head2_class = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
+            self.dec_conv1_head2_class = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
+            self.bn_dec_conv1_head2_class = nn.BatchNorm2d(base) 
 
-        self.dec_conv4_head2_class = nn.Conv2d(base, output_channels, kernel_size, padding=1)
+            self.dec_conv4_head2_class = nn.Conv2d(base, output_channels, kernel_size, padding=1)
 
 
-        # HEAD3 reg
-        self.upsample0_head3_reg = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
-        self.dec_conv0_head3_reg = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
-        self.bn_dec_conv0_head3_reg = nn.BatchNorm2d(base*2) 
+            # HEAD3 reg
+            self.upsample0_head3_reg = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
+            self.dec_conv0_head3_reg = nn.Conv2d(base*4, base*2, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip conneciton
+            self.bn_dec_conv0_head3_reg = nn.BatchNorm2d(base*2) 
 
-        self.upsample1_head3_reg = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
-        self.dec_conv1_head3_reg = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
-        self.bn_dec_conv1_head3_reg = nn.BatchNorm2d(base) 
+            self.upsample1_head3_reg = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
+            self.dec_conv1_head3_reg = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
+            self.bn_dec_conv1_head3_reg = nn.BatchNorm2d(base) 
 
-        self.dec_conv4_head3_reg = nn.Conv2d(base, output_channels, kernel_size, padding=1) # 2 because reg and class
+            self.dec_conv4_head3_reg = nn.Conv2d(base, output_channels, kernel_size, padding=1) # 2 because reg and class
 
 
-        # HEAD3 class
-        self.upsample0_head3_class = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
-        self.dec_conv0_head3_class = nn.Conv2d(base*4, base*2, 3, padding=1, bias = False) # base+base=base*2 because of skip conneciton
-        self.bn_dec_conv0_head3_class = nn.BatchNorm2d(base*2) 
+            # HEAD3 class
+            self.upsample0_head3_class = nn.ConvTranspose2d(base*4, base*2, 2, stride= 2, padding= 0, output_padding= 0) # 4 -> 8
+            self.dec_conv0_head3_class = nn.Conv2d(base*4, base*2, 3, padding=1, bias = False) # base+base=base*2 because of skip conneciton
+            self.bn_dec_conv0_head3_class = nn.BatchNorm2d(base*2) 
 
-        self.upsample1_head3_class = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
-        self.dec_conv1_head3_class = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
-        self.bn_dec_conv1_head3_class = nn.BatchNorm2d(base) 
+            self.upsample1_head3_class = nn.ConvTranspose2d(base*2, base, 2, stride= 2, padding= 0, output_padding= 0) # 8 -> 16
+            self.dec_conv1_head3_class = nn.Conv2d(base*2, base, kernel_size, padding=1, bias = False) # base+base=base*2 because of skip connection
+            self.bn_dec_conv1_head3_class = nn.BatchNorm2d(base) 
 
-        self.dec_conv4_head3_class = nn.Conv2d(base, output_channels, kernel_size, padding=1)
+            self.dec_conv4_head3_class = nn.Conv2d(base, output_channels, kernel_size, padding=1)
 
         # Dropout
         self.dropout = nn.Dropout(p = dropout_rate)
 
         # LSTM
-
-        # LSTM 1
-        self.Wxi_1 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True) 
-        self.Whi_1 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxf_1 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Whf_1 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxc_1 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Whc_1 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxo_1 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Who_1 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-
-
-        # LSTM 2
-        self.Wxi_2 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Whi_2 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxf_2 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Whf_2 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxc_2 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Whc_2 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxo_2 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Who_2 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-
-
-        # LSTM 3
-        self.Wxi_3 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True) 
-        self.Whi_3 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxf_3 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Whf_3 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxc_3 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Whc_3 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxo_3 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Who_3 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-
-
-        # LSTM 4
-        self.Wxi_4 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True) 
-        self.Whi_4 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxf_4 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Whf_4 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxc_4 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Whc_4 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Wxo_4 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
-        self.Who_4 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+        if fused_lstm:
+
+            # one conv for the x part of all gates of all four LSTMs, and one grouped conv (a group per LSTM) for the hs part.
+            # The output channels are ordered LSTM by LSTM and within each LSTM gate by gate (i, f, c, o). See fuse_lstm_state_dict for the mapping
+            self.Wx_lstm = nn.Conv2d(input_channels, num_lstm_cells * 4 * num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wh_lstm = nn.Conv2d(num_lstm_cells * num_lstm_state_layers, num_lstm_cells * 4 * num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True, groups=num_lstm_cells)
+
+        else:
+
+            # LSTM 1
+            self.Wxi_1 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True) 
+            self.Whi_1 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxf_1 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Whf_1 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxc_1 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Whc_1 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxo_1 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Who_1 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+
+
+            # LSTM 2
+            self.Wxi_2 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Whi_2 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxf_2 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Whf_2 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxc_2 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Whc_2 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxo_2 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Who_2 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+
+
+            # LSTM 3
+            self.Wxi_3 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True) 
+            self.Whi_3 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxf_3 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Whf_3 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxc_3 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Whc_3 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxo_3 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Who_3 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+
+
+            # LSTM 4
+            self.Wxi_4 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True) 
+            self.Whi_4 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxf_4 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Whf_4 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxc_4 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Whc_4 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Wxo_4 = nn.Conv2d(input_channels, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
+            self.Who_4 = nn.Conv2d(num_lstm_state_layers, num_lstm_state_layers, kernel_size, padding=lstm_padding, bias=True)
 
 
     def forward(self, x, h):
 
-        # Splitting the hidden state tensor into 4 short-term memory tensors and 4 long-term memory tensors. 
-        split_h = int(h.shape[1] / 8) # 32/8 = 4. 32 is the dim of the full hidden state. 8 is the number of tensors we want to split it into. Each tensor is then 4 channels.
-        hs_1, hs_2, hs_3, hs_4, hl_1, hl_2, hl_3, hl_4 = torch.split(h, split_h, dim=1) 
+        if getattr(self, 'fused_lstm', False): # getattr because models saved before the fused LSTM do not have the attribute
+            hs, h = self._fused_lstm_forward(x, h)
 
-        #----------------- LSTM 1 -----------------
-        # Input gate
-        i_t_1 = torch.sigmoid(self.Wxi_1(x) + self.Whi_1(hs_1)) # Wxi changes to dims for x to the same as hs
-        # Forget gate
-        f_t_1 = torch.sigmoid(self.Wxf_1(x) + self.Whf_1(hs_1)) # Wxf changes to dims for x to the same as hs
-        # Cell state
-        hl_1_tilde = torch.tanh(self.Wxc_1(x) + self.Whc_1(hs_1)) # Wxc changes to dims for x to the same as hs
-        hl_1 = f_t_1 * hl_1 + i_t_1 * hl_1_tilde
-        # Output gate
-        o_t_1 = torch.sigmoid(self.Wxo_1(x) + self.Who_1(hs_1)) # Wxo changes to dims for x to the same as hs
-        
-        hs_1 = o_t_1 * torch.tanh(hl_1) # The "input" that is used in the U-net below
+        else:
+            hs, h = self._lstm_forward(x, h)
 
-        #----------------- LSTM 2 -----------------
-        # Input gate
-        i_t_2 = torch.sigmoid(self.Wxi_2(x) + self.Whi_2(hs_2)) # Wxi changes to dims for x to the same as hs
-        # Forget gate
-        f_t_2 = torch.sigmoid(self.Wxf_2(x) + self.Whf_2(hs_2)) # Wxf changes to dims for x to the same as hs
-        # Cell state
-        hl_2_tilde = torch.tanh(self.Wxc_2(x) + self.Whc_2(hs_2)) # Wxc changes to dims for x to the same as hs
-        hl_2 = f_t_2 * hl_2 + i_t_2 * hl_2_tilde
-        # Output gate
-        o_t_2 = torch.sigmoid(self.Wxo_2(x) + self.Who_2(hs_2)) # Wxo changes to dims for x to the same as hs
-        
-        hs_2 = o_t_2 * torch.tanh(hl_2) # The "input" that is used in the U-net below
+        x = torch.cat([x, hs], 1) # concatenating x and the new short term memory along the channels - x here as a skip connection
 
-        #----------------- LSTM 3 -----------------
-        # Input gate
-        i_t_3 = torch.sigmoid(self.Wxi_3(x) + self.Whi_3(hs_3)) # Wxi changes to dims for x to the same as hs
-        # Forget gate
-        f_t_3 = torch.sigmoid(self.Wxf_3(x) + self.Whf_3(hs_3)) # Wxf changes to dims for x to the same as hs
-        # Cell state
-        hl_3_tilde = torch.tanh(self.Wxc_3(x) + self.Whc_3(hs_3)) # Wxc changes to dims for x to the same as hs
-        hl_3 = f_t_3 * hl_3 + i_t_3 * hl_3_tilde
-        # Output gate
-        o_t_3 = torch.sigmoid(self.Wxo_3(x) + self.Who_3(hs_3)) # Wxo changes to dims for x to the same as hs
+        if getattr(self, 'checkpoint_unet', False) and self.training and torch.is_grad_enabled(): # only when training - there is no backward pass otherwise
+            out_reg, out_class = self._checkpointed_unet_forward(x)
 
-        hs_3 = o_t_3 * torch.tanh(hl_3) # The "input" that is used in the U-net below
+        else:
+            out_reg, out_class = self._unet_forward(x)
 
-        #----------------- LSTM 4 -----------------
-        # Input gate
-        i_t_4 = torch.sigmoid(self.Wxi_4(x) + self.Whi_4(hs_4)) # Wxi changes to dims for x to the same as hs
-        # Forget gate
-        f_t_4 = torch.sigmoid(self.Wxf_4(x) + self.Whf_4(hs_4)) # Wxf changes to dims for x to the same as hs
-        # Cell state
-        hl_4_tilde = torch.tanh(self.Wxc_4(x) + self.Whc_4(hs_4)) # Wxc changes to dims for x to the same as hs
-        hl_4 = f_t_4 * hl_4 + i_t_4 * hl_4_tilde
-        # Output gate
-        o_t_4 = torch.sigmoid(self.Wxo_4(x) + self.Who_4(hs_4)) # Wxo changes to dims for x to the same as hs
+        return out_reg, out_class, h # e0s here also hidden state - should take tanh of self.enc_conv0(x) but it does not appear to make a big difference....
 
-        hs_4 = o_t_4 * torch.tanh(hl_4) # The "input" that is used in the U-net below
-        
-        # -----------------
-        h = torch.cat([hs_1, hs_2, hs_3, hs_4, hl_1, hl_2, hl_3, hl_4], 1) # concatenating short and long term memory along the channels. What is carried forward to the next timestep. The concat is just to keep it tight...
-        # -----------------
 
-        x = torch.cat([x, hs_1, hs_2, hs_3, hs_4], 1) # concatenating x and the new short term memory along the channels - x here as a skip connection
+    def _unet_forward(self, x):
 
         # encoder
         e0s_ = F.relu(self.bn_enc_conv0(self.enc_conv0(x))) 
@@ -231,6 +230,48 @@ class HydraBNUNet06_LSTM4(nn.Module):
         b = self.dropout(b)
 
         # DECODERS #
+        if getattr(self, 'grouped_decoder', False): # getattr because models saved before the grouped decoder do not have the attribute
+            out_reg, out_class = self._grouped_decoder_forward(b, e1s, e0s)
+
+        else:
+            out_reg, out_class = self._decoder_forward(b, e1s, e0s)
+
+        return out_reg, out_class
+
+
+    def _checkpointed_unet_forward(self, x):
+
+        # The U-Net body with activation checkpointing: only x is kept for the backward pass, and the activations are recomputed there.
+        # The dropout masks are the same in the recomputation (the RNG state is restored), but the batch norm running stats must not be updated a second time.
+        calls = []
+
+        def unet_forward(x):
+
+            calls.append(1)
+
+            if len(calls) == 1: # the forward pass
+                return self._unet_forward(x)
+
+            batch_norms = [m for m in self.modules() if isinstance(m, nn.BatchNorm2d)]
+            momenta = [m.momentum for m in batch_norms]
+            num_batches_tracked = [m.num_batches_tracked.clone() for m in batch_norms]
+
+            for m in batch_norms: # the recomputation in the backward pass - momentum 0 keeps the running stats as they are
+                m.momentum = 0.0
+
+            try:
+                return self._unet_forward(x)
+
+            finally:
+                for m, momentum, tracked in zip(batch_norms, momenta, num_batches_tracked):
+                    m.momentum = momentum
+                    m.num_batches_tracked.copy_(tracked)
+
+        return checkpoint(unet_forward, x, use_reentrant = False)
+
+
+    def _decoder_forward(self, b, e1s, e0s):
+
         #H1 reg
         H1_d0 = F.relu(self.bn_dec_conv0_head1_reg(self.dec_conv0_head1_reg(torch.cat([self.upsample0_head1_reg(b),e1s],1))))
         H1_d0 = self.dropout(H1_d0)
@@ -338,19 +379,280 @@ class HydraBNUNet06_LSTM4(nn.Module):
         out_reg = torch.concat([out_reg1, out_reg2, out_reg3], dim=1)        
         out_class = torch.concat([out_class1, out_class2, out_class3], dim=1)
 
-        return out_reg, out_class, h # e0s here also hidden state - should take tanh of self.enc_conv0(x) but it does not appear to make a big difference....
+        return out_reg, out_class
+
+
+    def _grouped_decoder_forward(self, b, e1s, e0s):
+
+        # The same six heads as _decoder_forward, but one grouped conv per layer for all heads.
+        # Heads are stacked along dim 1 (N x heads x channels x H x W) between the layers, in the order of DECODER_HEADS.
+        N = b.shape[0]
+        num_heads = len(DECODER_HEADS)
+
+        u0 = self.upsample0_heads(b)
+        u0 = u0.view(N, num_heads, -1, u0.shape[-2], u0.shape[-1])
+        skip = e1s.unsqueeze(1).expand(-1, num_heads, -1, -1, -1) # the same skip connection for all heads
+        d0 = torch.cat([u0, skip], 2).flatten(1, 2) # per head: upsampled, skip - as the torch.cat in each head of _decoder_forward
+        d0 = self.dropout(F.relu(self.bn_dec_conv0_heads(self.dec_conv0_heads(d0))))
+        d0 = d0.view(N, num_heads, -1, d0.shape[-2], d0.shape[-1])
+
+        # head2 reg, head2 class and head3 class continue from the (dropped out) head1 class, dropped out once more (see _decoder_forward)
+        d0 = d0[:, DECODER_D0_SOURCE]
+        d0 = torch.where(DECODER_D0_REDROP.to(d0.device).view(1, -1, 1, 1, 1), self.dropout(d0), d0)
+
+        u1 = self.upsample1_heads(d0.flatten(1, 2))
+        u1 = u1.view(N, num_heads, -1, u1.shape[-2], u1.shape[-1])
+        skip = e0s.unsqueeze(1).expand(-1, num_heads, -1, -1, -1)
+        d1 = torch.cat([u1, skip], 2).flatten(1, 2)
+        d1 = F.relu(self.bn_dec_conv1_heads(self.dec_conv1_heads(d1)))
+        d1 = d1.view(N, num_heads, -1, d1.shape[-2], d1.shape[-1])
+
+        # head2 reg uses head1 class (before its dropout) - see _decoder_forward
+        d1 = self.dropout(d1[:, DECODER_D1_SOURCE])
+
+        out = self.dec_conv4_heads(d1.flatten(1, 2))
+        out = out.view(N, num_heads, -1, out.shape[-2], out.shape[-1]) # N x heads x output_channels x H x W
+
+        # RESTRUCTURE TO FIT "OLD" FORMAT. dim 1 should be depth
+        out_reg = F.relu(out[:, 0::2].flatten(1, 2)) # the reg heads
+        out_class = out[:, 1::2].flatten(1, 2) # the class heads
+
+        return out_reg, out_class
+
+
+    def _lstm_forward(self, x, h):
+
+        # Splitting the hidden state tensor into 4 short-term memory tensors and 4 long-term memory tensors. 
+        split_h = int(h.shape[1] / 8) # 32/8 = 4. 32 is the dim of the full hidden state. 8 is the number of tensors we want to split it into. Each tensor is then 4 channels.
+        hs_1, hs_2, hs_3, hs_4, hl_1, hl_2, hl_3, hl_4 = torch.split(h, split_h, dim=1) 
+
+        #----------------- LSTM 1 -----------------
+        # Input gate
+        i_t_1 = torch.sigmoid(self.Wxi_1(x) + self.Whi_1(hs_1)) # Wxi changes to dims for x to the same as hs
+        # Forget gate
+        f_t_1 = torch.sigmoid(self.Wxf_1(x) + self.Whf_1(hs_1)) # Wxf changes to dims for x to the same as hs
+        # Cell state
+        hl_1_tilde = torch.tanh(self.Wxc_1(x) + self.Whc_1(hs_1)) # Wxc changes to dims for x to the same as hs
+        hl_1 = f_t_1 * hl_1 + i_t_1 * hl_1_tilde
+        # Output gate
+        o_t_1 = torch.sigmoid(self.Wxo_1(x) + self.Who_1(hs_1)) # Wxo changes to dims for x to the same as hs
+        
+        hs_1 = o_t_1 * torch.tanh(hl_1) # The "input" that is used in the U-net below
 
+        #----------------- LSTM 2 -----------------
+        # Input gate
+        i_t_2 = torch.sigmoid(self.Wxi_2(x) + self.Whi_2(hs_2)) # Wxi changes to dims for x to the same as hs
+        # Forget gate
+        f_t_2 = torch.sigmoid(self.Wxf_2(x) + self.Whf_2(hs_2)) # Wxf changes to dims for x to the same as hs
+        # Cell state
+        hl_2_tilde = torch.tanh(self.Wxc_2(x) + self.Whc_2(hs_2)) # Wxc changes to dims for x to the same as hs
+        hl_2 = f_t_2 * hl_2 + i_t_2 * hl_2_tilde
+        # Output gate
+        o_t_2 = torch.sigmoid(self.Wxo_2(x) + self.Who_2(hs_2)) # Wxo changes to dims for x to the same as hs
+        
+        hs_2 = o_t_2 * torch.tanh(hl_2) # The "input" that is used in the U-net below
 
-    def init_h(self, hidden_channels, dim): # could have x as input and then take x.shape
+        #----------------- LSTM 3 -----------------
+        # Input gate
+        i_t_3 = torch.sigmoid(self.Wxi_3(x) + self.Whi_3(hs_3)) # Wxi changes to dims for x to the same as hs
+        # Forget gate
+        f_t_3 = torch.sigmoid(self.Wxf_3(x) + self.Whf_3(hs_3)) # Wxf changes to dims for x to the same as hs
+        # Cell state
+        hl_3_tilde = torch.tanh(self.Wxc_3(x) + self.Whc_3(hs_3)) # Wxc changes to dims for x to the same as hs
+        hl_3 = f_t_3 * hl_3 + i_t_3 * hl_3_tilde
+        # Output gate
+        o_t_3 = torch.sigmoid(self.Wxo_3(x) + self.Who_3(hs_3)) # Wxo changes to dims for x to the same as hs
 
-        hs = torch.zeros((1,hidden_channels,dim,dim), dtype= torch.float64)
+        hs_3 = o_t_3 * torch.tanh(hl_3) # The "input" that is used in the U-net below
+
+        #----------------- LSTM 4 -----------------
+        # Input gate
+        i_t_4 = torch.sigmoid(self.Wxi_4(x) + self.Whi_4(hs_4)) # Wxi changes to dims for x to the same as hs
+        # Forget gate
+        f_t_4 = torch.sigmoid(self.Wxf_4(x) + self.Whf_4(hs_4)) # Wxf changes to dims for x to the same as hs
+        # Cell state
+        hl_4_tilde = torch.tanh(self.Wxc_4(x) + self.Whc_4(hs_4)) # Wxc changes to dims for x to the same as hs
+        hl_4 = f_t_4 * hl_4 + i_t_4 * hl_4_tilde
+        # Output gate
+        o_t_4 = torch.sigmoid(self.Wxo_4(x) + self.Who_4(hs_4)) # Wxo changes to dims for x to the same as hs
+
+        hs_4 = o_t_4 * torch.tanh(hl_4) # The "input" that is used in the U-net below
+        
+        # -----------------
+        h = torch.cat([hs_1, hs_2, hs_3, hs_4, hl_1, hl_2, hl_3, hl_4], 1) # concatenating short and long term memory along the channels. What is carried forward to the next timestep. The concat is just to keep it tight...
+        # -----------------
+
+        return torch.cat([hs_1, hs_2, hs_3, hs_4], 1), h
+
+
+    def _fused_lstm_forward(self, x, h):
+
+        # The same four LSTMs as _lstm_forward, but all gates in two convolutions instead of 32.
+        N, _, H, W = x.shape
+        S = self.num_lstm_state_layers
+
+        hs, hl = torch.split(h, self.num_lstm_cells * S, dim=1) # the short-term memory of the four LSTMs and then their long-term memory
+
+        gates = self.Wx_lstm(x) + self.Wh_lstm(hs) # each LSTM only sees its own hs (grouped conv)
+        gates = gates.view(N, self.num_lstm_cells, 4, S, H, W) # LSTM x gate x channels
+
+        i_t = torch.sigmoid(gates[:, :, 0]) # Input gate
+        f_t = torch.sigmoid(gates[:, :, 1]) # Forget gate
+        hl_tilde = torch.tanh(gates[:, :, 2]) # Cell state
+        o_t = torch.sigmoid(gates[:, :, 3]) # Output gate
+
+        hl = f_t * hl.view(N, self.num_lstm_cells, S, H, W) + i_t * hl_tilde
+        hs = o_t * torch.tanh(hl)
+
+        hs = hs.reshape(N, self.num_lstm_cells * S, H, W) # back to hs_1, hs_2, hs_3, hs_4 along the channels
+        hl = hl.reshape(N, self.num_lstm_cells * S, H, W)
+
+        h = torch.cat([hs, hl], 1) # same layout as in _lstm_forward
+
+        return hs, h
+
+
+    def init_h(self, hidden_channels, dim, batch_size = 1): # could have x as input and then take x.shape
+
+        hs = torch.zeros((batch_size,hidden_channels,dim,dim), dtype= torch.float64) # one hidden state per window in the batch
         
         return hs 
 
-    def init_hTtime(self, hidden_channels, H, W):
+    def init_hTtime(self, hidden_channels, H, W, batch_size = 1):
         
         # works
-        hs = torch.abs(torch.randn((1,hidden_channels, H, W), dtype= torch.float64) * torch.exp(torch.tensor(-100))) 
-        hs = torch.zeros((1,hidden_channels, H, W), dtype= torch.float64)
+        hs = torch.abs(torch.randn((batch_size,hidden_channels, H, W), dtype= torch.float64) * torch.exp(torch.tensor(-100))) 
+        hs = torch.zeros((batch_size,hidden_channels, H, W), dtype= torch.float64)
 
         return hs
+
+
+LSTM_GATES = ['i', 'f', 'c', 'o'] # the order of the gates in the fused LSTM convs
+
+
+def fuse_lstm_state_dict(state_dict, num_lstm_cells = 4):
+
+    """
+    Converts a state dict of HydraBNUNet06_LSTM4 with the 32 separate LSTM convs (Wxi_1, Whi_1, ... Who_4) to the fused layout 
+    (Wx_lstm and the grouped Wh_lstm). All other parameters are kept as they are.
+    The output channels of the fused convs are ordered LSTM by LSTM and within each LSTM gate by gate (i, f, c, o).
+    """
+
+    fused_state_dict = {k: v for k, v in state_dict.items() if not (k.startswith('Wx') or k.startswith('Wh'))}
+
+    for part in ['x', 'h']:
+        for param in ['weight', 'bias']:
+            fused_state_dict[f'W{part}_lstm.{param}'] = torch.cat([state_dict[f'W{part}{gate}_{cell}.{param}'] for cell in range(1, num_lstm_cells + 1) for gate in LSTM_GATES], 0)
+
+    return fused_state_dict
+
+
+def group_decoder_state_dict(state_dict):
+
+    """
+    Converts a state dict of HydraBNUNet06_LSTM4 with the six separate decoder heads (upsample0_head1_reg, dec_conv0_head1_reg, ...) to the grouped 
+    decoder (upsample0_heads, dec_conv0_heads, ...). The heads are stacked in the order of DECODER_HEADS. All other parameters are kept as they are.
+    """
+
+    layers = ['upsample0', 'dec_conv0', 'bn_dec_conv0', 'upsample1', 'dec_conv1', 'bn_dec_conv1', 'dec_conv4']
+    grouped_state_dict = {k: v for k, v in state_dict.items() if not any(k.startswith(f'{layer}_head') for layer in layers)}
+
+    for layer in layers:
+
+        params = [k.split('.')[-1] for k in state_dict if k.startswith(f'{layer}_{DECODER_HEADS[0]}.')]
+
+        for param in params:
+            tensors = [state_dict[f'{layer}_{head}.{param}'] for head in DECODER_HEADS]
+
+            if param == 'num_batches_tracked': # the same for all heads
+                grouped_state_dict[f'{layer}_heads.{param}'] = tensors[0]
+
+            elif layer == 'upsample0' and param == 'weight': # ConvTranspose2d weights are in x out - the heads share the input
+                grouped_state_dict[f'{layer}_heads.{param}'] = torch.cat(tensors, 1)
+
+            else:
+                grouped_state_dict[f'{layer}_heads.{param}'] = torch.cat(tensors, 0)
+
+    return grouped_state_dict
+
+
+def get_model_kwargs(model):
+
+    """Returns the arguments HydraBNUNet06_LSTM4 was built with, read from its layers (so it also works for models pickled before the arguments were stored)."""
+
+    fused_lstm = getattr(model, 'fused_lstm', False)
+    grouped_decoder = getattr(model, 'grouped_decoder', False)
+
+    return {
+        'input_channels' : model.Wx_lstm.in_channels if fused_lstm else model.Wxi_1.in_channels,
+        'total_hidden_channels' : model.base,
+        'output_channels' : model.dec_conv4_heads.out_channels // len(DECODER_HEADS) if grouped_decoder else model.dec_conv4_head1_reg.out_channels,
+        'dropout_rate' : model.dropout.p,
+        'fused_lstm' : fused_lstm,
+        'grouped_decoder' : grouped_decoder,
+    }
+
+
+def convert_model(model, fused_lstm = None, grouped_decoder = None):
+
+    """
+    Returns a copy of a (trained) HydraBNUNet06_LSTM4 with the fused LSTM and/or the grouped decoder, e.g. for a model loaded from an existing .pt artifact.
+    None keeps the model as it is in that respect. Only the conversion to the fused/grouped layers is supported, not back.
+    The model is returned as is if there is nothing to convert.
+    """
+
+    kwargs = get_model_kwargs(model)
+    state_dict = model.state_dict()
+
+    if fused_lstm is not None and fused_lstm != kwargs['fused_lstm']:
+        if not fused_lstm:
+            raise ValueError('Converting a fused LSTM back to the separate LSTM convs is not supported')
+        
+        state_dict = fuse_lstm_state_dict(state_dict)
+        kwargs['fused_lstm'] = True
+
+    if grouped_decoder is not None and grouped_decoder != kwargs['grouped_decoder']:
+        if not grouped_decoder:
+            raise ValueError('Converting a grouped decoder back to the separate decoder heads is not supported')
+
+        state_dict = group_decoder_state_dict(state_dict)
+        kwargs['grouped_decoder'] = True
+
+    if kwargs == get_model_kwargs(model):
+        return model
+
+    converted_model = HydraBNUNet06_LSTM4(**kwargs)
+    converted_model.load_state_dict(state_dict) # load_state_dict copies into the float32 parameters, so the dtype is restored below
+    converted_model.train(model.training)
+
+    param = next(model.parameters())
+
+    return converted_model.to(device = param.device, dtype = param.dtype)
+
+
+def conversion_equivalence_test(model, converted_model, window_dim = 32, batch_size = 2, atol = 1e-5):
+
+    """
+    Checks that a model converted with convert_model gives the same output as the original, for random inputs and hidden states, in eval mode.
+    Returns the max absolute difference and raises a ValueError if it is larger than atol.
+    """
+
+    model.eval()
+    converted_model.eval()
+
+    device = next(model.parameters()).device
+    x = torch.rand(batch_size, get_model_kwargs(model)['input_channels'], window_dim, window_dim, device = device)
+    h = torch.randn(batch_size, model.base, window_dim, window_dim, device = device)
+
+    with torch.no_grad():
+        outputs = model(x, h)
+        converted_outputs = converted_model(x, h)
+
+    max_abs_diff = max((output - converted_output).abs().max().item() for output, converted_output in zip(outputs, converted_outputs))
+
+    if max_abs_diff > atol:
+        raise ValueError(f'The converted model differs from the original by {max_abs_diff} (atol {atol})')
+
+    print(f'Conversion equivalence test passed. Max abs diff: {max_abs_diff}')
+
+    return max_abs_diff
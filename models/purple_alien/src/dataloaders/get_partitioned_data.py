@@ -10,7 +10,7 @@ from set_path import setup_project_paths, setup_data_paths
 setup_project_paths(PATH)
 
 # Import necessary functions
-from utils_dataloaders import fetch_or_load_views_df, create_or_load_views_vol, parse_args, get_alert_help_string
+from utils_dataloaders import fetch_or_load_views_dfs, create_or_load_views_vol, parse_args, get_alert_help_string
 from utils_dataloaders import publish_drift_detection_test_ps
 from common_configs import config_drift_detection
 
@@ -46,14 +46,15 @@ if __name__ == "__main__":
 
     with wandb.init(project=project, entity="views_pipeline", config=config, notes=get_alert_help_string()):
 
-        # Process calibration data if flag is set
-
-        self_test = True
+        # Fetch all requested partitions at once. Calibration and testing are sliced from a single fetch of the testing months
+        views_dfs = fetch_or_load_views_dfs('purple_alien', partitions_to_process, PATH_RAW, self_test=True,
+                                            use_saved=args.saved, override_month=args.override_month, use_cache=args.cache,
+                                            compact=args.compact)
 
+        # Process calibration data if flag is set
         if args.calibration:
 
-            df_cal, alerts_cal = fetch_or_load_views_df('calibration', PATH_RAW, self_test, args.saved)
-            self_test = False
+            df_cal, alerts_cal = views_dfs['calibration']
             for ialert, alert in enumerate(str(alerts_cal).strip('[').strip(']').split('Input')):
                 if 'offender' in alert:
                     wandb.log({f"calibration data alert {ialert}": str(alert)})
@@ -66,8 +67,7 @@ if __name__ == "__main__":
         # Process testing data if flag is set
         if args.testing:
 
-            df_test, alerts_test = fetch_or_load_views_df('testing', PATH_RAW, self_test, args.saved)
-            self_test = False
+            df_test, alerts_test = views_dfs['testing']
             for ialert, alert in enumerate(str(alerts_test).strip('[').strip(']').split('Input')):
                 if 'offender' in alert:
                     wandb.log({f"test data alert {ialert}": str(alert)})
@@ -79,9 +79,7 @@ if __name__ == "__main__":
 
         # Process forecasting data if flag is set
         if args.forecasting:
-            df_forecast, alerts_forecast = fetch_or_load_views_df('forecasting', PATH_RAW, self_test, args.saved,
-                                                                  args.override_month)
-            self_test = False
+            df_forecast, alerts_forecast = views_dfs['forecasting']
             for ialert, alert in enumerate(str(alerts_forecast).strip('[').strip(']').split('Input')):
                 if 'offender' in alert:
                     wandb.log({f"forecasting data alert {ialert}": str(alert)})
@@ -21,7 +21,7 @@ setup_project_paths(PATH)
 
 
 from utils import choose_model, choose_loss, choose_sheduler, get_train_tensors, get_full_tensor, apply_dropout, execute_freeze_h_option, train_log, init_weights, get_data
-from utils_prediction import predict, sample_posterior
+from utils_prediction import predict, sample_posterior, aggregate_posterior
 from config_hyperparameters import get_hp_config
 
 
@@ -44,16 +44,23 @@ def generate_forecast(model, views_vol, config, device, PATH):
     model.eval()
     model.apply(apply_dropout)
 
-    # Generate posterior samples and out-of-sample volumes
-    posterior_list, posterior_list_class, out_of_sample_vol, _ = sample_posterior(model, views_vol, config, device) # the _ is the full tensor. 
+    # Set up paths for storing generated data
+    _, _, PATH_GENERATED = setup_data_paths(PATH)
+
+    # the raw posterior samples are only kept (in a posterior store of land cells, see utils_posterior_store.py) if asked for
+    if getattr(config, 'save_posterior_samples', False):
+        path_store = f'{PATH_GENERATED}/posterior_store_{config.time_steps}_{config.run_type}_{config.model_time_stamp}'
+
+    else:
+        path_store = None
+
+    # Generate and aggregate posterior samples and out-of-sample volumes
+    aggregator, out_of_sample_vol, _, _, _ = aggregate_posterior(model, views_vol, config, device, path_store) # the _ are the meta vol, full tensor and metadata tensor.
     
     # I suspect you'll need the out_of_sample_vol to create the df (it has pg and ocean info)
     # However, I see in the test_prediction_store notebook in "conflictnet" repo that I load the "calibration_vol" from the pickle file.... Investigate... 
 
 
-    # Set up paths for storing generated data
-    _, _, PATH_GENERATED = setup_data_paths(PATH)
-
     # Create the directory if it does not exist
     os.makedirs(PATH_GENERATED, exist_ok=True)
 
@@ -62,8 +69,7 @@ def generate_forecast(model, views_vol, config, device, PATH):
 
     # Create a dictionary to store posterior data
     posterior_dict = {
-        'posterior_list': posterior_list,
-        'posterior_list_class': posterior_list_class,
+        **aggregator.to_dict(),                         # mean, std and quantiles - the raw samples are in path_store, if saved
         'out_of_sample_vol': out_of_sample_vol          # you might need this for the df creation before predstore. Experiments in notebook test_to_prediction_store.ipynb
     }
 
@@ -34,13 +34,16 @@ def execute_single_run(args):
     hyperparameters['run_type'] = args.run_type
     hyperparameters['sweep'] = False
 
+    if getattr(args, 'inference_backend', None) is not None: # override the backend in the config for this run
+        hyperparameters['inference_backend'] = args.inference_backend
+
     # get run type and denoting project name - check convention!
     project = f"purple_alien_{args.run_type}"
 
     if args.run_type == 'calibration' or args.run_type == 'testing':
 
         #model_run_manager(config = hyperparameters, project = project, train = args.train, eval = args.evaluate, forecast = False, artifact_name = args.artifact_name)        
-        execute_model_tasks(config = hyperparameters, project = project, train = args.train, eval = args.evaluate, forecast = False, artifact_name = args.artifact_name)
+        execute_model_tasks(config = hyperparameters, project = project, train = args.train, eval = args.evaluate, forecast = False, artifact_name = args.artifact_name, resume = getattr(args, 'resume', False))
 
     elif args.run_type == 'forecasting':
 
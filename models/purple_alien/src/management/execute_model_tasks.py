@@ -6,19 +6,20 @@ from pathlib import Path
 
 PATH = Path(__file__)
 sys.path.insert(0, str(Path(*[i for i in PATH.parts[:PATH.parts.index("views_pipeline")+1]]) / "common_utils")) # PATH_COMMON_UTILS  
-from set_path import setup_project_paths, setup_artifacts_paths
+from set_path import setup_project_paths, setup_artifacts_paths, setup_data_paths
 setup_project_paths(PATH)
 
 from utils import choose_model, choose_loss, choose_sheduler, get_train_tensors, get_full_tensor, apply_dropout, execute_freeze_h_option, train_log, init_weights, get_data
 from utils_wandb import add_wandb_monthly_metrics
 from utils_device import setup_device
+from utils_timing import setup_timing
 from train_model import make, training_loop, train_model_artifact #handle_training
 # from evaluate_sweep import evaluate_posterior # see if it can be more genrel to a single model as well... 
 from evaluate_model import evaluate_posterior, evaluate_model_artifact #handle_evaluation
 from generate_forecast import forecast_with_model_artifact #handle_forecasting
 
 
-def execute_model_tasks(config = None, project = None, train = None, eval = None, forecast = None, artifact_name = None):
+def execute_model_tasks(config = None, project = None, train = None, eval = None, forecast = None, artifact_name = None, resume = False):
 
     """
         Executes various model-related tasks including training, evaluation, and forecasting.
@@ -34,6 +35,7 @@ def execute_model_tasks(config = None, project = None, train = None, eval = None
         eval: Flag to indicate if the model should be evaluated.
         forecast: Flag to indicate if forecasting should be performed.
         artifact_name (optional): Specific name of the model artifact to load for evaluation or forecasting.
+        resume (optional): Continue the training from the last training checkpoint of the run type, if there is one.
     """
 
     # Define the path for the artifacts
@@ -50,6 +52,10 @@ def execute_model_tasks(config = None, project = None, train = None, eval = None
         # Update config from WandB initialization above
         config = wandb.config
 
+        # time the training and inference phases to a JSONL file (and WandB), if config.timing is set (see utils_timing.py)
+        _, _, PATH_GENERATED = setup_data_paths(PATH)
+        setup_timing(config, PATH_GENERATED, device)
+
         # Retrieve data (partition) based on the configuration
         views_vol = get_data(config) # a bit HydraNet specific, but it is fine for now. If statment or move to handle_training, handle_evaluation, and handle_forecasting?
 
@@ -66,7 +72,7 @@ def execute_model_tasks(config = None, project = None, train = None, eval = None
         # Handle the single model runs: train and save the model as an artifact
         if train:
             #handle_training(config, device, views_vol, PATH_ARTIFACTS)
-            train_model_artifact(config, device, views_vol, PATH_ARTIFACTS)
+            train_model_artifact(config, device, views_vol, PATH_ARTIFACTS, resume)
 
         # Handle the single model runs: evaluate a trained model (artifact)
         if eval:
@@ -27,12 +27,16 @@ setup_project_paths(PATH)
 
 
 from utils import choose_model, choose_loss, choose_sheduler, get_train_tensors, get_full_tensor, apply_dropout, execute_freeze_h_option, train_log, init_weights, get_data
-from utils_prediction import predict, sample_posterior
+from utils_prediction import predict, sample_posterior, aggregate_posterior, posterior_mode_report, inference_precision_report
 from utils_artifacts import get_latest_model_artifact
 from utils_wandb import generate_wandb_log_dict, generate_wandb_mean_metrics_log_dict
 from config_sweep import get_sweep_config
 from config_hyperparameters import get_hp_config
 from utils_hydranet_outputs import output_to_df, evaluation_to_df, save_model_outputs
+from utils_metrics import get_metric_arrays, fill_evaluation_dicts
+from HydraBNrecurrentUnet_06_LSTM4 import convert_model, conversion_equivalence_test
+from utils_export import export_model, set_inference_precision
+from utils_timing import timer
 
 
 from utils_model_outputs import ModelOutputs
@@ -57,7 +61,16 @@ def evaluate_posterior(model, views_vol, config, device): # is eval in config?
         None
     """ 
 
-    posterior_list, posterior_list_class, out_of_sample_vol, out_of_sample_meta_vol, full_tensor, metadata_tensor = sample_posterior(model, views_vol, config, device)
+    # the raw posterior samples are only kept (in a posterior store of land cells, see utils_posterior_store.py) if asked for
+    if getattr(config, 'save_posterior_samples', False) and not config.sweep:
+        _, _, PATH_GENERATED = setup_data_paths(PATH)
+        path_store = f'{PATH_GENERATED}/posterior_store_{config.time_steps}_{config.run_type}_{config.model_time_stamp}'
+
+    else:
+        path_store = None
+
+    # the samples are aggregated as they are drawn, so they never all have to be in memory
+    aggregator, out_of_sample_vol, out_of_sample_meta_vol, full_tensor, metadata_tensor = aggregate_posterior(model, views_vol, config, device, path_store)
 
     #if eval:
     dict_of_eval_dicts = {}
@@ -66,13 +79,26 @@ def evaluate_posterior(model, views_vol, config, device): # is eval in config?
     dict_of_outputs_dicts = {}
     dict_of_outputs_dicts = {k: ModelOutputs.make_output_dict(steps=config.time_steps) for k in ["sb", "ns", "os"]}
 
-    # Get mean and std
-    mean_array = np.array(posterior_list).mean(axis = 0) # get mean for each month!
-    std_array = np.array(posterior_list).std(axis = 0)
+    # Get mean and std - of the land cells only (see get_land_cells), so months x features x cells
+    mean_array = aggregator.mean # get mean for each month!
+    std_array = aggregator.std
+
+    mean_class_array = aggregator.mean_class # get mean for each month!
+    std_class_array = aggregator.std_class
+
+    # gather the observed values and the metadata of the land cells once, with the same land cell index
+    cells = aggregator.cells
+    n_months = out_of_sample_vol.shape[1]
 
-    mean_class_array = np.array(posterior_list_class).mean(axis = 0) # get mean for each month!
-    std_class_array = np.array(posterior_list_class).std(axis = 0)
+    land_true_array = out_of_sample_vol[0].reshape(n_months, out_of_sample_vol.shape[2], -1)[..., cells]  # months x features x cells
+    land_meta_array = out_of_sample_meta_vol[0].cpu().numpy().reshape(n_months, out_of_sample_meta_vol.shape[2], -1)[..., cells] # months x metadata features x cells
 
+    # MSE, Brier, AP and AUC for all steps and features at once (see utils_metrics.py)
+    with timer.phase('metrics'):
+        metric_arrays = get_metric_arrays(land_true_array, mean_array, mean_class_array)
+        dict_of_eval_dicts = fill_evaluation_dicts(dict_of_eval_dicts, metric_arrays)
+
+    timer.flush('metrics', 0)
 
     for t in range(mean_array.shape[0]): #  0 of mean array is the temporal dim    
 
@@ -84,35 +110,28 @@ def evaluate_posterior(model, views_vol, config, device): # is eval in config?
             step = f"step{str(t+1).zfill(2)}"
 
             # get the scores
-            y_score = mean_array[t,i,:,:].reshape(-1) # make it 1d  # nu 180x180 
-            y_score_prob = mean_class_array[t,i,:,:].reshape(-1) # nu 180x180 
+            y_score = mean_array[t,i,:] # already 1d - the land cells
+            y_score_prob = mean_class_array[t,i,:]
 
             # do not really know what to do with these yet.
-            y_var = std_array[t,i,:,:].reshape(-1)  # nu 180x180  
-            y_var_prob = std_class_array[t,i,:,:].reshape(-1)  # nu 180x180 
+            y_var = std_array[t,i,:]
+            y_var_prob = std_class_array[t,i,:]
 
             # see this is the out of sample vol - fine for evaluation but not for forecasting
             # but also the place where you get the pgm.. 
 
             #if eval:
-            y_true = out_of_sample_vol[:,t,i,:,:].reshape(-1)  # nu 180x180 . dim 0 is time     THE TRICK IS NOW TO USE A df -> vol and not out_of_sample_vol...
+            y_true = land_true_array[t,i,:]  # THE TRICK IS NOW TO USE A df -> vol and not out_of_sample_vol...
             y_true_binary = (y_true > 0) * 1
 
             # in theorty you could just use the metadata tensor to get pg and c id here
-            pg_id = out_of_sample_meta_vol[:,t,0,:,:].reshape(-1)  # nu 180x180, dim 1 is time . dim 2 is feature. feature 0 is pg_id
-            c_id = out_of_sample_meta_vol[:,t,4,:,:].reshape(-1)  # nu 180x180, dim 1 is time . dim 2 is feature. feature 4 is c_id
-            month_id = out_of_sample_meta_vol[:,t,3,:,:].reshape(-1)  # nu 180x180, dim 1 is time . dim 2 is feature. feature 3 is month_id
+            pg_id = land_meta_array[t,0,:]  # dim 0 is time . dim 1 is feature. feature 0 is pg_id
+            c_id = land_meta_array[t,4,:]  # feature 4 is c_id
+            month_id = land_meta_array[t,3,:]  # feature 3 is month_id
 
             dict_of_outputs_dicts[j][step].y_true = y_true
             dict_of_outputs_dicts[j][step].y_true_binary = y_true_binary
 
-            #else: # you need to make sure this works for forecasting
-                # in theorty you could just use the metadata tensor to get pg and c id here
-            pg_id = out_of_sample_meta_vol[:,t,0,:,:].reshape(-1)  # nu 180x180, dim 1 is time . dim 2 is feature. feature 0 is pg_id
-            c_id = out_of_sample_meta_vol[:,t,4,:,:].reshape(-1)  # nu 180x180, dim 1 is time . dim 2 is feature. feature 4 is c_id
-            month_id = out_of_sample_meta_vol[:,t,3,:,:].reshape(-1)  # nu 180x180, dim 1 is time . dim 2 is feature. feature 3 is month_id
-
-
             dict_of_outputs_dicts[j][step].y_score = y_score
             dict_of_outputs_dicts[j][step].y_score_prob = y_score_prob
             dict_of_outputs_dicts[j][step].y_var = y_var
@@ -123,13 +142,6 @@ def evaluate_posterior(model, views_vol, config, device): # is eval in config?
             dict_of_outputs_dicts[j][step].step = t +1 # 1 indexed, bc the first step is 1 month ahead
             dict_of_outputs_dicts[j][step].month_id = month_id
 
-            #if eval:   
-
-            dict_of_eval_dicts[j][step].MSE = mean_squared_error(y_true, y_score)
-            dict_of_eval_dicts[j][step].AP = average_precision_score(y_true_binary, y_score_prob)
-            dict_of_eval_dicts[j][step].AUC = roc_auc_score(y_true_binary, y_score_prob)
-            dict_of_eval_dicts[j][step].Brier = brier_score_loss(y_true_binary, y_score_prob)
-
             # note that this actually upates the dict of eval dicts with new stepwise metric values
             log_dict = generate_wandb_log_dict(log_dict, dict_of_eval_dicts, j, step)
 
@@ -142,12 +154,36 @@ def evaluate_posterior(model, views_vol, config, device): # is eval in config?
 
     if not config.sweep:
 
-        posterior_dict = {'posterior_list' : posterior_list, 'posterior_list_class': posterior_list_class, 'out_of_sample_vol' : out_of_sample_vol}
+        posterior_dict = {**aggregator.to_dict(), 'out_of_sample_vol' : out_of_sample_vol} # mean, std and quantiles - the raw samples are in path_store, if saved
         save_model_outputs(PATH, config, posterior_dict, dict_of_outputs_dicts, dict_of_eval_dicts, full_tensor, metadata_tensor)
 
     else:
         print('Running sweep. NO posterior dict, metric dict, or test vol pickled+dumped')
 
+    # compare the calibration of the shared warm-up and the full replay posterior modes
+    if getattr(config, 'posterior_mode_report', False):
+
+        df_report = posterior_mode_report(model, views_vol, config, device)
+        print(df_report.to_string(index = False))
+        wandb.log({'posterior_mode_report': wandb.Table(dataframe = df_report)})
+
+        if not config.sweep:
+            _, _, PATH_GENERATED = setup_data_paths(PATH)
+            Path(PATH_GENERATED).mkdir(parents=True, exist_ok=True)
+            df_report.to_csv(f'{PATH_GENERATED}/posterior_mode_report_{config.time_steps}_{config.run_type}_{config.model_time_stamp}.csv', index = False)
+
+    # compare the bf16 posterior against the float32 posterior - run it on the calibration partition before using config.inference_precision = 'bfloat16'
+    if getattr(config, 'precision_report', False):
+
+        df_report = inference_precision_report(model, views_vol, config, device)
+        print(df_report.to_string(index = False))
+        wandb.log({'precision_report': wandb.Table(dataframe = df_report)})
+
+        if not config.sweep:
+            _, _, PATH_GENERATED = setup_data_paths(PATH)
+            Path(PATH_GENERATED).mkdir(parents=True, exist_ok=True)
+            df_report.to_csv(f'{PATH_GENERATED}/precision_report_{config.time_steps}_{config.run_type}_{config.model_time_stamp}.csv', index = False)
+
 
 def evaluate_model_artifact(config, device, views_vol, PATH_ARTIFACTS, artifact_name=None):
 #def handle_evaluation(config, device, views_vol, PATH_ARTIFACTS, artifact_name=None):
@@ -202,6 +238,19 @@ def evaluate_model_artifact(config, device, views_vol, PATH_ARTIFACTS, artifact_
 
     # load the model
     model = torch.load(PATH_MODEL_ARTIFACT)
+
+    # artifacts trained with the separate LSTM convs or decoder heads are converted to the fused LSTM and/or the grouped decoder - the outputs are checked to be the same
+    converted_model = convert_model(model, fused_lstm = getattr(config, 'fused_lstm', None) or None, grouped_decoder = getattr(config, 'grouped_decoder', None) or None)
+
+    if converted_model is not model:
+        conversion_equivalence_test(model, converted_model)
+        model = converted_model
+
+    # run the month steps as an exported graph (torchscript, compile or onnx), cached next to the artifact. 'eager' keeps the model as it is
+    model = export_model(model, PATH_MODEL_ARTIFACT, backend = getattr(config, 'inference_backend', 'eager'))
+
+    # opt-in reduced precision (bf16 autocast) for the posterior samples. Check it with config.precision_report first
+    model = set_inference_precision(model, getattr(config, 'inference_precision', 'float32'))
     
     # get the exact model date_time stamp for the pkl files made in the evaluate_posterior from evaluation.py
     #model_time_stamp = os.path.basename(PATH_MODEL_ARTIFACT)[-18:-3] # 18 is the length of the timestamp string + ".pt", and -3 is to remove the .pt file extension. a bit hardcoded, but very simple and should not change.
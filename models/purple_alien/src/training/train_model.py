@@ -18,7 +18,9 @@ sys.path.insert(0, str(Path(*[i for i in PATH.parts[:PATH.parts.index("views_pip
 from set_path import setup_project_paths, setup_artifacts_paths
 setup_project_paths(PATH)
 
-from utils import choose_model, choose_loss, choose_sheduler, get_train_tensors, get_full_tensor, apply_dropout, execute_freeze_h_option, train_log, init_weights, get_data
+from utils import choose_model, choose_loss, choose_sheduler, get_train_tensors, get_full_tensor, apply_dropout, execute_freeze_h_option, train_log, init_weights, get_data, get_event_index, get_sample_batch, get_window_loader
+from utils_checkpoint import get_path_checkpoint, get_training_state, set_training_state, load_checkpoint, CheckpointWriter
+from utils_timing import timer
 #from config_sweep import get_swep_config
 from config_hyperparameters import get_hp_config
 
@@ -43,24 +45,63 @@ def make(config, device):
     return(model, criterion, optimizer, scheduler) #, dataloaders, dataset_sizes)
 
 
-def train(model, optimizer, scheduler, criterion_reg, criterion_class, multitaskloss_instance, views_vol, sample, config, device): # views vol and sample
+def get_channel_losses(criterion, pred, target):
+
+    """
+    The loss of each channel of pred (N x C x H x W) against target. ShrinkageLoss and FocalLoss compute all channels in one pass (channel_losses),
+    other criteria (e.g. nn.MSELoss) are called once per channel.
+    """
+
+    if hasattr(criterion, 'channel_losses'):
+        return criterion.channel_losses(pred, target)
+
+    return torch.stack([criterion(pred[:,j,:,:], target[:,j,:,:]) for j in range(pred.shape[1])]) # index 0 is batch dim, 1 is channel dim (here pred), 2 is H dim, 3 is W dim
+
+
+def get_losses(t1_pred, t1_pred_class, t1, t1_binary, criterion_reg, criterion_class, multitaskloss_instance):
+
+    """
+    The multi-task loss of one month and its regression and classification parts (for the logging). 
+    The regression losses of the reg heads come first, then the classification losses of the class heads, as the is_regression of MultiTaskLoss.
+    """
+
+    losses = torch.cat([get_channel_losses(criterion_reg, t1_pred, t1), get_channel_losses(criterion_class, t1_pred_class, t1_binary)])
+    loss = multitaskloss_instance(losses)
+
+    loss_reg = losses[:t1_pred.shape[1]].sum() # sum the reg losses
+    loss_class = losses[t1_pred.shape[1]:].sum() # and the class losses
+
+    return loss, loss_reg, loss_class
+
+
+def train(model, optimizer, scheduler, criterion_reg, criterion_class, multitaskloss_instance, views_vol, sample, config, device, event_index = None, train_tensor = None): # views vol and sample
 
     wandb.watch(model, [criterion_reg, criterion_class], log= None, log_freq=2048)
 
-    avg_loss_reg_list = []
-    avg_loss_class_list = []
-    avg_loss_list = []
+    # the running sum of the loss, the reg loss and the class loss over the months. Kept on the device, so it is only synced once for train_log
+    loss_sums = torch.zeros(3, device = device)
+    n_months = 0
     total_loss = 0
 
     model.train()  # train mode
     multitaskloss_instance.train() # meybe another place...
 
+    # truncated BPTT: backward every tbptt_steps months (see the sequence loop). 0 keeps all months in the graph and does one backward at the end
+    tbptt_steps = getattr(config, 'tbptt_steps', 0)
+
+    optimizer.zero_grad() # before the sequence loops, since the truncated BPTT accumulates the gradients in them
+
+    if getattr(config, 'batched_windows', False):
+        train_batched(model, optimizer, scheduler, criterion_reg, criterion_class, multitaskloss_instance, views_vol, sample, config, device, event_index, train_tensor)
+        return
+
 
     # Batch loops:
     for batch in range(config.batch_size):
 
         # Getting the train_tensor
-        train_tensor = get_train_tensors(views_vol, sample, config, device)
+        with timer.phase('window_sampling'):
+            train_tensor = get_train_tensors(views_vol, sample, config, device, event_index)
         seq_len = train_tensor.shape[1]
         window_dim = train_tensor.shape[-1] # the last dim should always be a spatial dim (H or W)
 
@@ -76,56 +117,151 @@ def train(model, optimizer, scheduler, criterion_reg, criterion_class, multitask
             t1 = train_tensor[:, i+1, :, :, :]
             t1_binary = (t1.clone().detach().requires_grad_(True) > 0) * 1.0 # 1.0 to ensure float. Should avoid cloning warning now.
 
-            # forward-pass
-            t1_pred, t1_pred_class, h = model(t0, h.detach())
-        
-            losses_list = []
+            # forward-pass. With truncated BPTT h is detached at the end of each unroll instead (so the gradient flows through h within it)
+            with timer.phase('forward'):
+                t1_pred, t1_pred_class, h = model(t0, h if tbptt_steps > 0 else h.detach())
+
+            # all reg and class channels at once (see get_losses)
+            with timer.phase('loss'):
+                loss, loss_reg, loss_class = get_losses(t1_pred, t1_pred_class, t1, t1_binary, criterion_reg, criterion_class, multitaskloss_instance)
+
+                total_loss += loss
 
-            for j in range(t1_pred.shape[1]): # first each reggression loss. Should be 1 channel, as I conccat the reg heads on dim = 1
+                # traning output - no sync with the host here
+                loss_sums += torch.stack([loss, loss_reg, loss_class]).detach()
+                n_months += 1
 
-                losses_list.append(criterion_reg(t1_pred[:,j,:,:], t1[:,j,:,:])) # index 0 is batch dim, 1 is channel dim (here pred), 2 is H dim, 3 is W dim
+            # truncated BPTT: backpropagate the unroll and free its graph. The gradients add up until the optimizer step below
+            if tbptt_steps > 0 and ((i + 1) % tbptt_steps == 0 or i == seq_len - 2):
+                with timer.phase('backward'):
+                    total_loss.backward()
+                total_loss = 0
+                h = h.detach()
+
+
+    # log each sequence/timeline/batch - the one sync of the losses per sample
+    avg_loss, avg_loss_reg, avg_loss_class = (loss_sums / n_months).tolist()
+    train_log([avg_loss], [avg_loss_reg], [avg_loss_class]) # FIX!!!
+
+    # Backpropagation and optimization - after a full sequence... 
+    if tbptt_steps == 0:
+        with timer.phase('backward'):
+            total_loss.backward()
 
-            for j in range(t1_pred_class.shape[1]): # then each classification loss. Should be 1 channel, as I conccat the class heads on dim = 1
+    with timer.phase('optimizer'):
 
-                losses_list.append(criterion_class(t1_pred_class[:,j,:,:], t1_binary[:,j,:,:])) # index 0 is batch dim, 1 is channel dim (here pred), 2 is H dim, 3 is W dim
+        # Gradient Clipping
+        if config.clip_grad_norm == True:
+            clip_value = 1.0
+            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=clip_value)
 
-            losses = torch.stack(losses_list)
-            loss = multitaskloss_instance(losses)
+        else:
+            pass
 
-            total_loss += loss
+        # optimize
+        optimizer.step()
 
-            # traning output
-            loss_reg = losses[:t1_pred.shape[1]].sum() # sum the reg losses
-            loss_class = losses[-t1_pred.shape[1]:].sum() # assuming 
+        # Adjust learning rate based on the loss
+        scheduler.step()
 
-            avg_loss_reg_list.append(loss_reg.detach().cpu().numpy().item())
-            avg_loss_class_list.append(loss_class.detach().cpu().numpy().item())
-            avg_loss_list.append(loss.detach().cpu().numpy().item())
 
+def train_batched(model, optimizer, scheduler, criterion_reg, criterion_class, multitaskloss_instance, views_vol, sample, config, device, event_index = None, train_tensor = None):
+
+    """
+    The batched version of the batch loop in train, used when config.batched_windows is True.
+    All config.batch_size windows are stacked into one N x T x C x H x W tensor (get_train_batch), 
+    so each month is a single forward pass for the whole batch instead of one pass per window.
+    The losses average over the batch, so they are multiplied by the batch size to keep the same scale as the 
+    sum over windows in the unbatched loop. Note that batch norm now normalizes over all windows in the batch.
+    train_tensor is a batch already sampled by the window loader (get_window_loader). If None, the batch is sampled here, 
+    from the same per-sample seeds as in the window loader (get_sample_batch), so the batches do not depend on config.num_workers.
+
+    With config.tbptt_steps = k > 0 (truncated BPTT) the loss is backpropagated every k months and the graph freed, so the memory scales with k 
+    instead of the sequence length. The hidden state is detached at the end of each unroll. The gradients add up over the unrolls and the optimizer 
+    steps once per batch as before. k = 1 gives the same gradients as one backward at the end (h is detached every month there).
+    """
+
+    tbptt_steps = getattr(config, 'tbptt_steps', 0)
+
+    optimizer.zero_grad() # before the sequence loop, since the truncated BPTT accumulates the gradients in it
+
+    # the running sum of the loss (per window), the reg loss and the class loss over the months. Kept on the device, so it is only synced once for train_log
+    loss_sums = torch.zeros(3, device = device)
+    total_loss = 0
 
-    # log each sequence/timeline/batch
-    train_log(avg_loss_list, avg_loss_reg_list, avg_loss_class_list) # FIX!!!
+    # Getting the batch of windows
+    if train_tensor is None:
+        with timer.phase('window_sampling'):
+            train_tensor = get_sample_batch(views_vol, sample, config, event_index)
+
+    with timer.phase('host_to_device'):
+        train_tensor = train_tensor.to(device, non_blocking = True) # pinned when training on cuda with the window loader
+    N = train_tensor.shape[0] # batch size
+    seq_len = train_tensor.shape[1]
+    window_dim = train_tensor.shape[-1] # the last dim should always be a spatial dim (H or W)
+
+    # initialize a hidden state for each window
+    h = model.init_h(hidden_channels = model.base, dim = window_dim, batch_size = N).float().to(device)
+
+    # Sequens loop rnn style
+    for i in range(seq_len-1): # so your sequnce is the full time len - last month.
+        print(f'\t\t month: {i+1}/{seq_len}...', end='\r')
+
+        t0 = train_tensor[:, i, :, :, :]
+
+        t1 = train_tensor[:, i+1, :, :, :]
+        t1_binary = (t1 > 0) * 1.0 # 1.0 to ensure float.
+
+        # forward-pass. With truncated BPTT h is detached at the end of each unroll instead (so the gradient flows through h within it)
+        with timer.phase('forward'):
+            t1_pred, t1_pred_class, h = model(t0, h if tbptt_steps > 0 else h.detach())
+
+        # all reg and class channels at once (see get_losses)
+        with timer.phase('loss'):
+            loss, loss_reg, loss_class = get_losses(t1_pred, t1_pred_class, t1, t1_binary, criterion_reg, criterion_class, multitaskloss_instance)
+
+            total_loss += loss * N # same scale as the sum over the windows in the unbatched loop
+
+            # traning output - per window, as in the unbatched loop. No sync with the host here
+            loss_sums += torch.stack([loss, loss_reg, loss_class]).detach()
+
+        # truncated BPTT: backpropagate the unroll and free its graph
+        if tbptt_steps > 0 and ((i + 1) % tbptt_steps == 0 or i == seq_len - 2):
+            with timer.phase('backward'):
+                total_loss.backward()
+            total_loss = 0
+            h = h.detach()
+
+    # log each sequence/timeline/batch - the one sync of the losses per sample
+    avg_loss, avg_loss_reg, avg_loss_class = (loss_sums / (seq_len - 1)).tolist()
+    train_log([avg_loss], [avg_loss_reg], [avg_loss_class])
 
     # Backpropagation and optimization - after a full sequence... 
-    optimizer.zero_grad()
-    total_loss.backward()
+    if tbptt_steps == 0:
+        with timer.phase('backward'):
+            total_loss.backward()
 
-    # Gradient Clipping
-    if config.clip_grad_norm == True:
-        clip_value = 1.0
-        torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=clip_value)
+    with timer.phase('optimizer'):
 
-    else:
-        pass
+        # Gradient Clipping
+        if config.clip_grad_norm == True:
+            clip_value = 1.0
+            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=clip_value)
 
-    # optimize
-    optimizer.step()
+        # optimize
+        optimizer.step()
 
-    # Adjust learning rate based on the loss
-    scheduler.step()
+        # Adjust learning rate based on the loss
+        scheduler.step()
 
 
-def training_loop(config, model, criterion, optimizer, scheduler, views_vol, device):
+def training_loop(config, model, criterion, optimizer, scheduler, views_vol, device, PATH_CHECKPOINT = None, resume = False):
+
+    """
+    Trains the model for config.samples samples. If PATH_CHECKPOINT is given, the training state is saved there every config.checkpoint_every samples 
+    (see utils_checkpoint.py), and with resume = True the training continues from the checkpoint there, if there is one. 
+    A resumed run gives the same model as a run that was never stopped.
+    """
 
     # # add spatail transformer
 
@@ -133,17 +269,58 @@ def training_loop(config, model, criterion, optimizer, scheduler, views_vol, dev
 
     np.random.seed(config.np_seed)
     torch.manual_seed(config.torch_seed)
+
+    start_sample = 0
+
+    if resume and PATH_CHECKPOINT is not None:
+        state = load_checkpoint(PATH_CHECKPOINT)
+
+        if state is None:
+            print(f'No checkpoint found at {PATH_CHECKPOINT}. Training from scratch...')
+
+        else: # after the seeding above, since the checkpoint has the RNG states of the interrupted run
+            start_sample = set_training_state(state, model, optimizer, scheduler, multitaskloss_instance)
+            print(f'Resuming from {PATH_CHECKPOINT} at sample {start_sample+1}/{config.samples}')
+
     print(f'Training initiated...')
 
-    for sample in range(config.samples):
+    # count the events per cell once, instead of for every sample and batch in get_window_index
+    event_index = get_event_index(views_vol, config)
+
+    # sample the batches in background workers while training, if there are any
+    if getattr(config, 'batched_windows', False) and getattr(config, 'num_workers', 0) > 0:
+        window_loader = get_window_loader(views_vol, config, device, event_index, start_sample)
+
+    else:
+        window_loader = [None] * (config.samples - start_sample) # sample the windows in train
 
-        print(f'Sample: {sample+1}/{config.samples}', end = '\r')
+    # write the checkpoints in the background, so the training does not wait for the disk
+    checkpoint_every = getattr(config, 'checkpoint_every', 0)
+    checkpoint_writer = CheckpointWriter(PATH_CHECKPOINT) if PATH_CHECKPOINT is not None and checkpoint_every > 0 else None
 
-        train(model, optimizer, scheduler , criterion_reg, criterion_class, multitaskloss_instance, views_vol, sample, config, device)
+    try:
+        # the wait for the next batch of the window loader is timed as window sampling (see utils_timing.py)
+        for sample, train_tensor in zip(range(start_sample, config.samples), timer.iterate('window_sampling', window_loader)):
+
+            print(f'Sample: {sample+1}/{config.samples}', end = '\r')
+
+            train(model, optimizer, scheduler , criterion_reg, criterion_class, multitaskloss_instance, views_vol, sample, config, device, event_index, train_tensor)
+
+            # no snapshot after the last sample - the model is saved as an artifact then
+            if checkpoint_writer is not None and (sample + 1) % checkpoint_every == 0 and sample + 1 < config.samples:
+                with timer.phase('checkpoint'):
+                    checkpoint_writer.save(get_training_state(model, optimizer, scheduler, multitaskloss_instance, sample + 1))
+
+            # one line of phase timings per sample, if the timing is on
+            timer.flush('train', sample)
+
+    finally: # also finish the last write if the training fails
+        if checkpoint_writer is not None:
+            checkpoint_writer.close()
 
     print('training done...')
 
-def train_model_artifact(config, device, views_vol, PATH_ARTIFACTS):
+def train_model_artifact(config, device, views_vol, PATH_ARTIFACTS, resume = False):
 #def handle_training(config, device, views_vol, PATH_ARTIFACTS):
     
     """
@@ -158,13 +335,17 @@ def train_model_artifact(config, device, views_vol, PATH_ARTIFACTS):
         device: The device (torch.device) to run the model on (CPU or GPU).
         views_vol: The tensor containing the input data for training.
         PATH_ARTIFACTS: The path where model artifacts are stored.
+        resume: Continue the training from the last checkpoint of the run type (see training_loop), if there is one.
     """
 
     # Create the model, criterion, optimizer and scheduler
     model, criterion, optimizer, scheduler = make(config, device)
+
+    # the training checkpoints go in a subfolder of the artifacts folder
+    PATH_CHECKPOINT = get_path_checkpoint(PATH_ARTIFACTS, config.run_type)
     
     # Train the model
-    training_loop(config, model, criterion, optimizer, scheduler, views_vol, device)
+    training_loop(config, model, criterion, optimizer, scheduler, views_vol, device, PATH_CHECKPOINT, resume)
     print('Done training')
 
     # just in case the artifacts folder does not exist
@@ -177,6 +358,10 @@ def train_model_artifact(config, device, views_vol, PATH_ARTIFACTS):
     
     # save the model
     torch.save(model, PATH_MODEL_ARTIFACT)
+
+    # the checkpoint is not needed once the model is saved - and should not be resumed by the next run
+    if PATH_CHECKPOINT.exists():
+        os.remove(PATH_CHECKPOINT)
     
     # done
     print(f"Model saved as: {PATH_MODEL_ARTIFACT}")
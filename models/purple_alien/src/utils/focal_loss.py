@@ -11,9 +11,7 @@ class FocalLoss(nn.Module):
         self.gamma = gamma  # Focal loss focusing parameter
         self.reduction = reduction  # Loss reduction method
 
-    def forward(self, logits, targets):
-
-        logits, targets = logits.unsqueeze(0), targets.unsqueeze(0)
+    def _elementwise(self, logits, targets):
 
         # since you are not taking log(p) anywhere, you don't need to clamp it for numerical stability.
         p = torch.sigmoid(logits)
@@ -26,6 +24,14 @@ class FocalLoss(nn.Module):
             alpha_t = self.alpha * targets + (1 - self.alpha) * (1 - targets) 
             loss = alpha_t * loss # multiple alpha_t with targets here to balance the loss
 
+        return loss
+
+    def forward(self, logits, targets):
+
+        logits, targets = logits.unsqueeze(0), targets.unsqueeze(0)
+
+        loss = self._elementwise(logits, targets)
+
         if self.reduction == 'mean':
             return loss.mean()  # Average the loss if reduction is set to 'mean'
         elif self.reduction == 'sum':
@@ -33,3 +39,17 @@ class FocalLoss(nn.Module):
         else:
             return loss  # Return the focal loss without reduction
 
+    def channel_losses(self, logits, targets):
+
+        # The loss of each channel (dim 1) of N x C x H x W inputs in one pass - the same as calling forward on logits[:, j] for each channel j.
+        # Only for the 'mean' and 'sum' reductions.
+        if self.reduction not in ['mean', 'sum']:
+            raise ValueError(f"channel_losses needs the 'mean' or 'sum' reduction, not '{self.reduction}'")
+
+        loss = self._elementwise(logits, targets)
+        dims = [d for d in range(loss.dim()) if d != 1]
+
+        if self.reduction == 'sum':
+            return loss.sum(dim = dims)
+        else:
+            return loss.mean(dim = dims)
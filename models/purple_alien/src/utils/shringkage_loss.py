@@ -9,16 +9,33 @@ class ShrinkageLoss(nn.Module):
         self.c = c  # Threshold
         self.size_average = size_average
 
-    def forward(self, input, target):
-
-        input, target = input.unsqueeze(0), target.unsqueeze(0) 
+    def _elementwise(self, input, target):
 
         l = torch.abs(target - input)  # Absolute difference between target and input
         exp_term = torch.exp(self.a * (self.c - l))  # Exponential term to control the sensitivity of the loss to deviations from the target values.
         loss = (l ** 2) / (1 + exp_term)  # Shrinkage loss calculation
 
+        return loss
+
+    def forward(self, input, target):
+
+        input, target = input.unsqueeze(0), target.unsqueeze(0) 
+
+        loss = self._elementwise(input, target)
+
         if self.size_average:
             return loss.mean()  # Average the loss if size_average is True
         else:
             return loss.sum()  # Sum the loss if size_average is False
 
+    def channel_losses(self, input, target):
+
+        # The loss of each channel (dim 1) of N x C x H x W inputs in one pass - the same as calling forward on input[:, j] for each channel j.
+        loss = self._elementwise(input, target)
+        dims = [d for d in range(loss.dim()) if d != 1]
+
+        if self.size_average:
+            return loss.mean(dim = dims)
+        else:
+            return loss.sum(dim = dims)
+
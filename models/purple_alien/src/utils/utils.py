@@ -33,13 +33,15 @@ sys.path.insert(0, str(Path(*[i for i in PATH.parts[:PATH.parts.index("views_pip
 from set_path import setup_project_paths, setup_data_paths
 setup_project_paths(PATH)
 
+from utils_df_to_vol_conversion import load_vol
+
 
 def choose_model(config, device):
 
     """More models can be added here. The model is chosen based on the config.model parameter."""
 
     if config.model == 'HydraBNUNet06_LSTM4':
-        unet = HydraBNUNet06_LSTM4(config.input_channels, config.total_hidden_channels, config.output_channels, config.dropout_rate).to(device)
+        unet = HydraBNUNet06_LSTM4(config.input_channels, config.total_hidden_channels, config.output_channels, config.dropout_rate, fused_lstm = getattr(config, 'fused_lstm', False), grouped_decoder = getattr(config, 'grouped_decoder', False), checkpoint_unet = getattr(config, 'checkpoint_unet', False)).to(device)
 
     else:
         print('no model...')
@@ -197,6 +199,9 @@ def get_data(config):
     """Return the data for either the calibration, the test run or an actual forecast.
     The shape for the views_vol is (N, C, H, W, D) where D is features.
     Right now the features are ln_best_sb, ln_best_ns, ln_best_os
+
+    The volume is memory-mapped as float32 (see load_vol in utils_df_to_vol_conversion.py), so it is not read into memory 
+    and the tensors built from it by get_full_tensor share its memory instead of copying it.
     """
 
     # Data
@@ -210,7 +215,7 @@ def get_data(config):
         file_name = f'/{run_type}_vol.npy' # NOT WINDOWS FRIENDLY
         # debug print
         print(f'Loading {run_type} data from {file_name}...')
-        views_vol = np.load(str(PATH_PROCESSED) + file_name)
+        views_vol = load_vol(str(PATH_PROCESSED) + file_name, dtype = np.float32, mmap_mode = 'c')
     
     except FileNotFoundError as e:
         print(f'File not found: {e}. Run correct dataloader get_calibration_data.py, get_test_data.py or get_forecasting_data.py. Now exiting...')
@@ -265,13 +270,44 @@ def my_decay(sample, samples, min_events, max_events, slope_ratio, roof_ratio):
     return(int(y))
 
 
-def get_window_index(views_vol, config, sample): 
+def get_event_index(views_vol, config):
+
+    """Precompute, once before training, the cells get_window_index samples from.
+    For each feature (fatcat) the number of months with events is counted for every cell. 
+    Then, for every threshold t from 1 to the max count, the (row-major, flat) indices of the cells with at least t events are stored.
+    The memory needed is the total number of cell-months with events (per feature), so it stays small.
+    get_window_index can then find the cells above the decaying min_events threshold with a lookup instead of scanning the volume."""
+
+    ln_best_sb_idx = config.first_feature_idx # 5 = ln_best_sb 
+    last_feature_idx = ln_best_sb_idx + config.input_channels
+
+    event_index = {}
+
+    for fatcat in range(ln_best_sb_idx, last_feature_idx):
+
+        views_vol_count = np.count_nonzero(views_vol[:,:,:,fatcat], axis = 0) # for either sb, ns, os
+        counts = views_vol_count.ravel()
+        max_events = counts.max()
+
+        # cells_by_threshold[t] holds the cells with counts >= t, in the same row-major order as np.where
+        cells_by_threshold = [np.arange(counts.size)] + [np.flatnonzero(counts >= t) for t in range(1, max_events + 1)]
+
+        event_index[fatcat] = {'max_events' : max_events, 'width' : views_vol_count.shape[1], 'cells_by_threshold' : cells_by_threshold}
+
+    return event_index
+
+
+def get_window_index(views_vol, config, sample, event_index = None): 
 
     """Draw/sample a cell which serves as the ancor for the sampeled window/patch drawn from the traning tensor.
     The dimensions of the windows are HxWxD, 
     where H=D in {16,32,64} and D is the number of months in the training data.
     The windows are constrained to be sampled from an area with some
-    minimum number of log_best events (min_events)."""
+    minimum number of log_best events (min_events).
+    
+    Pass the event_index from get_event_index (computed once before training) to avoid recounting the events in the full volume for every sample.
+    The cells above the threshold are then a lookup and the draw is constant time. 
+    The same cell is drawn as without the index, given the same state of np.random."""
 
 
     # BY NOW THIS IS PRETTY HACKY... SHOULD BE MADE MORE ELEGANT AT SOME POINT..
@@ -288,26 +324,27 @@ def get_window_index(views_vol, config, sample):
     n_fatcats = len(fatcats)
 
     fatcat = fatcats[sample % n_fatcats]
-    views_vol_count = np.count_nonzero(views_vol[:,:,:,fatcat], axis = 0) #.sum(axis=2) #for either sb, ns, os
+
+    if event_index is None:
+        event_index = get_event_index(views_vol, config) # slow path: recount the full volume
     
     # --------------------------------------------------------------------------------------------------------------------------------
 
-    max_events = views_vol_count.max()
+    fatcat_index = event_index[fatcat]
+    max_events = fatcat_index['max_events']
     min_events = my_decay(sample, samples, min_events, max_events, slope_ratio, roof_ratio)
     
-    min_events_index = np.where(views_vol_count >= min_events) # number of events so >= 1 or > 0 is the same as np.nonzero
+    # number of events so >= 1 or > 0 is the same as np.nonzero. Counts are integers, so any threshold below 1 includes all cells
+    min_events_cells = fatcat_index['cells_by_threshold'][max(min_events, 0)]
 
-    min_events_row = min_events_index[0]
-    min_events_col = min_events_index[1]
+    #indx = random.choice(min_events_indx) RANDOMENESS!!!!
+    cell = min_events_cells[np.random.choice(len(min_events_cells))] # dumb but working solution of np.random instead of random
 
     # it is index... Not lat long.
-    min_events_indx = [(row, col) for row, col in zip(min_events_row, min_events_col)] 
-
-    #indx = random.choice(min_events_indx) RANDOMENESS!!!!
-    indx = min_events_indx[np.random.choice(len(min_events_indx))] # dumb but working solution of np.random instead of random
+    row_indx, col_indx = divmod(int(cell), fatcat_index['width'])
 
     # if you want a random temporal window, it is here.
-    window_index = {'row_indx':indx[0], 'col_indx':indx[1]} 
+    window_index = {'row_indx':row_indx, 'col_indx':col_indx} 
 
     return(window_index)
 
@@ -353,26 +390,29 @@ def train_log(avg_loss_list, avg_loss_reg_list, avg_loss_class_list):
 
 
 # Should rename to sub_tensor or something like that... But it is used for training.. 
-def get_train_tensors(views_vol, sample, config, device): 
+def get_train_tensors(views_vol, sample, config, device, event_index = None): 
 
     """Uses the get_window_index and get_window_coords functions to sample a window from the training tensor. 
     The window is returned as a tensor of size 1 x config.time_steps x config.input_channels x 180 x 180.
-    A few spatial transformations are applied to the tensor at the end."""
+    A few spatial transformations are applied to the tensor at the end.
+    event_index is the precomputed index from get_event_index, passed on to get_window_index."""
 
     # Not using the last 36 months - these ar for test set
     train_views_vol = views_vol[:-config.time_steps] 
 
  #   min_max_values = 
-    window_index = get_window_index(views_vol = views_vol, config = config, sample = sample) # you should try and take this out of the loop - so you keep the index but changes the window_coords!!!
+    window_index = get_window_index(views_vol = views_vol, config = config, sample = sample, event_index = event_index) # you should try and take this out of the loop - so you keep the index but changes the window_coords!!!
     window_coords = get_window_coords(window_index = window_index, config = config)
 
     # you can add positional encoding here if you want - perhaps.....
 
-    input_window = train_views_vol[ : , window_coords['min_row_indx'] : window_coords['max_row_indx'] , window_coords['min_col_indx'] : window_coords['max_col_indx'], :]
-
     ln_best_sb_idx = config.first_feature_idx # 5 = ln_best_sb
     last_feature_idx = ln_best_sb_idx + config.input_channels
-    train_tensor = torch.tensor(input_window).float().to(device).unsqueeze(dim=0).permute(0,1,4,2,3)[:, :, ln_best_sb_idx:last_feature_idx, :, :]
+
+    # only the feature channels in use are read from the (memory-mapped) volume and copied into the tensor
+    input_window = train_views_vol[ : , window_coords['min_row_indx'] : window_coords['max_row_indx'] , window_coords['min_col_indx'] : window_coords['max_col_indx'], ln_best_sb_idx:last_feature_idx]
+
+    train_tensor = torch.tensor(input_window).float().to(device).unsqueeze(dim=0).permute(0,1,4,2,3)
 
     # Reshape
     N = train_tensor.shape[0] # batch size. Always one - remember your do batch a different way here
@@ -393,6 +433,144 @@ def get_train_tensors(views_vol, sample, config, device):
     return train_tensor
 
 
+def get_train_batch(views_vol, sample, config, device, event_index = None):
+
+    """Samples config.batch_size windows and stacks them into a single batch, the batched version of get_train_tensors. 
+    Each window is drawn as in get_train_tensors (get_window_index and get_window_coords) and the batch is returned as a tensor 
+    of size config.batch_size x config.time_steps x config.input_channels x window_dim x window_dim.
+    The random horizontal and vertical flips are drawn for each window separately, as they are for single windows."""
+
+    # Not using the last 36 months - these ar for test set
+    train_views_vol = views_vol[:-config.time_steps] 
+
+    ln_best_sb_idx = config.first_feature_idx # 5 = ln_best_sb
+    last_feature_idx = ln_best_sb_idx + config.input_channels
+
+    input_windows = []
+
+    for _ in range(config.batch_size):
+
+        window_index = get_window_index(views_vol = views_vol, config = config, sample = sample, event_index = event_index)
+        window_coords = get_window_coords(window_index = window_index, config = config)
+
+        input_windows.append(train_views_vol[ : , window_coords['min_row_indx'] : window_coords['max_row_indx'] , window_coords['min_col_indx'] : window_coords['max_col_indx'], ln_best_sb_idx:last_feature_idx])
+
+    # N x months x H x W x features -> N x months x features x H x W
+    train_tensor = torch.tensor(np.stack(input_windows)).float().to(device).permute(0,1,4,2,3)
+
+    # data augmentation (can be turned of for final experiments). One coin flip per window and direction
+    N = train_tensor.shape[0]
+    flip_h = (torch.rand(N, device = device) < 0.5).view(N, 1, 1, 1, 1)
+    flip_v = (torch.rand(N, device = device) < 0.5).view(N, 1, 1, 1, 1)
+
+    train_tensor = torch.where(flip_h, train_tensor.flip(-1), train_tensor) # horizontal flip is along W
+    train_tensor = torch.where(flip_v, train_tensor.flip(-2), train_tensor) # vertical flip is along H
+
+    return train_tensor
+
+
+class WindowSampler(torch.utils.data.IterableDataset):
+
+    """Samples the training batches (get_train_batch) in DataLoader worker processes, so the windows for the next samples 
+    are selected, cropped and flipped while the model trains on the current one. Yields one batch per sample, in sample order.
+
+    Worker w gets samples w, w + num_workers, ... and the DataLoader reads the workers round-robin, so the batches come out in 
+    the order of the training loop. Each batch is drawn from the seeds of its sample (see get_sample_batch), so the batches 
+    are the same for any number of workers - and the same as the ones train_batched samples itself without workers.
+
+    The memory-mapped volume is not pickled to the workers - they reopen the .npy file read-only, so all workers share the 
+    same pages instead of each holding a copy of the volume.
+
+    start_sample skips the samples before it, e.g. when the training is resumed from a checkpoint."""
+
+    def __init__(self, views_vol, config, event_index = None, start_sample = 0):
+
+        super().__init__()
+        self.views_vol = views_vol
+        self.config = config
+        self.event_index = event_index
+        self.start_sample = start_sample
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+
+        # only send the path of a memory-mapped volume to the workers (pickling a np.memmap copies the full volume)
+        if isinstance(self.views_vol, np.memmap) and self.views_vol.filename is not None:
+            state['views_vol'] = self.views_vol.filename
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+
+        if isinstance(self.views_vol, str):
+            self.views_vol = np.load(self.views_vol, mmap_mode = 'r')
+
+    def __iter__(self):
+
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id = 0 if worker_info is None else worker_info.id
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+
+        for sample in range(self.start_sample + worker_id, self.config.samples, num_workers):
+
+            yield get_sample_batch(self.views_vol, sample, self.config, self.event_index)
+
+
+def get_sample_seeds(config, sample):
+
+    """Return the numpy and torch seeds for a sample, derived from config.np_seed and config.torch_seed."""
+
+    np_seed = np.random.SeedSequence([config.np_seed, sample]).generate_state(1)[0]
+    torch_seed = np.random.SeedSequence([config.torch_seed, sample]).generate_state(1)[0]
+
+    return int(np_seed), int(torch_seed)
+
+
+def get_sample_batch(views_vol, sample, config, event_index = None):
+
+    """Return the training batch of a sample (get_train_batch, on the cpu), with numpy and torch seeded from the seeds of the sample (get_sample_seeds). 
+    The same sample gives the same batch in a worker of the window loader and in the training loop. The global numpy and torch RNG states are 
+    restored afterwards, so sampling in the training loop does not move the dropout draws."""
+
+    np_seed, torch_seed = get_sample_seeds(config, sample)
+    np_state = np.random.get_state()
+
+    with torch.random.fork_rng(devices = []): # the batch is drawn on the cpu, so only the cpu RNG is forked
+        np.random.seed(np_seed)
+        torch.manual_seed(torch_seed)
+
+        try:
+            return get_train_batch(views_vol, sample, config, 'cpu', event_index)
+
+        finally:
+            np.random.set_state(np_state)
+
+
+def get_window_loader(views_vol, config, device, event_index = None, start_sample = 0):
+
+    """Return a DataLoader over the WindowSampler that prefetches config.prefetch_factor batches per worker in config.num_workers 
+    worker processes. The batches are put in pinned memory when training on cuda, so they can be copied to the gpu asynchronously.
+    The first batch is the one for start_sample."""
+
+    window_sampler = WindowSampler(views_vol, config, event_index, start_sample)
+
+    # the DataLoader draws a base seed for its workers when it starts. From its own generator and not the global torch RNG, 
+    # so starting the loader does not shift the dropout draws in the training loop (a resumed run then matches one that was never stopped)
+    generator = torch.Generator().manual_seed(config.torch_seed)
+
+    window_loader = torch.utils.data.DataLoader(window_sampler, 
+                                                batch_size = None, # the sampler already yields full batches
+                                                num_workers = config.num_workers, 
+                                                prefetch_factor = getattr(config, 'prefetch_factor', 2), 
+                                                pin_memory = torch.device(device).type == 'cuda',
+                                                generator = generator)
+
+    return window_loader
+
+
 #def get_full_tensor(views_vol, config, device):
 #
 #    """
@@ -449,6 +627,8 @@ def get_full_tensor(views_vol, config = None):
         - The function assumes that the feature index for the main feature starts at position 5 (`ln_best_sb_idx`) 
           and the number of features to be used is defined by `month_range`.
         - Ensure that the input `views_vol` is structured correctly to match the expected dimensions and content.
+        - For a float32 `views_vol` (as returned by get_data) the tensors are views of the volume built with torch.from_numpy, 
+          so no copy of the volume is made. Other dtypes are converted, copying only the sliced channels.
 
     """
 
@@ -462,17 +642,35 @@ def get_full_tensor(views_vol, config = None):
 
     print(f'views_vol shape {views_vol.shape}')
 
-    # THIS IS WHERE YOU LOOSE THE OTHE FEATURES!!!!
-    full_tensor = torch.tensor(views_vol).float().unsqueeze(dim=0).permute(0,1,4,2,3)[:, :, ln_best_sb_idx:last_feature_idx, :, :] 
+    # THIS IS WHERE YOU LOOSE THE OTHE FEATURES!!!! The channels are sliced before the tensor is made, so only they are ever read
+    full_tensor = torch.from_numpy(views_vol[:, :, :, ln_best_sb_idx:last_feature_idx]).float().unsqueeze(dim=0).permute(0,1,4,2,3)
 
     # Make a metadata tensor with evrything else
-    metadata_tensor = torch.tensor(views_vol).float().unsqueeze(dim=0).permute(0,1,4,2,3)[:, :, :ln_best_sb_idx, :, :]
+    metadata_tensor = torch.from_numpy(views_vol[:, :, :, :ln_best_sb_idx]).float().unsqueeze(dim=0).permute(0,1,4,2,3)
 
     print(f'full_tensor shape {full_tensor.shape}')
 
     return full_tensor, metadata_tensor 
 
 
+def get_land_cells(metadata_tensor, time_steps = 1):
+
+    """
+    Return the land cell index of the 180x180 grid: the flat indices (row * 180 + col) and priogrid ids of the cells with a country id (c_id != 0) 
+    in any of the last time_steps months of the metadata tensor (from get_full_tensor). The other cells are ocean (or outside the data).
+    The index is used to gather only the land cells before the posterior is aggregated, evaluated and saved.
+    """
+
+    metadata_np = metadata_tensor[0, -time_steps:, :, :, :].cpu().numpy() # months x metadata features x 180 x 180
+
+    c_id = metadata_np[:, 4, :, :].reshape(time_steps, -1) # feature 4 is c_id
+    cells = np.flatnonzero((c_id != 0).any(axis = 0))
+
+    pg_id = metadata_np[:, 0, :, :].reshape(time_steps, -1)[:, cells].max(axis = 0) # feature 0 is pg_id
+
+    return cells.astype(np.int32), pg_id.astype(np.int32)
+
+
 
 # def get_log_dict(i, mean_array, mean_class_array, std_array, std_class_array, out_of_sample_vol, config):
 # 
@@ -517,6 +715,7 @@ def execute_freeze_h_option(config, model, t0, h_tt):
     Also have a random option where the model randomly picks between what to freeze.
 
     The function returns the new hidden state/short term memory h_tt and the prediction t1_pred and t1_pred_class.    
+    h_tt can hold a batch of posterior samples (see predict in utils_prediction.py); the freezing is applied to each of them.
     """
      
     if config.freeze_h == "hl": # freeze the long term memory
@@ -552,7 +751,8 @@ def execute_freeze_h_option(config, model, t0, h_tt):
         hs_1_new, hs_2_new, hs_3_new, hs_4_new, hl_1_new, hl_2_new, hl_3_new, hl_4_new = torch.split(h_tt_new, split_four_ways, dim=1) # split the h_tt from the current step
 
         pairs = [(hs_1_frozen, hs_1_new), (hs_2_frozen, hs_2_new), (hs_3_frozen, hs_3_new), (hs_4_frozen, hs_4_new), (hl_1_frozen, hl_1_new), (hl_2_frozen, hl_2_new), (hl_3_frozen, hl_3_new), (hl_4_frozen, hl_4_new)] # make pairs of the frozen and new hidden states
-        h_tt = torch.cat([pair[0] if torch.rand(1) < 0.5 else pair[1] for pair in pairs], dim=1) # concatenate the frozen and new hidden states. Randomly pick between the frozen and new hidden states for each pair.
+        N = h_tt.shape[0] # batch of posterior samples, each picks on its own
+        h_tt = torch.cat([torch.where(torch.rand(N, 1, 1, 1, device = h_tt.device) < 0.5, pair[0], pair[1]) for pair in pairs], dim=1) # concatenate the frozen and new hidden states. Randomly pick between the frozen and new hidden states for each pair.
 
     else:
         print('Wrong freez option...')
@@ -0,0 +1,128 @@
+import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+
+def get_path_checkpoint(PATH_ARTIFACTS, run_type):
+
+    """
+    The training checkpoint of a run type, e.g. checkpoints/calibration_checkpoint.pt in the artifacts folder.
+    A subfolder and not a file next to the artifacts, so get_latest_model_artifact does not pick up the checkpoint as a model.
+    There is one checkpoint per run type - each snapshot replaces the last one.
+    """
+
+    return Path(PATH_ARTIFACTS) / 'checkpoints' / f'{run_type}_checkpoint.pt'
+
+
+def _detach_to_cpu(obj):
+
+    """Copies all tensors in a (nested) state dict to the cpu, so the snapshot does not change while it is written and does not hold gpu memory."""
+
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy = True)
+
+    elif isinstance(obj, dict):
+        return {key: _detach_to_cpu(value) for key, value in obj.items()}
+
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_detach_to_cpu(value) for value in obj)
+
+    return obj
+
+
+def get_training_state(model, optimizer, scheduler, multitaskloss_instance, next_sample):
+
+    """
+    Everything needed to continue the training loop at next_sample: the model, the AdamW optimizer (moments and step counts), the scheduler,
+    the MultiTaskLoss weights and the numpy, torch and cuda RNG states (the window sampling, flips and dropout draw from them).
+    All tensors are copied to the cpu.
+    """
+
+    state = {'next_sample': next_sample,
+             'model': model.state_dict(),
+             'optimizer': optimizer.state_dict(),
+             'scheduler': scheduler.state_dict(),
+             'multitaskloss': multitaskloss_instance.state_dict(),
+             'np_rng': np.random.get_state(),
+             'torch_rng': torch.get_rng_state(),
+             'cuda_rng': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None}
+
+    return _detach_to_cpu(state)
+
+
+def set_training_state(state, model, optimizer, scheduler, multitaskloss_instance):
+
+    """Loads a state from get_training_state into the model, optimizer, scheduler and MultiTaskLoss, sets the RNG states and returns the sample to continue from."""
+
+    model.load_state_dict(state['model'])
+    optimizer.load_state_dict(state['optimizer']) # moves the moments to the device of the parameters
+    scheduler.load_state_dict(state['scheduler'])
+    multitaskloss_instance.load_state_dict(state['multitaskloss'])
+
+    np.random.set_state(state['np_rng'])
+    torch.set_rng_state(state['torch_rng'])
+
+    if state['cuda_rng'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda_rng'])
+
+    return state['next_sample']
+
+
+def load_checkpoint(PATH_CHECKPOINT):
+
+    """Returns the training state saved at PATH_CHECKPOINT, or None if there is no checkpoint."""
+
+    if not os.path.exists(PATH_CHECKPOINT):
+        return None
+
+    return torch.load(PATH_CHECKPOINT, map_location = 'cpu', weights_only = False) # weights_only = False for the numpy RNG state
+
+
+class CheckpointWriter:
+
+    """
+    Writes the training checkpoints in a background thread, so the training loop does not wait for the disk.
+
+    The state is copied to the cpu in the training loop (get_training_state) and only torch.save runs in the thread. It writes to a temporary
+    file that then replaces the checkpoint, so a job killed during a write still leaves the previous checkpoint. At most one write is pending -
+    a new snapshot waits for the previous write first, so a slow disk can not pile up copies of the state in memory.
+    """
+
+    def __init__(self, PATH_CHECKPOINT):
+
+        self.PATH_CHECKPOINT = Path(PATH_CHECKPOINT)
+        self.executor = ThreadPoolExecutor(max_workers = 1)
+        self.pending = None
+
+        os.makedirs(self.PATH_CHECKPOINT.parent, exist_ok = True)
+
+
+    def _write(self, state):
+
+        PATH_TMP = self.PATH_CHECKPOINT.with_suffix('.tmp')
+        torch.save(state, PATH_TMP)
+        os.replace(PATH_TMP, self.PATH_CHECKPOINT)
+
+
+    def wait(self):
+
+        """Waits for the pending write (and raises its error, if it failed)."""
+
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+
+    def save(self, state):
+
+        self.wait()
+        self.pending = self.executor.submit(self._write, state)
+
+
+    def close(self):
+
+        self.wait()
+        self.executor.shutdown()
@@ -0,0 +1,232 @@
+import os
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+from HydraBNrecurrentUnet_06_LSTM4 import get_model_kwargs
+
+
+INFERENCE_BACKENDS = ['eager', 'torchscript', 'compile', 'onnx']
+
+
+def get_export_mode(model):
+
+    """
+    Returns the mode the model is in: 'mc_dropout' (eval with dropout on, i.e. model.eval() and model.apply(apply_dropout) as in predict),
+    'eval' (everything in eval mode, e.g. the deterministic warm-up) or None (training), which is never exported.
+    """
+
+    if model.training:
+        return None
+
+    dropout_active = any(m.training for m in model.modules() if type(m) == nn.Dropout)
+
+    return 'mc_dropout' if dropout_active else 'eval'
+
+
+def get_path_export_cache(PATH_MODEL_ARTIFACT):
+
+    """
+    The exported graphs are cached in a folder next to the artifact, e.g. calibration_model_20240101_120000_exported/ for calibration_model_20240101_120000.pt.
+    A folder and not files next to the artifact, so get_latest_model_artifact does not pick up the exported graphs.
+    """
+
+    PATH_MODEL_ARTIFACT = Path(PATH_MODEL_ARTIFACT)
+
+    return PATH_MODEL_ARTIFACT.parent / f'{PATH_MODEL_ARTIFACT.stem}_exported'
+
+
+class ExportedHydraNet(nn.Module):
+
+    """
+    A HydraNet where the single month step (model(t0, h) -> out_reg, out_class, h) runs as an exported graph instead of the eager python forward.
+    It can be used as the model in predict, warm_up and execute_freeze_h_option - the freeze_h options work on h between the steps, so they are kept as they are.
+
+    Dropout is part of the traced graphs, so there is one graph per mode (see get_export_mode): 'mc_dropout' for the posterior samples
+    (after model.apply(apply_dropout)) and 'eval' for the deterministic warm-up. The graph is picked at each call from the mode of the wrapped model,
+    so model.eval() and model.apply(apply_dropout) work as before. Training runs the eager model.
+
+    Backends:
+        'torchscript': torch.jit.trace of the step, saved as {mode}.pt in the cache folder.
+        'compile': torch.compile of the step. The compiled kernels are cached by inductor in the cache folder.
+        'onnx': the step as an ONNX graph ({mode}.onnx), run with onnxruntime on CPU. Needs the onnx and onnxruntime packages.
+    """
+
+    def __init__(self, model, backend, path_cache, example_dim = 32):
+        super().__init__()
+
+        if backend not in INFERENCE_BACKENDS[1:]:
+            raise ValueError(f'Unknown inference backend: {backend}. Use one of {INFERENCE_BACKENDS[1:]}')
+
+        self.model = model
+        self.backend = backend
+        self.path_cache = Path(path_cache)
+        self.example_dim = example_dim # the window used to trace/export the graphs. Batch, height and width are dynamic
+        self.base = model.base # predict and warm_up use model.base for the hidden state
+
+        self.steps = {} # mode -> step function. A plain dict so model.apply()/eval() do not go through the exported graphs
+
+        os.makedirs(self.path_cache, exist_ok = True)
+
+        # the same layout (fused LSTM, grouped decoder) should not reuse graphs exported from another - so it is part of the file names
+        kwargs = get_model_kwargs(model)
+        self.layout = '_'.join([name for name in ['fused_lstm', 'grouped_decoder'] if kwargs[name]]) or 'separate'
+
+
+    def init_h(self, *args, **kwargs):
+        return self.model.init_h(*args, **kwargs)
+
+
+    def init_hTtime(self, *args, **kwargs):
+        return self.model.init_hTtime(*args, **kwargs)
+
+
+    def _example_inputs(self):
+
+        param = next(self.model.parameters())
+        kwargs = get_model_kwargs(self.model)
+
+        x = torch.zeros((2, kwargs['input_channels'], self.example_dim, self.example_dim), dtype = param.dtype, device = param.device)
+        h = torch.zeros((2, self.model.base, self.example_dim, self.example_dim), dtype = param.dtype, device = param.device)
+
+        return x, h
+
+
+    def _torchscript_step(self, mode):
+
+        PATH_STEP = self.path_cache / f'{self.layout}_{mode}.pt'
+
+        if PATH_STEP.exists():
+            print(f'Loading the exported {mode} step from {PATH_STEP}')
+            return torch.jit.load(PATH_STEP, map_location = next(self.model.parameters()).device)
+
+        print(f'Tracing the {mode} step...')
+        with torch.no_grad():
+            step = torch.jit.trace(self.model, self._example_inputs(), check_trace = False) # check_trace would fail on the random dropout masks
+
+        torch.jit.save(step, PATH_STEP)
+
+        return step
+
+
+    def _compile_step(self, mode):
+
+        # one compiled model for both modes - dynamo guards on the dropout mode and compiles each once.
+        # The compiled kernels are cached by inductor (next to the artifact unless TORCHINDUCTOR_CACHE_DIR is already set), so repeated runs skip most of the compilation
+        if 'compiled' not in self.steps:
+            os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', str(self.path_cache / 'inductor'))
+            self.steps['compiled'] = torch.compile(self.model)
+
+        return self.steps['compiled']
+
+
+    def _onnx_step(self, mode):
+
+        try:
+            import onnxruntime as ort
+
+        except ImportError as e:
+            raise ImportError('The onnx inference backend needs onnx and onnxruntime: pip install onnx onnxruntime') from e
+
+        PATH_STEP = self.path_cache / f'{self.layout}_{mode}.onnx'
+
+        if not PATH_STEP.exists():
+            print(f'Exporting the {mode} step to ONNX...')
+
+            # the TorchScript based exporter, with the dropout mode of each module kept (PRESERVE), so dropout stays random in the mc_dropout graph
+            torch.onnx.export(self.model, self._example_inputs(), PATH_STEP, dynamo = False, training = torch.onnx.TrainingMode.PRESERVE,
+                              input_names = ['x', 'h'], output_names = ['out_reg', 'out_class', 'h_out'], opset_version = 17,
+                              dynamic_axes = {name: {0: 'batch', 2: 'height', 3: 'width'} for name in ['x', 'h', 'out_reg', 'out_class', 'h_out']})
+
+        else:
+            print(f'Loading the exported {mode} step from {PATH_STEP}')
+
+        session = ort.InferenceSession(str(PATH_STEP), providers = ['CPUExecutionProvider'])
+
+        def step(x, h):
+            outputs = session.run(None, {'x': x.cpu().numpy(), 'h': h.cpu().numpy()})
+            return tuple(torch.from_numpy(output).to(x.device) for output in outputs)
+
+        return step
+
+
+    def forward(self, x, h):
+
+        mode = get_export_mode(self.model)
+
+        if mode is None: # training is never exported
+            return self.model(x, h)
+
+        if mode not in self.steps:
+            self.steps[mode] = getattr(self, f'_{self.backend}_step')(mode)
+
+        return self.steps[mode](x, h)
+
+
+def export_model(model, PATH_MODEL_ARTIFACT, backend = 'eager'):
+
+    """
+    Returns the model with its single month step exported with the given backend (see INFERENCE_BACKENDS and ExportedHydraNet),
+    cached next to the artifact (see get_path_export_cache). 'eager' returns the model as it is.
+    """
+
+    if backend == 'eager':
+        return model
+
+    print(f'Inference backend: {backend}')
+
+    return ExportedHydraNet(model, backend, get_path_export_cache(PATH_MODEL_ARTIFACT))
+
+
+INFERENCE_PRECISIONS = ['float32', 'bfloat16']
+
+
+class ReducedPrecisionHydraNet(nn.Module):
+
+    """
+    A HydraNet where the month step runs under bfloat16 autocast (on CPU the convs then use the bf16 kernels where the hardware has them).
+    The outputs and the hidden state are cast back to float32 after each step, so the long-term memory carried through the months stays float32
+    and predict gets float32 arrays as before. Like ExportedHydraNet it can be used as the model in predict, warm_up and execute_freeze_h_option,
+    and it can wrap an ExportedHydraNet.
+
+    Check the accuracy with inference_precision_report (utils_prediction.py) before switching it on.
+    """
+
+    def __init__(self, model, dtype = torch.bfloat16):
+        super().__init__()
+
+        self.model = model
+        self.dtype = dtype
+        self.base = model.base
+
+
+    def init_h(self, *args, **kwargs):
+        return self.model.init_h(*args, **kwargs)
+
+
+    def init_hTtime(self, *args, **kwargs):
+        return self.model.init_hTtime(*args, **kwargs)
+
+
+    def forward(self, x, h):
+
+        with torch.autocast(device_type = x.device.type, dtype = self.dtype):
+            outputs = self.model(x, h)
+
+        return tuple(output.float() for output in outputs) # out_reg, out_class, h
+
+
+def set_inference_precision(model, precision = 'float32'):
+
+    """Returns the model running its month steps in the given precision (see INFERENCE_PRECISIONS and ReducedPrecisionHydraNet). 'float32' returns the model as it is."""
+
+    if precision == 'float32':
+        return model
+
+    elif precision == 'bfloat16':
+        print(f'Inference precision: {precision}')
+        return ReducedPrecisionHydraNet(model, torch.bfloat16)
+
+    else:
+        raise ValueError(f'Unknown inference precision: {precision}. Use one of {INFERENCE_PRECISIONS}')
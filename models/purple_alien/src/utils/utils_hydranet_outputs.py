@@ -1,4 +1,5 @@
 import pickle
+import numpy as np
 
 from sklearn.metrics import mean_squared_error, average_precision_score, roc_auc_score, brier_score_loss
 import pandas as pd
@@ -64,7 +65,8 @@ def output_to_df(dict_of_outputs_dicts):
     # merge the dataframes
     df_all = pd.concat([df_sb, df_ns, df_os], axis=1)
 
-    # drop ocean cells, i.e. where c_id == 0
+    # drop ocean cells, i.e. where c_id == 0. evaluate_posterior already only keeps the land cells (see get_land_cells), 
+    # but a cell can have a country in some of the months and not in others
     df_all = df_all[df_all["c_id"] != 0]
 
     # no you can just drop it
@@ -131,12 +133,12 @@ def evaluation_to_df(dict_of_eval_dicts):
 def save_model_outputs(PATH, config, posterior_dict, dict_of_outputs_dicts, dict_of_eval_dicts, full_tensor, metadata_tensor):
     """
     Sets up data paths, creates necessary directories, and saves model outputs including posterior dictionary, 
-    evaluation metrics, and tensors to pickle files.
+    evaluation metrics (pickle files), and tensors (.npy files).
 
     Args:
         PATH (str): The base path for saving data.
         config (object): Configuration object containing attributes such as time_steps, run_type, and model_time_stamp.
-        posterior_dict (dict): Dictionary containing posterior list, posterior list class, and out-of-sample volume.
+        posterior_dict (dict): Dictionary containing the aggregated posterior (see PosteriorAggregator.to_dict) and out-of-sample volume.
         dict_of_outputs_dicts (dict): Dictionary containing model outputs.
         dict_of_eval_dicts (dict): Dictionary containing evaluation metrics.
         full_tensor (torch.Tensor): Tensor containing full dataset for predictions.
@@ -167,16 +169,14 @@ def save_model_outputs(PATH, config, posterior_dict, dict_of_outputs_dicts, dict
     with open(evaluation_path, 'wb') as file:
         pickle.dump(df_sb_os_ns_evaluation, file)
 
-    # Save the tensors
-    test_vol_path = f'{PATH_GENERATED}/test_vol_{config.time_steps}_{config.run_type}_{config.model_time_stamp}.pkl'
-    with open(test_vol_path, 'wb') as file:
-        pickle.dump(full_tensor.cpu().numpy(), file)
+    # Save the tensors as .npy, so readers can memory-map them (np.load(..., mmap_mode = 'r')) and only read the months they need
+    test_vol_path = f'{PATH_GENERATED}/test_vol_{config.time_steps}_{config.run_type}_{config.model_time_stamp}.npy'
+    np.save(test_vol_path, full_tensor.cpu().numpy())
 
-    metadata_vol_path = f'{PATH_GENERATED}/metadata_vol_{config.time_steps}_{config.run_type}_{config.model_time_stamp}.pkl'
-    with open(metadata_vol_path, 'wb') as file:
-        pickle.dump(metadata_tensor.cpu().numpy(), file)
+    metadata_vol_path = f'{PATH_GENERATED}/metadata_vol_{config.time_steps}_{config.run_type}_{config.model_time_stamp}.npy'
+    np.save(metadata_vol_path, metadata_tensor.cpu().numpy())
 
-    print('Posterior dict, outputs, evaluation metrics, and tensors pickled and saved!')
+    print('Posterior dict, outputs, evaluation metrics, and tensors saved!')
 
 
 def plot_metrics(df_all, feature = 0):
@@ -0,0 +1,107 @@
+import numpy as np
+
+
+def get_ranking_metrics(y_true_binary, y_score_prob):
+
+    """
+    Computes the average precision (AP) and the area under the ROC curve (AUC) along the last axis of the input arrays.
+
+    Each slice (e.g. [step, target, :]) is sorted once, by decreasing score, and both metrics are computed from the cumulative sums
+    of the true and false positives. Tied scores are treated as one threshold, as in sklearn's average_precision_score and
+    roc_auc_score, so the results match them.
+
+    Args:
+        y_true_binary (np.ndarray): Binary labels, e.g. of shape [steps, targets, cells].
+        y_score_prob (np.ndarray): Predicted probabilities of the same shape.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The AP and AUC of each slice, of shape y_true_binary.shape[:-1].
+        NaN where a slice has no positives (AP and AUC) or no negatives (AUC).
+    """
+
+    n = y_score_prob.shape[-1]
+    idx = np.arange(n)
+
+    # one sort per slice, by decreasing score
+    order = np.argsort(-y_score_prob, axis = -1, kind = 'stable')
+    score = np.take_along_axis(y_score_prob, order, axis = -1)
+    label = np.take_along_axis(y_true_binary, order, axis = -1).astype(np.float64)
+
+    tp = np.cumsum(label, axis = -1)
+    fp = (idx + 1) - tp
+    n_pos = tp[..., -1]
+    n_neg = n - n_pos
+
+    # the first and last position of the group of tied scores each position belongs to
+    group_end = np.ones(score.shape, dtype = bool)
+    group_end[..., :-1] = score[..., :-1] != score[..., 1:]
+    group_start = np.ones(score.shape, dtype = bool)
+    group_start[..., 1:] = group_end[..., :-1]
+
+    last = np.minimum.accumulate(np.where(group_end, idx, n)[..., ::-1], axis = -1)[..., ::-1]
+    first = np.maximum.accumulate(np.where(group_start, idx, 0), axis = -1)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'): # slices with only one class give NaN
+
+        # AP: each positive adds the precision at the threshold of its group, weighted by 1 / n_pos
+        precision = tp / (tp + fp)
+        ap = (label * np.take_along_axis(precision, last, axis = -1)).sum(axis = -1) / n_pos
+
+        # AUC: the Mann-Whitney U statistic, with the average ascending rank of each group of tied scores
+        rank = n - (first + last) / 2
+        auc = ((label * rank).sum(axis = -1) - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+
+    ap = np.where(n_pos > 0, ap, np.nan)
+    auc = np.where((n_pos > 0) & (n_neg > 0), auc, np.nan)
+
+    return ap, auc
+
+
+def get_metric_arrays(y_true, y_score, y_score_prob):
+
+    """
+    Computes MSE, Brier score, AP and AUC for every slice along the last axis in one pass.
+
+    Args:
+        y_true (np.ndarray): The observed values, of shape [steps, targets, cells].
+        y_score (np.ndarray): The predicted magnitudes (e.g. the posterior mean), of the same shape.
+        y_score_prob (np.ndarray): The predicted probabilities, of the same shape.
+
+    Returns:
+        dict: The metric arrays {'MSE', 'Brier', 'AP', 'AUC'}, each of shape [steps, targets].
+    """
+
+    y_true_binary = (y_true > 0) * 1
+
+    ap, auc = get_ranking_metrics(y_true_binary, y_score_prob)
+
+    metric_arrays = {
+        'MSE' : np.mean((y_true - y_score) ** 2, axis = -1),
+        'Brier' : np.mean((y_true_binary - y_score_prob) ** 2, axis = -1),
+        'AP' : ap,
+        'AUC' : auc,
+    }
+
+    return metric_arrays
+
+
+def fill_evaluation_dicts(dict_of_eval_dicts, metric_arrays):
+
+    """
+    Fills a dict of evaluation dicts (EvaluationMetrics per step, per target) with the metric arrays from get_metric_arrays.
+
+    Args:
+        dict_of_eval_dicts (Dict[str, Dict[str, EvaluationMetrics]]): The evaluation dicts, with the targets in the order of the target axis
+            of the metric arrays (e.g. 'sb', 'ns', 'os') and 'step01', 'step02', ... as keys.
+        metric_arrays (dict): Metric arrays of shape [steps, targets].
+
+    Returns:
+        Dict[str, Dict[str, EvaluationMetrics]]: The filled dict of evaluation dicts.
+    """
+
+    for i, target in enumerate(dict_of_eval_dicts.keys()):
+        for t, step in enumerate(dict_of_eval_dicts[target].keys()):
+            for metric, metric_array in metric_arrays.items():
+                setattr(dict_of_eval_dicts[target][step], metric, float(metric_array[t, i]))
+
+    return dict_of_eval_dicts
@@ -0,0 +1,193 @@
+import numpy as np
+
+
+class P2Quantile:
+
+    """
+    Streaming estimate of the p quantile of every cell of an array, using the P² algorithm (Jain & Chlamtac, 1985).
+    Each cell keeps five markers (heights q and positions n), so the memory is 10 x the array, no matter how many samples are seen.
+    The first five samples are kept as they are and the quantile is exact until the markers are initialized.
+    """
+
+    def __init__(self, p):
+
+        self.p = p
+        self.count = 0
+        self.first_samples = [] # the first five samples, used to initialize the markers
+
+        self.dn = np.array([0, p/2, p, (1+p)/2, 1], dtype = np.float32) # increments of the desired marker positions
+        self.desired_n = np.array([0, 2*p, 4*p, 2+2*p, 4], dtype = np.float32) # desired marker positions (0 indexed)
+
+
+    def update(self, x):
+
+        """Add one sample x (an array of the same shape for every sample)."""
+
+        self.count += 1
+
+        if self.count <= 5:
+            self.first_samples.append(np.asarray(x, dtype = np.float32).copy())
+
+            if self.count == 5: # initialize the markers with the sorted first five samples
+                self.q = np.sort(np.stack(self.first_samples), axis = 0)
+                self.n = np.broadcast_to(np.arange(5, dtype = np.float32).reshape((5,) + (1,) * x.ndim), self.q.shape).copy()
+                self.first_samples = []
+
+            return
+
+        q, n = self.q, self.n
+
+        # the cell k of the markers x falls in (q[k] <= x < q[k+1]), extending the min and max marker if x is outside them
+        k = (x[None] >= q[1:4]).sum(axis = 0)
+        q[0] = np.minimum(q[0], x)
+        q[4] = np.maximum(q[4], x)
+
+        # increment the positions of the markers above x
+        n[1:] += np.arange(1, 5).reshape((4,) + (1,) * x.ndim) > k
+        self.desired_n += self.dn
+
+        # adjust the heights of the three middle markers if they are off their desired positions
+        with np.errstate(divide = 'ignore', invalid = 'ignore'): # cells that are not adjusted can divide by zero
+
+            for i in range(1, 4):
+
+                d = self.desired_n[i] - n[i]
+                adjust = ((d >= 1) & (n[i+1] - n[i] > 1)) | ((d <= -1) & (n[i-1] - n[i] < -1))
+                d = np.sign(d)
+
+                # piecewise parabolic prediction
+                q_parabolic = q[i] + d / (n[i+1] - n[i-1]) * ((n[i] - n[i-1] + d) * (q[i+1] - q[i]) / (n[i+1] - n[i])
+                                                              + (n[i+1] - n[i] - d) * (q[i] - q[i-1]) / (n[i] - n[i-1]))
+
+                # linear prediction, used when the parabolic one is not between the neighbouring markers
+                q_neighbour = np.where(d > 0, q[i+1], q[i-1])
+                n_neighbour = np.where(d > 0, n[i+1], n[i-1])
+                q_linear = q[i] + d * (q_neighbour - q[i]) / (n_neighbour - n[i])
+
+                q_new = np.where((q[i-1] < q_parabolic) & (q_parabolic < q[i+1]), q_parabolic, q_linear)
+
+                q[i] = np.where(adjust, q_new, q[i])
+                n[i] = np.where(adjust, n[i] + d, n[i])
+
+
+    def value(self):
+
+        """Return the current estimate of the p quantile."""
+
+        if self.count < 5:
+            return np.quantile(np.stack(self.first_samples), self.p, axis = 0)
+
+        return self.q[2]
+
+
+class PosteriorAggregator:
+
+    """
+    Aggregates the posterior samples of HydraNet as they are drawn, instead of keeping all of them in memory.
+    The mean and variance of the magnitudes and the probabilities are updated with Welford's online algorithm
+    (in the batched form of Chan et al.), so the memory is O(months x features x grid) instead of O(samples x months x features x grid).
+
+    If cells (the land cell index from get_land_cells in utils.py) is given, only those cells are aggregated and the aggregates are of shape 
+    months x features x cells instead of months x features x 180 x 180.
+
+    quantiles is an optional list of quantiles of the magnitudes to estimate with P² sketches (see P2Quantile).
+    If a store (PosteriorStoreWriter in utils_posterior_store.py) is given, the raw samples are also written to it batch by batch.
+    """
+
+    def __init__(self, cells = None, quantiles = None, store = None):
+
+        self.count = 0
+        self.cells = cells
+        self.quantiles = {p: P2Quantile(p) for p in (quantiles or [])}
+        self.store = store
+
+
+    def _update_moments(self, name, x):
+
+        """Chan's update of the mean and the sum of squared deviations (M2) with a batch x of samples (the first dim)."""
+
+        x = x.astype(np.float64)
+        n_a = self.count
+        n_b = x.shape[0]
+        n = n_a + n_b
+
+        mean_b = x.mean(axis = 0)
+        m2_b = ((x - mean_b) ** 2).sum(axis = 0)
+
+        if n_a == 0:
+            setattr(self, f'{name}_mean', mean_b)
+            setattr(self, f'{name}_m2', m2_b)
+            return
+
+        mean = getattr(self, f'{name}_mean')
+        m2 = getattr(self, f'{name}_m2')
+
+        delta = mean_b - mean
+        mean += delta * n_b / n
+        m2 += m2_b + delta ** 2 * n_a * n_b / n
+
+
+    def update(self, pred_array, pred_class_array):
+
+        """
+        Add a batch of posterior samples.
+        pred_array and pred_class_array are the magnitudes and probabilities of shape samples x months x features x 180 x 180.
+        """
+
+        if self.cells is not None: # gather the land cells once, before anything else is done with the samples
+            pred_array = pred_array.reshape(pred_array.shape[:3] + (-1,))[..., self.cells]
+            pred_class_array = pred_class_array.reshape(pred_class_array.shape[:3] + (-1,))[..., self.cells]
+
+        if self.store is not None: # opt-in: keep the raw samples, written batch by batch
+            self.store.write(self.count, pred_array, pred_class_array)
+
+        self._update_moments('pred', pred_array)
+        self._update_moments('pred_class', pred_class_array)
+
+        for sketch in self.quantiles.values():
+            for sample in pred_array:
+                sketch.update(sample)
+
+        self.count += pred_array.shape[0]
+
+
+    @property
+    def mean(self):
+        return self.pred_mean
+
+    @property
+    def std(self):
+        return np.sqrt(self.pred_m2 / self.count) # population std, as np.std
+
+    @property
+    def mean_class(self):
+        return self.pred_class_mean
+
+    @property
+    def std_class(self):
+        return np.sqrt(self.pred_class_m2 / self.count)
+
+
+    def get_quantile(self, p):
+
+        """Return the P² estimate of the p quantile of the magnitudes (p must be in quantiles)."""
+
+        return self.quantiles[p].value()
+
+
+    def to_dict(self):
+
+        """Return the aggregated posterior as a dict of arrays, e.g. for pickling."""
+
+        posterior_dict = {
+            'n_samples' : self.count,
+            'cells' : self.cells,
+            'mean_array' : self.mean.astype(np.float32),
+            'std_array' : self.std.astype(np.float32),
+            'mean_class_array' : self.mean_class.astype(np.float32),
+            'std_class_array' : self.std_class.astype(np.float32),
+            'quantile_arrays' : {p: self.get_quantile(p) for p in self.quantiles},
+            'path_store' : None if self.store is None else str(self.store.path_store),
+        }
+
+        return posterior_dict
@@ -0,0 +1,171 @@
+import os
+import json
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+STORE_FEATURES = ['sb', 'ns', 'os'] # same order as the feature dim of the HydraNet outputs
+STORE_KINDS = ['magnitudes', 'probabilities']
+
+
+class PosteriorStoreWriter:
+
+    """
+    Writes the posterior samples of HydraNet to a directory of .npy shards, one shard per kind (magnitudes/probabilities), step and feature:
+
+        {path_store}/meta.json
+        {path_store}/cells.npy, pg_id.npy              the land cells and their priogrid ids
+        {path_store}/observed.npy                      the observed values, steps x features x cells (if given)
+        {path_store}/{kind}/step{step:02d}_{feature}.npy   samples x cells
+
+    Only the land cells (see get_land_cells in utils.py) are stored, in the given dtype (float16 by default). The shards are memory-mapped while the samples are written batch by batch.
+    With compression = True they are converted to compressed .npz files when the writer is closed.
+    Use PosteriorStore to read the store.
+    """
+
+    def __init__(self, path_store, n_samples, n_steps, cells, pg_id, observed = None, dtype = 'float16', compression = False):
+
+        self.path_store = Path(path_store)
+        self.n_samples = n_samples
+        self.n_steps = n_steps
+        self.cells = cells
+        self.dtype = np.dtype(dtype)
+        self.compression = compression
+
+        self.shards = {}
+
+        for kind in STORE_KINDS:
+            os.makedirs(self.path_store / kind, exist_ok = True)
+
+            for step in range(1, n_steps + 1):
+                for feature in STORE_FEATURES:
+                    self.shards[(kind, step, feature)] = open_memmap(self.path_store / kind / f'step{str(step).zfill(2)}_{feature}.npy', mode = 'w+', dtype = self.dtype, shape = (n_samples, len(cells)))
+
+        np.save(self.path_store / 'cells.npy', cells)
+        np.save(self.path_store / 'pg_id.npy', pg_id)
+
+        if observed is not None: # out_of_sample_vol, 1 x steps x features x 180 x 180
+            np.save(self.path_store / 'observed.npy', observed.reshape(n_steps, len(STORE_FEATURES), -1)[:, :, cells].astype(np.float32))
+
+        self.meta = {
+            'n_samples' : n_samples,
+            'n_steps' : n_steps,
+            'n_cells' : len(cells),
+            'features' : STORE_FEATURES,
+            'dtype' : self.dtype.name,
+            'compression' : compression,
+            'observed' : observed is not None,
+            'complete' : False,
+        }
+        self._save_meta()
+
+
+    def _save_meta(self):
+
+        with open(self.path_store / 'meta.json', 'w') as file:
+            json.dump(self.meta, file, indent = 2)
+
+
+    def write(self, first_sample, pred_array, pred_class_array):
+
+        """
+        Write a batch of posterior samples, starting at sample number first_sample.
+        pred_array and pred_class_array are the magnitudes and probabilities of the land cells, of shape samples x steps x features x cells.
+        """
+
+        n = pred_array.shape[0]
+
+        for kind, land_array in zip(STORE_KINDS, [pred_array, pred_class_array]):
+
+            for step in range(1, self.n_steps + 1):
+                for i, feature in enumerate(STORE_FEATURES):
+                    self.shards[(kind, step, feature)][first_sample:first_sample + n] = land_array[:, step - 1, i]
+
+
+    def close(self):
+
+        """Flush the shards to disk, compress them if asked for, and mark the store as complete."""
+
+        for key in list(self.shards):
+
+            shard = self.shards.pop(key)
+            shard.flush()
+            path_shard = Path(shard.filename)
+            del shard # closes the memory map
+
+            if self.compression: # the memory-mapped .npy is replaced by a compressed .npz
+                np.savez_compressed(path_shard.with_suffix('.npz'), posterior = np.load(path_shard))
+                path_shard.unlink()
+
+        self.meta['complete'] = True
+        self._save_meta()
+
+        print(f'Posterior store written to {self.path_store}')
+
+
+class PosteriorStore:
+
+    """
+    Reads a posterior store written by PosteriorStoreWriter. Only the shards of the requested steps and features are read,
+    and uncompressed shards are memory-mapped, so selecting a few samples only reads those rows.
+    """
+
+    def __init__(self, path_store):
+
+        self.path_store = Path(path_store)
+
+        with open(self.path_store / 'meta.json', 'r') as file:
+            self.meta = json.load(file)
+
+        if not self.meta['complete']:
+            raise ValueError(f'The posterior store {self.path_store} is incomplete. The writer was never closed.')
+
+        self.cells = np.load(self.path_store / 'cells.npy')
+        self.pg_id = np.load(self.path_store / 'pg_id.npy')
+
+
+    def _load_shard(self, kind, step, feature):
+
+        path_shard = self.path_store / kind / f'step{str(step).zfill(2)}_{feature}'
+
+        if self.meta['compression']:
+            with np.load(path_shard.with_suffix('.npz')) as npz:
+                return npz['posterior']
+
+        return np.load(path_shard.with_suffix('.npy'), mmap_mode = 'r')
+
+
+    def load(self, kind = 'magnitudes', steps = None, features = None, samples = None):
+
+        """
+        Return the posterior samples of the given kind ('magnitudes' or 'probabilities') as an array of shape samples x steps x features x cells.
+        steps (1 indexed, as the evaluation), features (e.g. ['sb']) and samples (anything that indexes a numpy array) select a slice. None selects all.
+        """
+
+        if kind not in STORE_KINDS:
+            raise ValueError(f'Unknown kind: {kind}. Use one of {STORE_KINDS}')
+
+        steps = range(1, self.meta['n_steps'] + 1) if steps is None else steps
+        features = STORE_FEATURES if features is None else features
+        samples = slice(None) if samples is None else samples
+
+        return np.stack([np.stack([np.asarray(self._load_shard(kind, step, feature)[samples]) for feature in features], axis = 1) for step in steps], axis = 1)
+
+
+    def load_observed(self):
+
+        """Return the observed values of the land cells, steps x features x cells."""
+
+        return np.load(self.path_store / 'observed.npy')
+
+
+    def to_grid(self, values, height = 180, width = 180, fill_value = np.nan):
+
+        """Scatter values over the land cells (the last dim) back to height x width grids. The ocean cells get fill_value."""
+
+        grid = np.full(values.shape[:-1] + (height * width,), fill_value, dtype = np.float32)
+        grid[..., self.cells] = values
+
+        return grid.reshape(values.shape[:-1] + (height, width))
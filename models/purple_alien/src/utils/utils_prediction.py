@@ -1,9 +1,12 @@
 import os
 
 import numpy as np
+import pandas as pd
 import pickle
 import time
 import functools
+import warnings
+from types import SimpleNamespace
 
 import torch
 import torch.nn as nn
@@ -27,18 +30,85 @@ from set_path import setup_project_paths, setup_data_paths
 setup_project_paths(PATH)
 
 
-from utils import choose_model, choose_loss, choose_sheduler, get_train_tensors, get_full_tensor, apply_dropout, execute_freeze_h_option, train_log, init_weights, get_data
+from utils import choose_model, choose_loss, choose_sheduler, get_train_tensors, get_full_tensor, apply_dropout, execute_freeze_h_option, train_log, init_weights, get_data, get_land_cells
 from config_sweep import get_sweep_config
 from config_hyperparameters import get_hp_config
+from utils_posterior import PosteriorAggregator
+from utils_posterior_store import PosteriorStoreWriter
+from utils_metrics import get_metric_arrays
+from utils_export import ExportedHydraNet, ReducedPrecisionHydraNet, set_inference_precision
+from utils_timing import timer
 
 
-def predict(model, full_tensor, config, device, sample_i, is_evalutaion = True):
+def get_seq_lens(full_tensor, config, is_evalutaion = True):
+
+    """
+    Returns the full sequence length looped over by predict and the length of the in-sample part of it.
+    In evaluation mode the last config.time_steps months are the hold-out set, in forecasting mode they come after the sequence.
+    """
+
+    seq_len = full_tensor.shape[1] # get the sequence length
+
+    if is_evalutaion:
+        full_seq_len = seq_len -1 # we loop over the full sequence. you need -1 because you are predicting the next month.
+        in_sample_seq_len = seq_len - 1 - config.time_steps # but retain the last time_steps for hold-out evaluation
+
+    else:
+        full_seq_len = seq_len - 1 + config.time_steps # we loop over the entire sequence plus the additional time_steps for forecasting
+        in_sample_seq_len = seq_len - 1 # the in-sample part is now the entire sequence
+
+    return full_seq_len, in_sample_seq_len
+
+
+def warm_up(model, full_tensor, config, device, is_evalutaion = True):
+
+    """
+    Runs the in-sample part of the sequence once, for the shared warm-up mode (posterior_mode = 'shared_warmup', see iter_posterior_batches).
+    Instead of replaying the in-sample months for every posterior sample, predict then branches the out-of-sample rollouts from 
+    the returned hidden state h_tt and last prediction t1_pred.
+
+    With config.warmup_passes = 0 (default) the warm-up is deterministic (dropout off). With config.warmup_passes = n > 0, n warm-ups 
+    with dropout are run together in one batch and the posterior samples branch from them in turn.
+    The returned h_tt and t1_pred have one entry per warm-up pass along the batch dim.
+    """
+
+    warmup_passes = getattr(config, 'warmup_passes', 0)
+
+    model.eval()
+
+    if warmup_passes > 0:
+        model.apply(apply_dropout) # shared passes with MC dropout
+
+    h_tt = model.init_hTtime(hidden_channels = model.base, H = 180, W  = 180, batch_size = max(warmup_passes, 1)).float().to(device)
+
+    _, in_sample_seq_len = get_seq_lens(full_tensor, config, is_evalutaion)
+
+    with torch.no_grad(): # nothing is trained here, so no need to keep the graph of 300+ months around
+        for i in range(in_sample_seq_len):
+
+            print(f'\t\t\t warm-up. month: {i+1}', end= '\r')
+
+            t0 = full_tensor[:, i, :, :, :].to(device)
+            t0 = t0.expand(h_tt.shape[0], -1, -1, -1)
+
+            t1_pred, t1_pred_class, h_tt = model(t0, h_tt)
+
+    return h_tt, t1_pred
+
+
+def predict(model, full_tensor, config, device, sample_i, is_evalutaion = True, n_samples = 1, warmup = None):
 
     """
     Function to create predictions for the Hydranet model.
     The function takes the model, the test tensor, the number of time steps to predict, the config, and the device as input.
     The function returns **two lists of numpy arrays**. One list of the predicted magnitudes and one list of the predicted probabilities.
     Each array is of the shap **fx180x180**, where f is the number of features (currently 3 types of violence).
+
+    With n_samples > 1 the input is repeated along the batch dim, so n_samples posterior samples (each with its own dropout masks) 
+    go through each month together. The arrays are then of the shape **n_samplesxfx180x180**.
+
+    warmup is the (h_tt, t1_pred) returned by warm_up. If given, the in-sample months are skipped and only the out-of-sample 
+    rollouts are run, starting from the warm-up. Posterior sample sample_i + k branches from warm-up pass (sample_i + k) % passes.
     """
 
     print(f'Posterior sample: {sample_i}/{config.test_samples}', end = '\r') # could and should put this in the predict function above.
@@ -55,65 +125,292 @@ def predict(model, full_tensor, config, device, sample_i, is_evalutaion = True):
     pred_class_np_list = []
 
     # initialize the hidden state
-    h_tt = model.init_hTtime(hidden_channels = model.base, H = 180, W  = 180).float().to(device) # coul auto the...
+    h_tt = model.init_hTtime(hidden_channels = model.base, H = 180, W  = 180, batch_size = n_samples).float().to(device) # coul auto the...
 
-    # get the sequence length   
-    seq_len = full_tensor.shape[1] # get the sequence length 
-    
-    if is_evalutaion:
+    # get the sequence length. In evaluation mode the last time_steps are retained for hold-out evaluation, in forecasting mode the in-sample part is the entire sequence
+    full_seq_len, in_sample_seq_len = get_seq_lens(full_tensor, config, is_evalutaion)
 
-        full_seq_len = seq_len -1 # we loop over the full sequence. you need -1 because you are predicting the next month.
-        in_sample_seq_len = seq_len - 1 - config.time_steps # but retain the last time_steps for hold-out evaluation
+    first_month = 0
 
-        # These print staments are informative while the model is running, but the implementation is not optimal....
-        #print(f'\t\t\t\t\t\t\t Evaluation mode. retaining hold out set. Full sequence length: {full_seq_len}', end= '\r')
-    
-    else:
+    if warmup is not None: # branch from the shared warm-up instead of replaying the in-sample months
+        h_warmup, t1_pred_warmup = warmup
+        branch_idx = (sample_i + torch.arange(n_samples)) % h_warmup.shape[0]
+        h_tt = h_warmup[branch_idx.to(h_warmup.device)]
+        t1_pred = t1_pred_warmup[branch_idx.to(t1_pred_warmup.device)]
+        first_month = in_sample_seq_len
 
-        full_seq_len = seq_len - 1 + config.time_steps # we loop over the entire sequence plus the additional time_steps for forecasting
-        in_sample_seq_len = seq_len - 1 # the in-sample part is now the entire sequence
+    with torch.no_grad(): # nothing is trained here, so no need to keep the graph of 300+ months around
+        for i in range(first_month, full_seq_len): 
 
-        #print(f'\t\t\t\t\t\t\t Forecasting mode. No hold out set. Full sequence length: {full_seq_len}', end= '\r')
+            if i < in_sample_seq_len: # This is the in-sample part and where the out sample part is defined (seq_len-1-time_steps)
 
-    for i in range(full_seq_len): 
+                print(f'\t\t\t in sample. month: {i+1}', end= '\r')
 
-        if i < in_sample_seq_len: # This is the in-sample part and where the out sample part is defined (seq_len-1-time_steps)
+                # get the tensor for the current month
+                with timer.phase('host_to_device'):
+                    t0 = full_tensor[:, i, :, :, :].to(device) # This is all you need to put on device.
+                t0 = t0.expand(n_samples, -1, -1, -1) # one copy per posterior sample (a view, so no extra memory)
+            
+                # predict the next month, both the magnitudes and the probabilities and get the updated hidden state (which both cell and hidden state concatenated)
+                with timer.phase('rollout'):
+                    t1_pred, t1_pred_class, h_tt = model(t0, h_tt)
 
-            print(f'\t\t\t in sample. month: {i+1}', end= '\r')
 
-            # get the tensor for the current month
-            t0 = full_tensor[:, i, :, :, :].to(device) # This is all you need to put on device.
-            
-            # predict the next month, both the magnitudes and the probabilities and get the updated hidden state (which both cell and hidden state concatenated)
-            t1_pred, t1_pred_class, h_tt = model(t0, h_tt)
+            else: # take the last t1_pred. This is the out-of-sample part.
+                print(f'\t\t\t Out of sample. month: {i+1}', end= '\r')
+                t0 = t1_pred.detach()
 
+                # Execute  whatever freeze option you have set in the config out of sample
+                with timer.phase('rollout'):
+                    t1_pred, t1_pred_class, h_tt = execute_freeze_h_option(config, model, t0, h_tt)
 
-        else: # take the last t1_pred. This is the out-of-sample part.
-            print(f'\t\t\t Out of sample. month: {i+1}', end= '\r')
-            t0 = t1_pred.detach()
+                    # Only save the out-of-sample predictions
+                    t1_pred_class = torch.sigmoid(t1_pred_class) # there is no sigmoid in the model (the loss takes logits) so you need to do it here.
 
-            # Execute  whatever freeze option you have set in the config out of sample
-            t1_pred, t1_pred_class, h_tt = execute_freeze_h_option(config, model, t0, h_tt)
+                with timer.phase('device_to_host'):
+                    if n_samples == 1:
+                        pred_np_list.append(t1_pred.cpu().detach().numpy().squeeze()) # squeeze to remove the batch dim. So this is a list of 3x180x180 arrays
+                        pred_class_np_list.append(t1_pred_class.cpu().detach().numpy().squeeze()) # squeeze to remove the batch dim. So this is a list of 3x180x180 arrays
 
-            # Only save the out-of-sample predictions
-            t1_pred_class = torch.sigmoid(t1_pred_class) # there is no sigmoid in the model (the loss takes logits) so you need to do it here.
-            pred_np_list.append(t1_pred.cpu().detach().numpy().squeeze()) # squeeze to remove the batch dim. So this is a list of 3x180x180 arrays
-            pred_class_np_list.append(t1_pred_class.cpu().detach().numpy().squeeze()) # squeeze to remove the batch dim. So this is a list of 3x180x180 arrays
+                    else:
+                        pred_np_list.append(t1_pred.cpu().detach().numpy()) # keep the batch dim. So this is a list of n_samplesx3x180x180 arrays
+                        pred_class_np_list.append(t1_pred_class.cpu().detach().numpy())
 
     # return the lists of predictions
     return pred_np_list, pred_class_np_list
 
 
-def sample_posterior(model, views_vol, config, device): 
+def stack_posterior_batch(pred_np_list, pred_class_np_list, n_samples):
+
+    """Stacks the lists of months returned by predict into two arrays (magnitudes and probabilities) of shape samples x months x features x 180 x 180."""
+
+    if n_samples == 1: # add the sample dim predict squeezed away
+        return np.stack(pred_np_list)[np.newaxis], np.stack(pred_class_np_list)[np.newaxis]
+
+    else: # months x samples -> samples x months
+        return np.stack(pred_np_list, axis = 1), np.stack(pred_class_np_list, axis = 1)
+
+
+def get_posterior_streams(config, n_batches):
+
+    """
+    The RNG streams of the posterior sampler: one SeedSequence spawned from config.torch_seed for the warm-up and one for each posterior batch. 
+    A batch seeds numpy and torch from its own stream (see seed_from_stream) before it is drawn, so it gets the same dropout masks 
+    (and freeze_h = 'random' picks) whichever worker draws it - or the calling process, with config.posterior_workers = 0.
+    """
+
+    warmup_stream, *batch_streams = np.random.SeedSequence(config.torch_seed).spawn(n_batches + 1)
+
+    return warmup_stream, batch_streams
+
+
+def seed_from_stream(stream):
+
+    """Seeds numpy and torch from a SeedSequence."""
+
+    np_seed, torch_seed = stream.generate_state(2)
+    np.random.seed(int(np_seed))
+    torch.manual_seed(int(torch_seed))
+
+
+# the state of a posterior worker process, set once by _init_posterior_worker
+_posterior_worker = {}
+
+
+def _init_posterior_worker(model, full_tensor, config, warmup, num_threads):
+
+    # the model and warmup arrive as handles to the shared memory of the main process, so they are not copied
+    torch.set_num_threads(num_threads)
+
+    # full_tensor is the path of the memory-mapped volume (see get_worker_full_tensor): reopen it read-only, so all workers map the same pages
+    if isinstance(full_tensor, str):
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message = 'The given NumPy array is not writable') # the tensor is only read
+            full_tensor, _ = get_full_tensor(np.load(full_tensor, mmap_mode = 'r'), config)
+
+    _posterior_worker.update(model = model, full_tensor = full_tensor, config = config, warmup = warmup)
+
+
+def _draw_posterior_batch(args):
+
+    sample_i, n_samples, stream = args
+    seed_from_stream(stream)
+
+    pred_np_list, pred_class_np_list = predict(_posterior_worker['model'], _posterior_worker['full_tensor'], _posterior_worker['config'], 'cpu', sample_i, 
+                                               n_samples = n_samples, warmup = _posterior_worker['warmup'])
+
+    return stack_posterior_batch(pred_np_list, pred_class_np_list, n_samples)
+
+
+def get_worker_model(model):
+
+    """
+    The model the posterior workers run. The exported graphs of an ExportedHydraNet (see utils_export.py) are not shared with the workers, 
+    so they run the eager model it wraps (in the same precision).
+    """
+
+    if isinstance(model, ReducedPrecisionHydraNet) and isinstance(model.model, ExportedHydraNet):
+        print('The posterior workers run the eager model, not the exported graphs')
+        return ReducedPrecisionHydraNet(model.model.model, model.dtype)
+
+    elif isinstance(model, ExportedHydraNet):
+        print('The posterior workers run the eager model, not the exported graphs')
+        return model.model
+
+    return model
+
+
+def get_worker_full_tensor(full_tensor, views_vol = None):
+
+    """
+    What the posterior workers get to build their full_tensor from. For a memory-mapped views_vol (see get_data) the path of the .npy file, 
+    which the workers reopen (see _init_posterior_worker), like the WindowSampler workers do - so the volume is neither copied nor pickled.
+    Otherwise full_tensor in shared memory. Only its channels are copied there: share_memory_ on the tensor itself would move the whole storage 
+    it is a view of, all channels of the volume. The copy keeps the months x H x W x channels memory layout of the volume, 
+    so the convolutions run on the same layout (and give the same results) as in the main process.
+    """
+
+    if isinstance(views_vol, np.memmap) and views_vol.filename is not None:
+        return str(views_vol.filename)
+
+    return full_tensor.permute(0, 1, 3, 4, 2).contiguous().share_memory_().permute(0, 1, 4, 2, 3)
+
+
+def iter_posterior_batches_parallel(model, full_tensor, config, warmup_fn = None, views_vol = None):
+
+    """
+    Draws the posterior batches like iter_posterior_batches, but in config.posterior_workers CPU processes, and yields them in order.
+
+    The model weights and the shared warm-up (if any, run here from its own stream) are put in shared memory, so the workers 
+    do not hold copies of them. The workers build full_tensor from the memory-mapped views_vol it was made from, if given (see get_worker_full_tensor). Each batch is seeded from its own stream (see get_posterior_streams) and the batches are yielded in the order 
+    of the samples, so the caller aggregates the same samples in the same order for any number of workers. The workers only run the rollouts,
+    the aggregation stays in the calling process - PosteriorAggregator and its P² sketches then see the samples in one order, 
+    instead of merging partial aggregates that would depend on how the samples were split.
+
+    Each worker uses config.posterior_worker_threads torch threads (1 by default). The results are the same for any number of workers
+    with the same number of threads per worker. Without workers (config.posterior_workers = 0) they are only bitwise the same if the calling 
+    process also runs with config.posterior_worker_threads torch threads - with another number of threads the convolutions round differently.
+    """
+
+    posterior_batch_size = getattr(config, 'posterior_batch_size', 1)
+    posterior_workers = config.posterior_workers
+
+    batch_starts = list(range(0, config.test_samples, posterior_batch_size))
+    warmup_stream, batch_streams = get_posterior_streams(config, len(batch_starts))
+
+    if warmup_fn is not None:
+        seed_from_stream(warmup_stream)
+
+        with timer.phase('warmup'):
+            warmup = warmup_fn()
+
+        timer.flush('warmup', 0)
+
+    else:
+        warmup = None
+
+    # move what the workers read to shared memory. A plain namespace for the config, since the WandB config can not be pickled
+    model = get_worker_model(model)
+    model.share_memory()
+    full_tensor = get_worker_full_tensor(full_tensor, views_vol)
+    warmup = None if warmup is None else tuple(tensor.share_memory_() for tensor in warmup)
+    worker_config = SimpleNamespace(**{key: config[key] for key in config.keys()}) if hasattr(config, 'keys') else SimpleNamespace(**vars(config))
+
+    tasks = [(sample_i, min(posterior_batch_size, config.test_samples - sample_i), stream) for sample_i, stream in zip(batch_starts, batch_streams)]
+
+    print(f'Drawing the posterior batches in {posterior_workers} worker processes...')
+
+    # spawn, so the workers start clean instead of forking the thread pools of this process
+    context = torch.multiprocessing.get_context('spawn')
+
+    with context.Pool(posterior_workers, initializer = _init_posterior_worker, 
+                      initargs = (model, full_tensor, worker_config, warmup, getattr(config, 'posterior_worker_threads', 1))) as pool:
+
+        # the wait for the next batch is the rollout time seen from here
+        for (sample_i, _, _), (pred_array, pred_class_array) in zip(tasks, timer.iterate('rollout', pool.imap(_draw_posterior_batch, tasks))):
+
+            print(f'Posterior sample: {sample_i}/{config.test_samples}', end = '\r')
+
+            yield pred_array, pred_class_array
+
+            # one line of phase timings per posterior batch (after the caller has aggregated it), if the timing is on
+            timer.flush('posterior', sample_i)
+
+
+def iter_posterior_batches(model, full_tensor, config, device, posterior_mode = None, views_vol = None):
+
+    """
+    Draws the config.test_samples posterior samples in batches of config.posterior_batch_size (see predict) and yields them one batch at a time, 
+    as two numpy arrays (magnitudes and probabilities) of shape samples x months x features x 180 x 180.
+    With posterior_mode = 'shared_warmup' the in-sample months are run once (see warm_up) and all batches branch from there.
+    posterior_mode defaults to config.posterior_mode. Pass it to use another mode without changing the config (see posterior_mode_report).
+    With config.posterior_workers > 0 the batches are drawn in that many CPU processes (see iter_posterior_batches_parallel).
+    Either way the warm-up and each batch are seeded from their own stream (see get_posterior_streams), so the posterior does not depend on the number of workers,
+    as long as the calling process runs with as many torch threads as each worker (config.posterior_worker_threads, see iter_posterior_batches_parallel).
+    views_vol is the volume full_tensor was made from (get_full_tensor). If it is memory-mapped, the workers reopen it instead of getting a copy of full_tensor.
+    """
+
+    # number of posterior samples drawn together in one batch. Lower it if the batch does not fit in memory
+    posterior_batch_size = getattr(config, 'posterior_batch_size', 1)
+
+    # 'full_replay' replays the in-sample months for every posterior sample, 'shared_warmup' runs them once (see warm_up)
+    if posterior_mode is None:
+        posterior_mode = getattr(config, 'posterior_mode', 'full_replay')
+
+    if posterior_mode not in ['full_replay', 'shared_warmup']:
+        raise ValueError(f'Unknown posterior_mode: {posterior_mode}. Use "full_replay" or "shared_warmup"')
+
+    # the parallel sampler is for CPU nodes - on a gpu the batches are drawn here, as before
+    if getattr(config, 'posterior_workers', 0) > 0:
+
+        if torch.device(device).type == 'cpu':
+            warmup_fn = (lambda: warm_up(model, full_tensor, config, device)) if posterior_mode == 'shared_warmup' else None
+            yield from iter_posterior_batches_parallel(model, full_tensor, config, warmup_fn, views_vol)
+            return
+
+        print(f'posterior_workers is only used on CPU. Drawing the posterior samples on {device} in this process...')
+
+    # the same streams as the parallel sampler, so the posterior is the same with and without workers (with the same number of torch threads)
+    batch_starts = list(range(0, config.test_samples, posterior_batch_size))
+    warmup_stream, batch_streams = get_posterior_streams(config, len(batch_starts))
+
+    if posterior_mode == 'shared_warmup':
+        seed_from_stream(warmup_stream)
+
+        with timer.phase('warmup'):
+            warmup = warm_up(model, full_tensor, config, device)
+
+        timer.flush('warmup', 0)
+
+    else:
+        warmup = None
+
+    for sample_i, stream in zip(batch_starts, batch_streams): # number of posterior samples to draw - just set config.test_samples, no? 
+
+        n_samples = min(posterior_batch_size, config.test_samples - sample_i) # the last batch can be smaller
+        seed_from_stream(stream)
+
+        # full_tensor is need on device here, but maybe just do it inside the test function? 
+        pred_np_list, pred_class_np_list = predict(model, full_tensor, config, device, sample_i, n_samples = n_samples, warmup = warmup) # Returns two lists of numpy arrays (shape 3/180/180). One list of the predicted magnitudes and one list of the predicted probabilities.
+
+        yield stack_posterior_batch(pred_np_list, pred_class_np_list, n_samples)
+
+        # one line of phase timings per posterior batch (after the caller has aggregated it), if the timing is on
+        timer.flush('posterior', sample_i)
+
+
+def sample_posterior(model, views_vol, config, device, posterior_mode = None): 
 
     """
     Samples from the posterior distribution of Hydranet.
+    All samples are kept in memory - use aggregate_posterior if you only need the mean, std and quantiles.
 
     Args:
     - model: HydraNet
     - views_vol (torch.Tensor): Input views data.
     - config: Configuration file
     - device: Device for computations.
+    - posterior_mode: 'full_replay' or 'shared_warmup'. Defaults to config.posterior_mode (see iter_posterior_batches).
 
     Returns:
     - tuple: (posterior_magnitudes, posterior_probabilities, out_of_sample_data)
@@ -131,15 +428,189 @@ def sample_posterior(model, views_vol, config, device):
     posterior_list = []
     posterior_list_class = []
 
-    for sample_i in range(config.test_samples): # number of posterior samples to draw - just set config.test_samples, no? 
+    for pred_array, pred_class_array in iter_posterior_batches(model, full_tensor, config, device, posterior_mode, views_vol):
 
-        # full_tensor is need on device here, but maybe just do it inside the test function? 
-        pred_np_list, pred_class_np_list = predict(model, full_tensor, config, device, sample_i) # Returns two lists of numpy arrays (shape 3/180/180). One list of the predicted magnitudes and one list of the predicted probabilities.
-        posterior_list.append(pred_np_list)
-        posterior_list_class.append(pred_class_np_list)
-
-        #if i % 10 == 0: # print steps 10
-        #print(f'Posterior sample: {sample}/{config.test_samples}', end = '\r') # could and should put this in the predict function above.
+        # split the batch back into one list of months per sample
+        with timer.phase('aggregation'):
+            posterior_list.extend([list(pred) for pred in pred_array])
+            posterior_list_class.extend([list(pred_class) for pred_class in pred_class_array])
 
     return posterior_list, posterior_list_class, out_of_sample_vol, out_of_sample_meta_vol, full_tensor, metadata_tensor
 
+
+def aggregate_posterior(model, views_vol, config, device, path_store = None):
+
+    """
+    Samples from the posterior distribution of Hydranet like sample_posterior, but aggregates the samples as they are drawn (see PosteriorAggregator) 
+    instead of keeping them, so the memory does not grow with config.test_samples.
+    Only the land cells (see get_land_cells) are aggregated, so the aggregates are of shape months x features x cells (the index is aggregator.cells).
+    The quantiles in config.posterior_quantiles (if any) are estimated as well. 
+    If path_store is given, the raw samples of the land cells are written to a posterior store there (see PosteriorStoreWriter), 
+    in config.posterior_store_dtype and compressed if config.posterior_store_compression is set.
+
+    Returns:
+    - tuple: (aggregator, out_of_sample_vol, out_of_sample_meta_vol, full_tensor, metadata_tensor)
+    """
+
+    print(f'Drawing and aggregating {config.test_samples} posterior samples...', end = '\r')
+
+    full_tensor, metadata_tensor = get_full_tensor(views_vol, config)
+    out_of_sample_vol = full_tensor[:,-config.time_steps:,:,:,:].cpu().numpy() # From the test tensor get the out-of-sample time_steps. 
+    out_of_sample_meta_vol = metadata_tensor[:,-config.time_steps:,:,:,:]
+
+    # the land cell index, derived once
+    cells, pg_id = get_land_cells(metadata_tensor, config.time_steps)
+
+    if path_store is not None:
+        store = PosteriorStoreWriter(path_store, config.test_samples, config.time_steps, cells, pg_id, out_of_sample_vol,
+                                     dtype = getattr(config, 'posterior_store_dtype', 'float16'), compression = getattr(config, 'posterior_store_compression', False))
+
+    else:
+        store = None
+
+    aggregator = PosteriorAggregator(cells = cells, quantiles = getattr(config, 'posterior_quantiles', None), store = store)
+
+    for pred_array, pred_class_array in iter_posterior_batches(model, full_tensor, config, device, views_vol = views_vol):
+        with timer.phase('aggregation'):
+            aggregator.update(pred_array, pred_class_array)
+
+    if store is not None:
+        store.close()
+
+    return aggregator, out_of_sample_vol, out_of_sample_meta_vol, full_tensor, metadata_tensor
+
+
+def get_calibration_metrics(posterior_list, posterior_list_class, out_of_sample_vol, cells = None, n_bins = 10):
+
+    """
+    Returns the calibration metrics of a posterior, per feature (sb, ns, os), averaged over the out-of-sample months:
+    MSE of the posterior mean, Brier score and average precision of the mean probability, the expected calibration error (ECE) 
+    of the mean probability over n_bins equal-width bins, the share of the true values inside the central 90% posterior interval, 
+    and the mean posterior standard deviation.
+    If cells (the land cell index from get_land_cells) is given, only those cells are evaluated.
+    """
+
+    posterior_array = np.array(posterior_list) # samples x months x features x 180 x 180
+    posterior_class_array = np.array(posterior_list_class)
+    y_true_array = out_of_sample_vol[0] # months x features x 180 x 180
+
+    # flatten the grid to cells - and gather the land cells if given
+    cells = slice(None) if cells is None else cells
+    posterior_array = posterior_array.reshape(posterior_array.shape[:3] + (-1,))[..., cells]
+    posterior_class_array = posterior_class_array.reshape(posterior_class_array.shape[:3] + (-1,))[..., cells]
+    y_true_array = y_true_array.reshape(y_true_array.shape[:2] + (-1,))[..., cells]
+
+    mean_array = posterior_array.mean(axis = 0)
+    mean_class_array = posterior_class_array.mean(axis = 0)
+    lower_array, upper_array = np.quantile(posterior_array, [0.05, 0.95], axis = 0)
+
+    metrics = []
+
+    for i, feature in enumerate(['sb', 'ns', 'os']):
+
+        y_true = y_true_array[:, i] # months x cells
+        y_true_binary = (y_true > 0) * 1
+        y_score_prob = mean_class_array[:, i]
+
+        # expected calibration error: the bin-size weighted gap between the mean probability and the event frequency in each bin
+        bins = np.minimum((y_score_prob * n_bins).astype(int), n_bins - 1).reshape(-1)
+        bin_counts = np.bincount(bins, minlength = n_bins)
+        bin_prob = np.bincount(bins, weights = y_score_prob.reshape(-1), minlength = n_bins)
+        bin_true = np.bincount(bins, weights = y_true_binary.reshape(-1), minlength = n_bins)
+        ece = np.abs(bin_prob - bin_true).sum() / bin_counts.sum()
+
+        metrics.append({
+            'feature' : feature,
+            'MSE' : mean_squared_error(y_true.reshape(-1), mean_array[:, i].reshape(-1)),
+            'Brier' : brier_score_loss(y_true_binary.reshape(-1), y_score_prob.reshape(-1)),
+            'AP' : average_precision_score(y_true_binary.reshape(-1), y_score_prob.reshape(-1)),
+            'ECE' : ece,
+            'coverage_90' : np.mean((y_true >= lower_array[:, i]) & (y_true <= upper_array[:, i])),
+            'mean_std' : posterior_array[:, :, i].std(axis = 0).mean(),
+        })
+
+    return metrics
+
+
+def posterior_mode_report(model, views_vol, config, device):
+
+    """
+    Compares the calibration of the shared warm-up mode ('shared_warmup') against the full replay of the 
+    in-sample months for every posterior sample ('full_replay'). Both posteriors are drawn from the same seeds (see get_posterior_streams).
+    The mode is passed to sample_posterior, not set in the config - a WandB config does not allow changing it (and a sweep locks it).
+
+    Returns a DataFrame with one row per posterior mode and feature, holding the metrics of get_calibration_metrics and the 
+    wall time of sample_posterior.
+    """
+
+    report = []
+
+    for mode in ['full_replay', 'shared_warmup']:
+
+        start_time = time.time()
+        posterior_list, posterior_list_class, out_of_sample_vol, _, _, metadata_tensor = sample_posterior(model, views_vol, config, device, posterior_mode = mode)
+        wall_time = time.time() - start_time
+
+        cells, _ = get_land_cells(metadata_tensor, config.time_steps)
+
+        for metrics in get_calibration_metrics(posterior_list, posterior_list_class, out_of_sample_vol, cells):
+            report.append({'posterior_mode' : mode, **metrics, 'wall_time' : wall_time})
+
+    return pd.DataFrame(report)
+
+
+def inference_precision_report(model, views_vol, config, device, precision = 'bfloat16'):
+
+    """
+    Validates a reduced precision inference mode (see set_inference_precision in utils_export.py) against the float32 path, 
+    e.g. on a stored calibration volume, before it is switched on. Both posteriors are drawn with aggregate_posterior and the same seed.
+    If model is already a ReducedPrecisionHydraNet, the float32 model it wraps is the reference.
+
+    Returns a DataFrame with one row per precision and feature, holding the MSE and AP of the posterior mean (averaged over the months), 
+    the mean posterior std, the max and mean absolute difference of the posterior mean, std and mean probability to the float32 posterior, 
+    and the wall time of aggregate_posterior.
+    """
+
+    float_model = model.model if isinstance(model, ReducedPrecisionHydraNet) else model
+    aggregators = {}
+    wall_times = {}
+
+    for inference_precision in ['float32', precision]:
+
+        torch.manual_seed(config.torch_seed)
+
+        start_time = time.time()
+        aggregators[inference_precision], out_of_sample_vol, _, _, _ = aggregate_posterior(set_inference_precision(float_model, inference_precision), views_vol, config, device)
+        wall_times[inference_precision] = time.time() - start_time
+
+    reference = aggregators['float32']
+    n_months = out_of_sample_vol.shape[1]
+    land_true_array = out_of_sample_vol[0].reshape(n_months, out_of_sample_vol.shape[2], -1)[..., reference.cells] # months x features x cells
+
+    report = []
+
+    for inference_precision, aggregator in aggregators.items():
+
+        metric_arrays = get_metric_arrays(land_true_array, aggregator.mean, aggregator.mean_class)
+
+        for i, feature in enumerate(['sb', 'ns', 'os']):
+
+            diff_mean = np.abs(aggregator.mean[:, i] - reference.mean[:, i])
+            diff_std = np.abs(aggregator.std[:, i] - reference.std[:, i])
+            diff_mean_class = np.abs(aggregator.mean_class[:, i] - reference.mean_class[:, i])
+
+            report.append({
+                'precision' : inference_precision,
+                'feature' : feature,
+                'MSE' : np.nanmean(metric_arrays['MSE'][:, i]),
+                'AP' : np.nanmean(metric_arrays['AP'][:, i]),
+                'mean_std' : aggregator.std[:, i].mean(),
+                'max_abs_diff_mean' : diff_mean.max(),
+                'mean_abs_diff_mean' : diff_mean.mean(),
+                'max_abs_diff_std' : diff_std.max(),
+                'mean_abs_diff_std' : diff_std.mean(),
+                'max_abs_diff_mean_class' : diff_mean_class.max(),
+                'wall_time' : wall_times[inference_precision],
+            })
+
+    return pd.DataFrame(report)
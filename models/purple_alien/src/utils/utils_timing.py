@@ -0,0 +1,174 @@
+import os
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+import torch
+import wandb
+
+
+TRAIN_PHASES = ['window_sampling', 'host_to_device', 'forward', 'loss', 'backward', 'optimizer', 'checkpoint']
+INFERENCE_PHASES = ['warmup', 'host_to_device', 'rollout', 'device_to_host', 'aggregation', 'metrics']
+
+
+class PhaseTimer:
+
+    """
+    Wall time counters for the phases of the training and the inference (see TRAIN_PHASES and INFERENCE_PHASES).
+
+    The time spent in each phase is added up until flush, which writes one JSON line per sample (training) or posterior batch (inference)
+    with the seconds and the number of calls of each phase, and forwards the seconds to WandB if asked to (under timing/{stage}/{phase}).
+    Off by default: then phase is a no-op and flush does nothing, so the instrumented code costs nothing when the timing is not used.
+
+    On cuda the device is synchronized at the end of each phase, so the time of the kernels is counted in the phase that launched them
+    and not in the next one that waits for them. This costs some throughput, so compare timed runs with timed runs.
+
+    There is one timer for the whole run (timer below), set up in execute_model_tasks (setup_timing). Use it as:
+
+        with timer.phase('forward'):
+            t1_pred, t1_pred_class, h = model(t0, h)
+        ...
+        timer.flush('train', sample)
+    """
+
+    def __init__(self):
+
+        self.enabled = False
+        self.path = None
+        self.log_wandb = False
+        self.synchronize = False
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+
+    def setup(self, path, device = 'cpu', log_wandb = False):
+
+        """Turns the timer on, appending to the JSONL file at path."""
+
+        self.enabled = True
+        self.path = Path(path)
+        self.log_wandb = log_wandb
+        self.synchronize = torch.device(device).type == 'cuda'
+        self.reset()
+
+        os.makedirs(self.path.parent, exist_ok = True)
+
+        if log_wandb: # all timings on their own step, so they do not move the step of the other metrics
+            wandb.define_metric('timing/step')
+            wandb.define_metric('timing/*', step_metric = 'timing/step')
+
+        print(f'Timing the phases to {self.path}')
+
+
+    def reset(self):
+
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+
+    @contextmanager
+    def phase(self, name):
+
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            if self.synchronize:
+                torch.cuda.synchronize()
+
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+
+    def iterate(self, name, iterable):
+
+        """Yields from iterable, timing how long each item takes to come (e.g. the wait for the next batch of the window loader)."""
+
+        iterator = iter(iterable)
+
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+
+                except StopIteration:
+                    return
+
+            yield item
+
+
+    def flush(self, stage, step):
+
+        """Writes the counters since the last flush as one JSON line (stage, step, seconds and calls per phase, and their total) and resets them."""
+
+        if not self.enabled:
+            return
+
+        record = {'stage': stage,
+                  'step': step,
+                  'time': time.time(),
+                  'seconds': dict(self.seconds),
+                  'calls': dict(self.calls),
+                  'total_seconds': sum(self.seconds.values())}
+
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+        if self.log_wandb:
+            log_dict = {f'timing/{stage}/{name}': seconds for name, seconds in self.seconds.items()}
+            log_dict[f'timing/{stage}/total'] = record['total_seconds']
+            log_dict['timing/step'] = step
+            wandb.log(log_dict)
+
+        self.reset()
+
+
+# the timer of the run. Off until setup_timing
+timer = PhaseTimer()
+
+
+def setup_timing(config, PATH_GENERATED, device):
+
+    """
+    Turns the run's timer on if config.timing is set, writing to timing_{run_type}_{timestamp}.jsonl in PATH_GENERATED.
+    With config.timing_wandb the timings are logged to WandB as well.
+    """
+
+    if not getattr(config, 'timing', False):
+        return
+
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
+    timer.setup(Path(PATH_GENERATED) / f'timing_{config.run_type}_{timestamp}.jsonl', device, getattr(config, 'timing_wandb', False))
+
+
+def summarize_timing(path):
+
+    """
+    Reads a timing JSONL file (see PhaseTimer) into a DataFrame with the total and mean seconds of each stage and phase,
+    and the share of the stage time each phase takes. Handy for comparing the throughput before and after an architecture change.
+    """
+
+    rows = []
+
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+
+            for name, seconds in record['seconds'].items():
+                rows.append({'stage': record['stage'], 'step': record['step'], 'phase': name, 'seconds': seconds})
+
+    df = pd.DataFrame(rows, columns = ['stage', 'step', 'phase', 'seconds'])
+
+    df_summary = df.groupby(['stage', 'phase'])['seconds'].agg(total_seconds = 'sum', mean_seconds = 'mean', steps = 'count').reset_index()
+    df_summary['share'] = df_summary['total_seconds'] / df_summary.groupby('stage')['total_seconds'].transform('sum')
+
+    return df_summary
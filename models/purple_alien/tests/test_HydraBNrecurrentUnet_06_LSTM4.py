@@ -0,0 +1,180 @@
+import pytest
+import torch
+import sys
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_ARCHITECTURES = PATH_ROOT / 'models' / 'purple_alien' / 'src' / 'architectures'
+    if not PATH_ARCHITECTURES.exists():
+        raise ValueError("The 'models/purple_alien/src/architectures' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_ARCHITECTURES))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+import HydraBNrecurrentUnet_06_LSTM4 as architecture
+from HydraBNrecurrentUnet_06_LSTM4 import HydraBNUNet06_LSTM4, fuse_lstm_state_dict, group_decoder_state_dict
+
+
+N_MONTHS = 4
+BATCH_SIZE = 3
+WINDOW_DIM = 16
+
+
+@pytest.fixture
+def model():
+    """
+    Fixture to create a HydraBNUNet06_LSTM4 with the separate LSTM convs and decoder heads, in eval mode.
+
+    The batch norm running statistics are randomized, so a head whose batch norm ends up in the wrong place changes the output.
+    """
+    torch.manual_seed(0)
+    model = HydraBNUNet06_LSTM4(input_channels=3, total_hidden_channels=32, output_channels=1, dropout_rate=0.125)
+
+    for name, buffer in model.named_buffers():
+        if name.endswith('running_mean'):
+            buffer.copy_(torch.randn_like(buffer) * 0.1)
+        elif name.endswith('running_var'):
+            buffer.copy_(torch.rand_like(buffer) + 0.5)
+
+    return model.eval()
+
+
+@pytest.fixture
+def inputs():
+    """
+    Fixture to create N_MONTHS months of input and an initial hidden state for a batch of BATCH_SIZE windows.
+    """
+    torch.manual_seed(1)
+    x = torch.rand(N_MONTHS, BATCH_SIZE, 3, WINDOW_DIM, WINDOW_DIM)
+    h = torch.randn(BATCH_SIZE, 32, WINDOW_DIM, WINDOW_DIM)
+
+    return x, h
+
+
+def convert(model, fused_lstm, grouped_decoder, state_dict):
+    """
+    Loads a converted state dict into a new model with the given layout, in eval mode.
+    """
+    converted_model = HydraBNUNet06_LSTM4(input_channels=3, total_hidden_channels=32, output_channels=1, dropout_rate=0.125,
+                                          fused_lstm=fused_lstm, grouped_decoder=grouped_decoder)
+    converted_model.load_state_dict(state_dict)
+
+    return converted_model.eval()
+
+
+def get_rollout(model, x, h):
+    """
+    Runs the model over the months of x, feeding the hidden state forward, and returns the outputs and hidden state of every month.
+    """
+    rollout = []
+
+    with torch.no_grad():
+        for t0 in x:
+            t1_pred, t1_pred_class, h = model(t0, h)
+            rollout.append((t1_pred, t1_pred_class, h))
+
+    return rollout
+
+
+def assert_rollouts_close(rollout, converted_rollout):
+    for month, (outputs, converted_outputs) in enumerate(zip(rollout, converted_rollout)):
+        for output, converted_output in zip(outputs, converted_outputs):
+            torch.testing.assert_close(converted_output, output, rtol=1e-5, atol=1e-5, msg=lambda msg: f'month {month}: {msg}')
+
+
+@pytest.mark.parametrize("fused_lstm, grouped_decoder", [(True, False), (False, True), (True, True)])
+def test_converted_model_equivalence(model, inputs, fused_lstm, grouped_decoder):
+    """
+    Test that the fused LSTM (fuse_lstm_state_dict) and the grouped decoder (group_decoder_state_dict) give the same
+    outputs and hidden states as the separate layers they are converted from, over several months and a batch of windows.
+    """
+    state_dict = model.state_dict()
+
+    if fused_lstm:
+        state_dict = fuse_lstm_state_dict(state_dict)
+    if grouped_decoder:
+        state_dict = group_decoder_state_dict(state_dict)
+
+    converted_model = convert(model, fused_lstm, grouped_decoder, state_dict)
+    x, h = inputs
+
+    assert_rollouts_close(get_rollout(model, x, h), get_rollout(converted_model, x, h))
+
+
+def test_fuse_lstm_state_dict_gate_order(model, inputs, monkeypatch):
+    """
+    Test that the equivalence check is sensitive to the layout: fusing the gates in the wrong order changes the rollout.
+    """
+    monkeypatch.setattr(architecture, 'LSTM_GATES', ['f', 'i', 'c', 'o'])
+    converted_model = convert(model, True, False, fuse_lstm_state_dict(model.state_dict()))
+    x, h = inputs
+
+    with pytest.raises(AssertionError):
+        assert_rollouts_close(get_rollout(model, x, h), get_rollout(converted_model, x, h))
+
+
+def test_group_decoder_state_dict_head_order(model, inputs, monkeypatch):
+    """
+    Test that the equivalence check is sensitive to the layout: grouping the decoder heads in the wrong order changes the outputs.
+    """
+    heads = list(architecture.DECODER_HEADS)
+    heads[0], heads[1] = heads[1], heads[0]
+    monkeypatch.setattr(architecture, 'DECODER_HEADS', heads)
+    state_dict = group_decoder_state_dict(model.state_dict())
+    monkeypatch.undo()
+    converted_model = convert(model, False, True, state_dict)
+    x, h = inputs
+
+    with pytest.raises(AssertionError):
+        assert_rollouts_close(get_rollout(model, x, h), get_rollout(converted_model, x, h))
+
+
+class FixedMaskDropout(torch.nn.Module):
+    """
+    Dropout with a fixed mask per spatial size, so both decoders drop out the same cells whatever the number and order of
+    their dropout calls. A tensor dropped out twice is scaled twice, so a missing or extra re-drop still changes the outputs.
+    """
+    def __init__(self, p):
+        super().__init__()
+        self.p = p
+
+    def forward(self, x):
+        generator = torch.Generator().manual_seed(x.shape[-1])
+        keep = (torch.rand(x.shape[-2:], generator=generator) >= self.p).to(x.dtype)
+
+        return x * keep / (1 - self.p)
+
+
+def get_dropout_rollouts(model, x, h):
+    """
+    Returns the rollouts of model and its grouped decoder conversion, with the same dropout masks in both.
+    """
+    grouped_model = convert(model, False, True, group_decoder_state_dict(model.state_dict()))
+
+    for m in [model, grouped_model]:
+        m.dropout = FixedMaskDropout(p=0.5)
+
+    return get_rollout(model, x, h), get_rollout(grouped_model, x, h)
+
+
+def test_grouped_decoder_dropout_equivalence(model, inputs):
+    """
+    Test that with dropout active (as in MC-dropout posterior sampling) the grouped decoder drops out the same tensors as
+    the separate heads, including the heads that continue from the dropped out head1 class (DECODER_D0_REDROP, DECODER_D1_SOURCE).
+    """
+    x, h = inputs
+
+    assert_rollouts_close(*get_dropout_rollouts(model, x, h))
+
+
+def test_grouped_decoder_dropout_redrop(model, inputs, monkeypatch):
+    """
+    Test that the dropout equivalence check is sensitive to the rerouting: without the re-drop the outputs differ.
+    """
+    monkeypatch.setattr(architecture, 'DECODER_D0_REDROP', torch.zeros(len(architecture.DECODER_HEADS), dtype=torch.bool))
+    x, h = inputs
+
+    with pytest.raises(AssertionError):
+        assert_rollouts_close(*get_dropout_rollouts(model, x, h))
@@ -0,0 +1,49 @@
+import pytest
+import torch
+import sys
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_UTILS = PATH_ROOT / 'models' / 'purple_alien' / 'src' / 'utils'
+    if not PATH_UTILS.exists():
+        raise ValueError("The 'models/purple_alien/src/utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_UTILS))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from focal_loss import FocalLoss
+
+
+@pytest.fixture
+def logits_and_targets():
+    """
+    Fixture to create logits and binary targets of shape N x C x H x W.
+    """
+    torch.manual_seed(0)
+    logits = torch.randn(2, 3, 8, 8)
+    targets = (torch.rand(2, 3, 8, 8) > 0.8).float()
+
+    return logits, targets
+
+
+@pytest.mark.parametrize("reduction", ['mean', 'sum'])
+def test_channel_losses_match_forward(logits_and_targets, reduction):
+    """
+    Test that channel_losses gives the same loss for each channel as calling forward on the channel.
+    """
+    logits, targets = logits_and_targets
+    loss_fn = FocalLoss(reduction=reduction)
+
+    expected = torch.stack([loss_fn(logits[:, j], targets[:, j]) for j in range(logits.shape[1])])
+
+    torch.testing.assert_close(loss_fn.channel_losses(logits, targets), expected)
+
+
+def test_channel_losses_unsupported_reduction(logits_and_targets):
+    """
+    Test that channel_losses refuses reductions it can not return one loss per channel for.
+    """
+    with pytest.raises(ValueError):
+        FocalLoss(reduction='none').channel_losses(*logits_and_targets)
@@ -0,0 +1,96 @@
+import pytest
+import numpy as np
+import torch
+import sys
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_UTILS = PATH_ROOT / 'models' / 'purple_alien' / 'src' / 'utils'
+    if not PATH_UTILS.exists():
+        raise ValueError("The 'models/purple_alien/src/utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_UTILS))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from mtloss import MultiTaskLoss
+from warmup_decay_lr_scheduler import WarmupDecayLearningRateScheduler
+from utils_checkpoint import get_training_state, set_training_state, load_checkpoint, get_path_checkpoint, CheckpointWriter
+
+
+N_SAMPLES = 10
+
+
+def get_training_objects(seed):
+    """
+    Creates a tiny model with dropout, the AdamW optimizer, the warm-up/decay scheduler and the MultiTaskLoss, as in utils.py.
+    """
+    torch.manual_seed(seed)
+    model = torch.nn.Sequential(torch.nn.Linear(4, 8), torch.nn.ReLU(), torch.nn.Dropout(0.5), torch.nn.Linear(8, 2))
+    multitaskloss_instance = MultiTaskLoss(torch.tensor([True, False]), reduction='sum')
+    optimizer = torch.optim.AdamW(list(model.parameters()) + list(multitaskloss_instance.parameters()), lr=1e-2)
+    scheduler = WarmupDecayLearningRateScheduler(optimizer, d=8, warmup_steps=3)
+
+    return model, optimizer, scheduler, multitaskloss_instance
+
+
+def train(model, optimizer, scheduler, multitaskloss_instance, first_sample, last_sample):
+    """
+    A training loop that draws its batches from numpy and its dropout masks from torch, as training_loop does.
+    """
+    model.train()
+
+    for _ in range(first_sample, last_sample):
+        x = torch.tensor(np.random.rand(5, 4), dtype=torch.float32)
+        losses = (model(x) - 1).pow(2).mean(dim=0)
+        loss = multitaskloss_instance(losses)
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        scheduler.step()
+
+
+def test_resumed_training_matches_uninterrupted(tmp_path):
+    """
+    Test that training that is checkpointed, stopped and resumed in new objects gives the same model, optimizer and MultiTaskLoss
+    as training that was never stopped.
+    """
+    np.random.seed(0)
+    objects = get_training_objects(seed=0)
+    train(*objects, 0, N_SAMPLES)
+
+    np.random.seed(0)
+    stopped_objects = get_training_objects(seed=0)
+    train(*stopped_objects, 0, N_SAMPLES // 2)
+
+    PATH_CHECKPOINT = get_path_checkpoint(tmp_path, 'calibration')
+    writer = CheckpointWriter(PATH_CHECKPOINT)
+    writer.save(get_training_state(*stopped_objects, next_sample=N_SAMPLES // 2))
+    writer.close()
+
+    # a new process: other weights and RNG states until the checkpoint is loaded
+    np.random.seed(1)
+    resumed_objects = get_training_objects(seed=1)
+    next_sample = set_training_state(load_checkpoint(PATH_CHECKPOINT), *resumed_objects)
+    assert next_sample == N_SAMPLES // 2
+
+    train(*resumed_objects, next_sample, N_SAMPLES)
+
+    (model, optimizer, scheduler, multitaskloss_instance) = objects
+    (resumed_model, resumed_optimizer, resumed_scheduler, resumed_multitaskloss_instance) = resumed_objects
+
+    for name, tensor in model.state_dict().items():
+        torch.testing.assert_close(resumed_model.state_dict()[name], tensor, rtol=0, atol=0, msg=lambda msg: f'{name}: {msg}')
+
+    torch.testing.assert_close(resumed_multitaskloss_instance.log_vars, multitaskloss_instance.log_vars, rtol=0, atol=0)
+    torch.testing.assert_close(resumed_optimizer.state_dict()['state'], optimizer.state_dict()['state'], rtol=0, atol=0)
+    assert resumed_scheduler.get_last_lr() == scheduler.get_last_lr()
+
+
+def test_load_checkpoint_missing(tmp_path):
+    """
+    Test that load_checkpoint returns None when there is no checkpoint to resume from.
+    """
+    assert load_checkpoint(get_path_checkpoint(tmp_path, 'calibration')) is None
@@ -0,0 +1,91 @@
+import pytest
+import torch
+import sys
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_PURPLE_ALIEN = PATH_ROOT / 'models' / 'purple_alien' / 'src'
+    if not PATH_PURPLE_ALIEN.exists():
+        raise ValueError("The 'models/purple_alien/src' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_PURPLE_ALIEN / 'architectures'))
+    sys.path.insert(0, str(PATH_PURPLE_ALIEN / 'utils'))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from HydraBNrecurrentUnet_06_LSTM4 import HydraBNUNet06_LSTM4
+from utils_export import ExportedHydraNet, export_model, get_export_mode, get_path_export_cache
+
+
+@pytest.fixture
+def model():
+    """
+    Fixture to create a small HydraBNUNet06_LSTM4 in eval mode.
+    """
+    torch.manual_seed(0)
+    model = HydraBNUNet06_LSTM4(input_channels=3, total_hidden_channels=8, output_channels=1, dropout_rate=0.125)
+
+    return model.eval()
+
+
+@pytest.fixture
+def inputs():
+    """
+    Fixture to create three months of input and an initial hidden state for 3 windows of 48x48 - another batch and size than the traced example.
+    """
+    torch.manual_seed(1)
+    x = torch.rand(3, 3, 3, 48, 48)
+    h = torch.randn(3, 8, 48, 48)
+
+    return x, h
+
+
+def get_rollout(model, x, h):
+    """
+    Runs the model over the months of x, feeding the hidden state forward, and returns the outputs and hidden state of every month.
+    """
+    rollout = []
+
+    with torch.no_grad():
+        for t0 in x:
+            t1_pred, t1_pred_class, h = model(t0, h)
+            rollout.append((t1_pred, t1_pred_class, h))
+
+    return rollout
+
+
+def test_torchscript_step_matches_eager(tmp_path, model, inputs):
+    """
+    Test that the torchscript step gives the same outputs and hidden states as the eager model in eval mode, and that the traced
+    graph is cached next to the artifact and reloaded from there.
+    """
+    PATH_MODEL_ARTIFACT = tmp_path / 'calibration_model_20240101_120000.pt'
+    exported_model = export_model(model, PATH_MODEL_ARTIFACT, backend='torchscript')
+    x, h = inputs
+
+    assert isinstance(exported_model, ExportedHydraNet)
+    assert get_export_mode(model) == 'eval'
+
+    rollout = get_rollout(model, x, h)
+    exported_rollout = get_rollout(exported_model, x, h)
+
+    assert (get_path_export_cache(PATH_MODEL_ARTIFACT) / 'separate_eval.pt').exists()
+    for outputs, exported_outputs in zip(rollout, exported_rollout):
+        for output, exported_output in zip(outputs, exported_outputs):
+            torch.testing.assert_close(exported_output, output, rtol=1e-5, atol=1e-6)
+
+    reloaded_rollout = get_rollout(export_model(model, PATH_MODEL_ARTIFACT, backend='torchscript'), x, h)
+    for outputs, reloaded_outputs in zip(exported_rollout, reloaded_rollout):
+        for output, reloaded_output in zip(outputs, reloaded_outputs):
+            torch.testing.assert_close(reloaded_output, output, rtol=0, atol=0)
+
+
+def test_export_model_eager(tmp_path, model):
+    """
+    Test that the eager backend returns the model as it is and that unknown backends are rejected.
+    """
+    assert export_model(model, tmp_path / 'calibration_model_20240101_120000.pt') is model
+
+    with pytest.raises(ValueError):
+        ExportedHydraNet(model, 'tensorrt', tmp_path)
@@ -0,0 +1,71 @@
+import pytest
+import numpy as np
+import sys
+from pathlib import Path
+from sklearn.metrics import average_precision_score, roc_auc_score, mean_squared_error, brier_score_loss
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_UTILS = PATH_ROOT / 'models' / 'purple_alien' / 'src' / 'utils'
+    if not PATH_UTILS.exists():
+        raise ValueError("The 'models/purple_alien/src/utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_UTILS))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from utils_metrics import get_ranking_metrics, get_metric_arrays
+
+
+N_STEPS, N_TARGETS, N_CELLS = 4, 3, 200
+
+
+@pytest.fixture
+def evaluation_arrays():
+    """
+    Fixture to create observed values and predictions of shape steps x targets x cells.
+    The probabilities are rounded to one decimal so there are many tied scores, and target 2 of step 0 is all zero.
+    """
+    rng = np.random.default_rng(0)
+    y_true = rng.lognormal(size=(N_STEPS, N_TARGETS, N_CELLS)) * (rng.uniform(size=(N_STEPS, N_TARGETS, N_CELLS)) < 0.2)
+    y_true[0, 2] = 0
+    y_score = rng.lognormal(size=(N_STEPS, N_TARGETS, N_CELLS))
+    y_score_prob = np.round(np.clip((y_true > 0) * 0.3 + rng.uniform(size=(N_STEPS, N_TARGETS, N_CELLS)) * 0.7, 0, 1), 1)
+
+    return y_true, y_score, y_score_prob
+
+
+def test_get_metric_arrays_matches_sklearn(evaluation_arrays):
+    """
+    Test that the vectorized metrics match sklearn per step and target, with tied scores, and that AP and AUC are NaN for a target with no events.
+    """
+    y_true, y_score, y_score_prob = evaluation_arrays
+    metric_arrays = get_metric_arrays(y_true, y_score, y_score_prob)
+
+    for metric_array in metric_arrays.values():
+        assert metric_array.shape == (N_STEPS, N_TARGETS)
+
+    for t in range(N_STEPS):
+        for i in range(N_TARGETS):
+            y_true_binary = (y_true[t, i] > 0) * 1
+
+            np.testing.assert_allclose(metric_arrays['MSE'][t, i], mean_squared_error(y_true[t, i], y_score[t, i]))
+            np.testing.assert_allclose(metric_arrays['Brier'][t, i], brier_score_loss(y_true_binary, y_score_prob[t, i]))
+
+            if y_true_binary.sum() == 0:
+                assert np.isnan(metric_arrays['AP'][t, i])
+                assert np.isnan(metric_arrays['AUC'][t, i])
+                continue
+
+            np.testing.assert_allclose(metric_arrays['AP'][t, i], average_precision_score(y_true_binary, y_score_prob[t, i]), err_msg=f'AP step {t} target {i}')
+            np.testing.assert_allclose(metric_arrays['AUC'][t, i], roc_auc_score(y_true_binary, y_score_prob[t, i]), err_msg=f'AUC step {t} target {i}')
+
+
+def test_get_ranking_metrics_single_class():
+    """
+    Test that a slice with only positives gets an AP (all precisions are 1) but no AUC.
+    """
+    ap, auc = get_ranking_metrics(np.ones((1, 5), dtype=int), np.array([[0.1, 0.5, 0.5, 0.9, 0.2]]))
+
+    np.testing.assert_allclose(ap, [1.0])
+    assert np.isnan(auc).all()
@@ -0,0 +1,101 @@
+import pytest
+import numpy as np
+import sys
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_UTILS = PATH_ROOT / 'models' / 'purple_alien' / 'src' / 'utils'
+    if not PATH_UTILS.exists():
+        raise ValueError("The 'models/purple_alien/src/utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_UTILS))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from utils_posterior import P2Quantile, PosteriorAggregator
+
+
+BATCH_SIZE = 7
+GRID_SHAPE = (2, 3, 4, 5) # months x features x height x width
+
+
+@pytest.fixture
+def samples():
+    """
+    Fixture to create 2000 posterior samples of magnitudes and probabilities. 2000 is not a multiple of BATCH_SIZE, so the last batch is smaller.
+    """
+    rng = np.random.default_rng(0)
+    pred = rng.lognormal(mean=0.0, sigma=0.5, size=(2000,) + GRID_SHAPE).astype(np.float32)
+    pred_class = rng.uniform(size=(2000,) + GRID_SHAPE).astype(np.float32)
+
+    return pred, pred_class
+
+
+def aggregate(pred, pred_class, **kwargs):
+    """
+    Feeds the samples to a PosteriorAggregator in batches of BATCH_SIZE.
+    """
+    aggregator = PosteriorAggregator(**kwargs)
+
+    for i in range(0, pred.shape[0], BATCH_SIZE):
+        aggregator.update(pred[i:i + BATCH_SIZE], pred_class[i:i + BATCH_SIZE])
+
+    return aggregator
+
+
+def test_posterior_aggregator_moments(samples):
+    """
+    Test that the streamed mean and std match numpy on the materialized samples.
+    """
+    pred, pred_class = samples
+    aggregator = aggregate(pred, pred_class)
+
+    assert aggregator.count == pred.shape[0]
+    np.testing.assert_allclose(aggregator.mean, pred.astype(np.float64).mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(aggregator.std, pred.astype(np.float64).std(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(aggregator.mean_class, pred_class.astype(np.float64).mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(aggregator.std_class, pred_class.astype(np.float64).std(axis=0), rtol=1e-10)
+
+
+def test_posterior_aggregator_cells(samples):
+    """
+    Test that with a land cell index only those cells are aggregated, in the order of the index.
+    """
+    pred, pred_class = samples
+    cells = np.array([19, 0, 7, 12])
+    aggregator = aggregate(pred, pred_class, cells=cells)
+
+    expected = pred.reshape(pred.shape[:3] + (-1,))[..., cells].astype(np.float64)
+    assert aggregator.mean.shape == GRID_SHAPE[:2] + (len(cells),)
+    np.testing.assert_allclose(aggregator.mean, expected.mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(aggregator.std, expected.std(axis=0), rtol=1e-10)
+
+
+def test_posterior_aggregator_quantiles(samples):
+    """
+    Test that the P² estimates of the quantiles are close to numpy's quantiles of the materialized samples.
+    """
+    pred, pred_class = samples
+    quantiles = [0.05, 0.5, 0.95]
+    aggregator = aggregate(pred, pred_class, quantiles=quantiles)
+
+    for p in quantiles:
+        np.testing.assert_allclose(aggregator.get_quantile(p), np.quantile(pred, p, axis=0), rtol=0.1, err_msg=f'quantile {p}')
+
+    posterior_dict = aggregator.to_dict()
+    assert posterior_dict['n_samples'] == pred.shape[0]
+    assert set(posterior_dict['quantile_arrays']) == set(quantiles)
+
+
+def test_p2_quantile_exact_below_five_samples(samples):
+    """
+    Test that P2Quantile returns the exact quantile until the markers are initialized.
+    """
+    pred, _ = samples
+    sketch = P2Quantile(0.5)
+
+    for sample in pred[:4]:
+        sketch.update(sample)
+
+    np.testing.assert_allclose(sketch.value(), np.quantile(pred[:4], 0.5, axis=0), rtol=1e-6)
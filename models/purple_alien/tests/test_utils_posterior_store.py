@@ -0,0 +1,87 @@
+import pytest
+import numpy as np
+import sys
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_UTILS = PATH_ROOT / 'models' / 'purple_alien' / 'src' / 'utils'
+    if not PATH_UTILS.exists():
+        raise ValueError("The 'models/purple_alien/src/utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_UTILS))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from utils_posterior_store import PosteriorStoreWriter, PosteriorStore
+
+
+N_SAMPLES = 10
+N_STEPS = 3
+HEIGHT, WIDTH = 4, 5
+
+
+@pytest.fixture
+def posterior():
+    """
+    Fixture to create the land cell index and posterior samples of the land cells (samples x steps x features x cells) on a 4x5 grid.
+    """
+    rng = np.random.default_rng(0)
+    cells = np.array([1, 4, 7, 8, 15, 19])
+    pg_id = cells + 1000
+    pred = rng.lognormal(size=(N_SAMPLES, N_STEPS, 3, len(cells))).astype(np.float32)
+    pred_class = rng.uniform(size=(N_SAMPLES, N_STEPS, 3, len(cells))).astype(np.float32)
+    observed = rng.uniform(size=(1, N_STEPS, 3, HEIGHT, WIDTH)).astype(np.float32)
+
+    return cells, pg_id, pred, pred_class, observed
+
+
+@pytest.mark.parametrize("dtype", ['float16', 'float32'])
+@pytest.mark.parametrize("compression", [False, True])
+def test_posterior_store_round_trip(tmp_path, posterior, dtype, compression):
+    """
+    Test that samples written in uneven batches are read back in the stored dtype, with the land cell index and the observed values.
+    """
+    cells, pg_id, pred, pred_class, observed = posterior
+
+    writer = PosteriorStoreWriter(tmp_path / 'store', N_SAMPLES, N_STEPS, cells, pg_id, observed=observed, dtype=dtype, compression=compression)
+    for first_sample in range(0, N_SAMPLES, 4): # the last batch has 2 samples
+        writer.write(first_sample, pred[first_sample:first_sample + 4], pred_class[first_sample:first_sample + 4])
+    writer.close()
+
+    assert sorted(p.suffix for p in (tmp_path / 'store' / 'magnitudes').iterdir()) == ['.npz' if compression else '.npy'] * N_STEPS * 3
+
+    store = PosteriorStore(tmp_path / 'store')
+    np.testing.assert_array_equal(store.cells, cells)
+    np.testing.assert_array_equal(store.pg_id, pg_id)
+
+    magnitudes = store.load('magnitudes')
+    assert magnitudes.dtype == np.dtype(dtype)
+    np.testing.assert_array_equal(magnitudes, pred.astype(dtype))
+    np.testing.assert_array_equal(store.load('probabilities'), pred_class.astype(dtype))
+
+    # a slice of steps, features and samples
+    np.testing.assert_array_equal(store.load('magnitudes', steps=[2], features=['os'], samples=[3, 9]), pred[[3, 9]][:, [1]][:, :, [2]].astype(dtype))
+
+    np.testing.assert_array_equal(store.load_observed(), observed.reshape(N_STEPS, 3, -1)[:, :, cells])
+
+    grid = store.to_grid(store.load_observed(), height=HEIGHT, width=WIDTH)
+    land = np.zeros(HEIGHT * WIDTH, dtype=bool)
+    land[cells] = True
+    np.testing.assert_array_equal(grid.reshape(N_STEPS, 3, -1)[..., land], observed.reshape(N_STEPS, 3, -1)[..., land])
+    assert np.isnan(grid.reshape(N_STEPS, 3, -1)[..., ~land]).all()
+
+
+def test_posterior_store_incomplete(tmp_path, posterior):
+    """
+    Test that a store whose writer was never closed is not read.
+    """
+    cells, pg_id, pred, pred_class, _ = posterior
+
+    writer = PosteriorStoreWriter(tmp_path / 'store', N_SAMPLES, N_STEPS, cells, pg_id)
+    writer.write(0, pred, pred_class)
+
+    with pytest.raises(ValueError):
+        PosteriorStore(tmp_path / 'store')
+
+    writer.close()
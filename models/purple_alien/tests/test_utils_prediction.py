@@ -0,0 +1,73 @@
+import pytest
+import numpy as np
+import torch
+import sys
+from types import SimpleNamespace
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_UTILS = PATH_ROOT / 'models' / 'purple_alien' / 'src' / 'utils'
+    if not PATH_UTILS.exists():
+        raise ValueError("The 'models/purple_alien/src/utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_UTILS))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+from utils_prediction import iter_posterior_batches
+from utils import get_full_tensor
+from config_hyperparameters import get_hp_config
+from HydraBNrecurrentUnet_06_LSTM4 import HydraBNUNet06_LSTM4
+
+
+@pytest.fixture
+def views_vol(tmp_path):
+    """
+    Fixture to create a memory-mapped volume of 5 months (months x 180 x 180 x 8), as get_data loads it.
+    """
+    rng = np.random.default_rng(0)
+    vol = ((rng.random((5, 180, 180, 8)) > 0.9) * rng.random((5, 180, 180, 8)) * 5).astype(np.float32)
+    np.save(tmp_path / 'vol.npy', vol)
+
+    return np.load(tmp_path / 'vol.npy', mmap_mode='r')
+
+
+@pytest.fixture
+def one_thread():
+    """
+    Fixture to run the test with one torch thread, as each posterior worker does by default (posterior_worker_threads).
+    """
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    yield
+    torch.set_num_threads(num_threads)
+
+
+def draw_posterior(views_vol, posterior_mode, posterior_workers):
+    """
+    Draws 5 posterior samples in batches of 2 (so the last batch is smaller) with a small HydraNet, and returns them as one array.
+    """
+    torch.manual_seed(0)
+    model = HydraBNUNet06_LSTM4(input_channels=3, total_hidden_channels=8, output_channels=1, dropout_rate=0.125)
+
+    config = get_hp_config()
+    config.update(input_channels=3, time_steps=2, test_samples=5, posterior_batch_size=2, freeze_h='random', warmup_passes=2,
+                  posterior_workers=posterior_workers, posterior_worker_threads=1)
+    config = SimpleNamespace(**config)
+
+    full_tensor, _ = get_full_tensor(views_vol, config)
+    batches = iter_posterior_batches(model, full_tensor, config, 'cpu', posterior_mode=posterior_mode, views_vol=views_vol)
+
+    return np.concatenate([np.concatenate([pred_array, pred_class_array], axis=2) for pred_array, pred_class_array in batches])
+
+
+@pytest.mark.parametrize("posterior_mode", ['full_replay', 'shared_warmup'])
+def test_posterior_independent_of_workers(views_vol, one_thread, posterior_mode):
+    """
+    Test that the posterior drawn in this process is the same as the one drawn by 2 worker processes.
+    """
+    posterior = draw_posterior(views_vol, posterior_mode, posterior_workers=0)
+
+    assert posterior.shape == (5, 2, 6, 180, 180)
+    np.testing.assert_array_equal(draw_posterior(views_vol, posterior_mode, posterior_workers=2), posterior)
@@ -0,0 +1,76 @@
+import pytest
+import json
+import time
+import sys
+from types import SimpleNamespace
+from pathlib import Path
+
+PATH = Path(__file__)
+if 'views_pipeline' in PATH.parts:
+    PATH_ROOT = Path(*PATH.parts[:PATH.parts.index('views_pipeline') + 1])
+    PATH_UTILS = PATH_ROOT / 'models' / 'purple_alien' / 'src' / 'utils'
+    if not PATH_UTILS.exists():
+        raise ValueError("The 'models/purple_alien/src/utils' directory was not found in the provided path.")
+    sys.path.insert(0, str(PATH_UTILS))
+else:
+    raise ValueError("The 'views_pipeline' directory was not found in the provided path.")
+
+import utils_timing
+from utils_timing import PhaseTimer, summarize_timing
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Fixture to replace the clock of utils_timing with one that only moves when the test advances it.
+    """
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(utils_timing, 'time', SimpleNamespace(perf_counter=lambda: clock.now, time=time.time, strftime=time.strftime))
+
+    return clock
+
+
+def test_phase_timer_flush_and_summarize(tmp_path, clock):
+    """
+    Test that flush writes the seconds and calls of two phases per step, and that summarize_timing adds them up per stage and phase.
+    """
+    timer = PhaseTimer()
+    timer.setup(tmp_path / 'timing.jsonl')
+
+    for step in range(2):
+        with timer.phase('forward'):
+            clock.now += 1.0
+        with timer.phase('backward'):
+            clock.now += 3.0
+        with timer.phase('forward'):
+            clock.now += 1.0
+        timer.flush('train', step)
+
+    with open(tmp_path / 'timing.jsonl') as f:
+        records = [json.loads(line) for line in f]
+
+    assert [record['step'] for record in records] == [0, 1]
+    assert records[0]['seconds'] == {'forward': 2.0, 'backward': 3.0}
+    assert records[0]['calls'] == {'forward': 2, 'backward': 1}
+    assert records[0]['total_seconds'] == 5.0
+
+    df_summary = summarize_timing(tmp_path / 'timing.jsonl').set_index('phase')
+
+    assert df_summary.loc['forward', 'total_seconds'] == 4.0
+    assert df_summary.loc['backward', 'mean_seconds'] == 3.0
+    assert df_summary.loc['backward', 'steps'] == 2
+    assert df_summary.loc['forward', 'share'] == pytest.approx(0.4)
+
+
+def test_phase_timer_disabled(tmp_path):
+    """
+    Test that a timer that was never set up counts and writes nothing.
+    """
+    timer = PhaseTimer()
+
+    with timer.phase('forward'):
+        pass
+    timer.flush('train', 0)
+
+    assert dict(timer.seconds) == {}
+    assert list(tmp_path.iterdir()) == []
@@ -25,7 +25,7 @@ def initialize():
 
 
 @task(task_run_name="{name}")
-def run_model_script(script_path, name, run_type, sweep, train, evaluate, forecast, saved, override_month):
+def run_model_script(script_path, name, run_type, sweep, train, evaluate, forecast, saved, override_month, incremental, cache, compact):
     cli_args = []
     cli_args.append("--run_type")
     cli_args.append(run_type)
@@ -40,6 +40,12 @@ def run_model_script(script_path, name, run_type, sweep, train, evaluate, foreca
         cli_args.append("--forecast")
     if saved:
         cli_args.append("--saved")
+    if incremental:
+        cli_args.append("--incremental")
+    if cache:
+        cli_args.append("--cache")
+    if compact:
+        cli_args.append("--compact")
     if override_month:
         cli_args.extend(["--override_month", int(override_month)])
 
@@ -77,7 +83,7 @@ def run_ensemble_script(script_path, name, run_type, train, evaluate, forecast):
 
 
 @flow(log_prints=True)
-def model_execution_flow(run_type, sweep, train, evaluate, forecast, ensemble, saved, override_month):
+def model_execution_flow(run_type, sweep, train, evaluate, forecast, ensemble, saved, override_month, incremental, cache, compact):
     model_main_files, ensemble_main_files = initialize()
     if not ensemble:
         for main_file in model_main_files:
@@ -86,7 +92,7 @@ def model_execution_flow(run_type, sweep, train, evaluate, forecast, ensemble, s
                 continue
             run_model_script(main_file, main_file.parent.name,
                              run_type, sweep, train, evaluate, forecast,
-                             saved, override_month)
+                             saved, override_month, incremental, cache, compact)
     else:
         for ensemble_file in ensemble_main_files:
             run_ensemble_script(ensemble_file, ensemble_file.parent.name, run_type, train, evaluate, forecast)
@@ -103,4 +109,7 @@ if __name__ == "__main__":
                          forecast=args.forecast,
                          ensemble=args.ensemble,
                          saved=args.saved,
-                         override_month=args.override_month)
+                         override_month=args.override_month,
+                         incremental=args.incremental,
+                         cache=args.cache,
+                         compact=args.compact)